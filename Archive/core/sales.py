@@ -5,6 +5,11 @@ def aggregate_sales(df):
     by_make_model = df.groupby(['make', 'model', 'inventory_type'])['vin'].nunique().reset_index(name='sales_count')
     return total, by_make_model
 
+# Strip/lowercase each distinct value once and map the results back onto the rows
+def normalize_names(values):
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return pd.Series(pd.Index(uniques).astype(str).str.strip().str.lower().take(codes), index=values.index)
+
 def precompute_dealer_stats(df):
     # Ensure status_date is datetime
     df['status_date'] = pd.to_datetime(df['status_date'], errors='coerce')
@@ -20,9 +25,9 @@ def precompute_dealer_stats(df):
     # Normalize types before groupby
     df['mc_dealer_id'] = pd.to_numeric(df['mc_dealer_id'], errors='coerce').astype(int)
     df['period_start'] = pd.to_datetime(df['status_date']).dt.to_period('M').dt.to_timestamp()
-    df['make'] = df['make'].astype(str).str.strip().str.lower()
-    df['model'] = df['model'].astype(str).str.strip().str.lower()
-    df['inventory_type'] = df['inventory_type'].astype(str).str.strip().str.lower()
+    df['make'] = normalize_names(df['make'])
+    df['model'] = normalize_names(df['model'])
+    df['inventory_type'] = normalize_names(df['inventory_type'])
 
     # Dealer sales summary: count all rows (not just unique VINs)
     summary = df.groupby(['mc_dealer_id', 'period_start'], as_index=False).agg(
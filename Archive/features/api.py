@@ -29,6 +29,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+_dealer_dim = None  # (raw_df it was built from, dimension)
+
+def get_dealer_dim(raw_df):
+    """Dealer dimension sorted by mc_dealer_id, built from raw_df (the rows summary_df was loaded with,
+    from the database or the CSV fallback) and reused while the same raw_df is passed"""
+    global _dealer_dim
+    if _dealer_dim is None or _dealer_dim[0] is not raw_df:
+        dim = raw_df.groupby('mc_dealer_id').agg({
+            'seller_name': 'first',
+            'city': 'first',
+            'state': 'first',
+            'zip': 'first'
+        }).reset_index()
+        dim['mc_dealer_id'] = pd.to_numeric(dim['mc_dealer_id'], errors='coerce')
+        dim = dim.dropna(subset=['mc_dealer_id'])
+        dim['mc_dealer_id'] = dim['mc_dealer_id'].astype('int64')
+        _dealer_dim = (raw_df, dim.sort_values('mc_dealer_id').reset_index(drop=True))
+    return _dealer_dim[1]
+
+def lookup_dealer(dealer_dim, dealer_id):
+    """Dealer row by integer ID (binary search on the sorted dimension), or None"""
+    ids = dealer_dim['mc_dealer_id'].to_numpy()
+    pos = ids.searchsorted(int(dealer_id))
+    if pos < len(ids) and ids[pos] == int(dealer_id):
+        return dealer_dim.iloc[pos]
+    return None
+
 def get_db_data():
     """Get data from database or fallback to CSV"""
     try:
@@ -84,12 +111,7 @@ async def get_dealers(
     summary_df, _, raw_df = get_db_data()
     
     # Merge with dealer info
-    dealer_info = raw_df.groupby('mc_dealer_id').agg({
-        'seller_name': 'first',
-        'city': 'first',
-        'state': 'first',
-        'zip': 'first'
-    }).reset_index()
+    dealer_info = get_dealer_dim(raw_df)[['mc_dealer_id', 'seller_name', 'city', 'state', 'zip']]
     
     dealer_data = dealer_info.merge(
         summary_df.groupby('dealer_id')['total_sales'].sum().reset_index(),
@@ -122,12 +144,10 @@ async def get_dealer_info(dealer_id: str):
     summary_df, _, raw_df = get_db_data()
     
     # Get dealer info
-    dealer_info = raw_df[raw_df['mc_dealer_id'] == int(dealer_id)]
-    if dealer_info.empty:
+    dealer_data = lookup_dealer(get_dealer_dim(raw_df), dealer_id)
+    if dealer_data is None:
         raise HTTPException(status_code=404, detail="Dealer not found")
     
-    dealer_data = dealer_info.iloc[0]
-    
     # Get sales summary
     dealer_summary = summary_df[summary_df['dealer_id'] == int(dealer_id)]
     
@@ -208,18 +228,19 @@ async def get_dealer_competitors(
     summary_df, _, raw_df = get_db_data()
     
     # Get dealer location
-    dealer_location = raw_df[raw_df['mc_dealer_id'] == int(dealer_id)]
-    if dealer_location.empty:
+    dealer_dim = get_dealer_dim(raw_df)
+    dealer_location = lookup_dealer(dealer_dim, dealer_id)
+    if dealer_location is None:
         raise HTTPException(status_code=404, detail="Dealer not found")
     
-    dealer_city = dealer_location.iloc[0]['city']
-    dealer_state = dealer_location.iloc[0]['state']
+    dealer_city = dealer_location['city']
+    dealer_state = dealer_location['state']
     
     # Find nearby dealers (same city/state for now, can be enhanced with lat/lng)
-    nearby_dealers = raw_df[
-        (raw_df['city'] == dealer_city) & 
-        (raw_df['state'] == dealer_state) & 
-        (raw_df['mc_dealer_id'] != int(dealer_id))
+    nearby_dealers = dealer_dim[
+        (dealer_dim['city'] == dealer_city) & 
+        (dealer_dim['state'] == dealer_state) & 
+        (dealer_dim['mc_dealer_id'] != int(dealer_id))
     ]['mc_dealer_id'].unique()
     
     if len(nearby_dealers) == 0:
@@ -243,7 +264,7 @@ async def get_dealer_competitors(
     
     competitors = []
     for comp_id, sales in top_competitors.items():
-        comp_info = raw_df[raw_df['mc_dealer_id'] == comp_id].iloc[0]
+        comp_info = lookup_dealer(dealer_dim, comp_id)
         competitors.append({
             "dealer_id": comp_id,
             "name": comp_info['seller_name'],
@@ -270,7 +291,7 @@ async def get_market_overview(
     
     # Apply location filters
     if state or city:
-        location_filter = raw_df.copy()
+        location_filter = get_dealer_dim(raw_df)
         if state:
             location_filter = location_filter[location_filter['state'] == state]
         if city:
@@ -313,20 +334,16 @@ async def get_top_dealers(
     top_dealers = dealer_ranking.sort_values(ascending=False).head(limit)
     
     # Get dealer info
-    dealer_info = raw_df.groupby('mc_dealer_id').agg({
-        'seller_name': 'first',
-        'city': 'first',
-        'state': 'first'
-    }).reset_index()
+    dealer_dim = get_dealer_dim(raw_df)
     
     result = []
     for dealer_id, sales in top_dealers.items():
-        dealer_data = dealer_info[dealer_info['mc_dealer_id'] == int(dealer_id)]
-        if not dealer_data.empty:
+        dealer_data = lookup_dealer(dealer_dim, dealer_id)
+        if dealer_data is not None:
             result.append({
                 "dealer_id": dealer_id,
-                "name": dealer_data.iloc[0]['seller_name'],
-                "location": f"{dealer_data.iloc[0]['city']}, {dealer_data.iloc[0]['state']}",
+                "name": dealer_data['seller_name'],
+                "location": f"{dealer_data['city']}, {dealer_data['state']}",
                 "sales": int(sales)
             })
     
@@ -8,9 +8,11 @@ from sklearn.cluster import KMeans
 import json
 import warnings
 warnings.filterwarnings('ignore')
-from geopy.distance import geodesic
 from datetime import datetime, timedelta
 import streamlit as st
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from core.geo import within_radius
 
 class CompetitorAnalyzer:
     def __init__(self):
@@ -49,24 +51,15 @@ class CompetitorAnalyzer:
             
         self.radius_miles = radius_miles
         
-        # Clean coordinate data
-        df = self.data.copy()
-        df = df.dropna(subset=['latitude', 'longitude'])
-        
-        # Calculate distances
-        target_coords = (self.target_location['lat'], self.target_location['lon'])
-        
-        def calculate_distance(row):
-            try:
-                dealer_coords = (row['latitude'], row['longitude'])
-                return geodesic(target_coords, dealer_coords).miles
-            except:
-                return float('inf')
-        
-        df['distance_miles'] = df.apply(calculate_distance, axis=1)
+        # Vectorized great-circle distances (bounding-box prefilter, then haversine on the candidates only);
+        # unparseable or missing coordinates never match
+        lats = pd.to_numeric(self.data['latitude'], errors='coerce')
+        lons = pd.to_numeric(self.data['longitude'], errors='coerce')
+        rows, distances = within_radius(lats, lons, self.target_location['lat'], self.target_location['lon'], radius_miles)
         
         # Filter by radius
-        competitors = df[df['distance_miles'] <= radius_miles].copy()
+        competitors = self.data.iloc[rows].copy()
+        competitors['distance_miles'] = distances
         
         print(f"🔍 Found {len(competitors)} vehicles from competitors within {radius_miles} miles")
         return competitors
@@ -7,6 +7,9 @@ import warnings
 warnings.filterwarnings('ignore')
 from datetime import datetime
 import math
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.geo import within_radius
 
 class SimpleCompetitorAnalyzer:
     def __init__(self):
@@ -62,21 +65,15 @@ class SimpleCompetitorAnalyzer:
             
         self.radius_miles = radius_miles
         
-        # Clean coordinate data
-        df = self.data.copy()
-        df = df.dropna(subset=['latitude', 'longitude'])
-        
-        # Calculate distances
-        target_lat = self.target_location['lat']
-        target_lon = self.target_location['lon']
-        
-        def calc_dist(row):
-            return self.calculate_distance(target_lat, target_lon, row['latitude'], row['longitude'])
-        
-        df['distance_miles'] = df.apply(calc_dist, axis=1)
+        # Vectorized distances (bounding-box prefilter, then haversine on the candidates only);
+        # unparseable or missing coordinates never match
+        lats = pd.to_numeric(self.data['latitude'], errors='coerce')
+        lons = pd.to_numeric(self.data['longitude'], errors='coerce')
+        rows, distances = within_radius(lats, lons, self.target_location['lat'], self.target_location['lon'], radius_miles)
         
         # Filter by radius
-        competitors = df[df['distance_miles'] <= radius_miles].copy()
+        competitors = self.data.iloc[rows].copy()
+        competitors['distance_miles'] = distances
         
         print(f"🔍 Found {len(competitors)} vehicles from competitors within {radius_miles} miles")
         return competitors
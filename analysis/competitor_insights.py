@@ -1,56 +1,57 @@
 import pandas as pd
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.postings import load_postings, lookup, rows_in_range, sold_row_range, count_by_dealer
+from core.make_model_dictionary import load_make_model_dictionary, lookup_make_model_id
+from core.dealer_index import load_dealer_index, dealers_within, zip_location, empty_result
+from core.dealers import load_dealers, join_dealers
 
-SUMMARY_PATH = "state/dealer_sales_summary.parquet"
-BY_MODEL_PATH = "state/dealer_sales_by_model.parquet"
-RAW_PATH = "state/main_record.parquet"  # For dealer info lookup
+# Dealers within radius_miles of the target zip (centroid of the zip's dealers), with their distance.
+# Uses the spatial index the ETL writes (core/dealer_index.py).
+def dealers_in_radius(dealer_index, target_zip, radius_miles=25):
+    center = zip_location(dealer_index, target_zip)
+    if center is None:
+        print(f"[ANALYSIS] No dealers with a location in zip {target_zip}.")
+        return empty_result()
+    return dealers_within(dealer_index, *center, radius_miles)
 
-# Simple zip code group filter (can be replaced with radius logic)
-def dealers_in_zip_group(raw_df, target_zip, zip_group=0):
-    # For now, just match zip exactly or within +/- zip_group
-    return raw_df[(raw_df['zip'] >= target_zip - zip_group) & (raw_df['zip'] <= target_zip + zip_group)]['mc_dealer_id'].unique()
-
-def competitor_analysis(make, model, target_zip, client_dealer_id, zip_group=0):
-    print("[ANALYSIS] Loading summary and raw data...")
-    if not os.path.exists(BY_MODEL_PATH) or not os.path.exists(RAW_PATH):
-        print("Required summary or raw file not found.")
+# start_date/end_date restrict sales to a sold_date range. Inventory and sales come from the posting-list
+# indexes the ETL writes (core/postings.py): the make/model is resolved to its make_model_id in the
+# make/model dictionary, and that ID's postings are counted against the postings of the dealers in the
+# area, so only matching rows are read.
+def competitor_analysis(make, model, target_zip, client_dealer_id, radius_miles=25, start_date=None, end_date=None):
+    print("[ANALYSIS] Loading postings and dealer tables...")
+    main_postings = load_postings('main')
+    sold_postings = load_postings('sold')
+    dealer_index = load_dealer_index()
+    dealer_dim = load_dealers()
+    if main_postings is None or sold_postings is None or dealer_index is None or dealer_dim is None:
+        print("Required postings or dealer tables not found.")
         return
-    by_model = pd.read_parquet(BY_MODEL_PATH)
-    raw_df = pd.read_parquet(RAW_PATH)
-    print(f"[ANALYSIS] Loaded by_model rows: {len(by_model)}, raw_df rows: {len(raw_df)}")
-    # Deduplicate
-    by_model = by_model.drop_duplicates(['mc_dealer_id', 'neo_make', 'neo_model'], keep='first')
-    raw_df = raw_df.drop_duplicates('vin', keep='first')
-    # Find dealers in zip group
-    dealers = dealers_in_zip_group(raw_df, target_zip, zip_group)
-    print(f"[ANALYSIS] Dealers in zip group: {len(dealers)}")
-    # Filter by make/model and dealers in area (sold)
-    # Use neo_make, neo_model, neo_year for filtering
-    filtered = by_model[(by_model['neo_make'].str.lower() == make.lower()) &
-                        (by_model['neo_model'].str.lower() == model.lower()) &
-                        (by_model['mc_dealer_id'].isin(dealers))]
-    print(f"[ANALYSIS] Filtered by_model rows: {len(filtered)}")
-    # Inventory for make/model by dealer
-    inv = raw_df[(raw_df['neo_make'].str.lower() == make.lower()) &
-                 (raw_df['neo_model'].str.lower() == model.lower()) &
-                 (raw_df['mc_dealer_id'].isin(dealers))]
-    print(f"[ANALYSIS] Filtered inventory rows: {len(inv)}")
-    inv_counts = inv.groupby('mc_dealer_id').size().reset_index(name='current_inventory')
-    # Dealer info lookup (enriched)
-    dealer_info_cols = ['mc_dealer_id', 'seller_name', 'city', 'state', 'zip']
-    for col in [
-        'mc_dealership_group_name', 'dealer_type', 'source',
-        'latitude', 'longitude', 'seller_phone', 'seller_email',
-        'car_seller_name', 'car_address', 'photo_links']:
-        if col in raw_df.columns:
-            dealer_info_cols.append(col)
-    dealer_info = raw_df.drop_duplicates('mc_dealer_id')[dealer_info_cols]
-    merged = filtered.merge(dealer_info, on='mc_dealer_id', how='left').merge(inv_counts, on='mc_dealer_id', how='left')
+    # Find dealers in radius
+    area = dealers_in_radius(dealer_index, target_zip, radius_miles)
+    dealers = area['mc_dealer_id']
+    print(f"[ANALYSIS] Dealers within {radius_miles} miles: {len(dealers)}")
+    # Rows of the make/model (the dictionary matches it case-insensitively), sales restricted to the period
+    make_model_id = lookup_make_model_id(make, model, load_make_model_dictionary())
+    keys = [make_model_id] if make_model_id is not None else []
+    inv_rows = lookup(main_postings, 'make_model', keys)
+    sold_rows = rows_in_range(lookup(sold_postings, 'make_model', keys), *sold_row_range(sold_postings, start_date, end_date))
+    print(f"[ANALYSIS] Matching inventory rows: {len(inv_rows)}, sold rows: {len(sold_rows)}")
+    # Dealers in the area that sold the make/model, with their inventory of it
+    sales = count_by_dealer(sold_postings, sold_rows, dealers)
+    filtered = sales[sales > 0].sort_index().rename('sales_count').reset_index()
+    print(f"[ANALYSIS] Dealers with sales: {len(filtered)}")
+    inv_counts = count_by_dealer(main_postings, inv_rows, filtered['mc_dealer_id']).rename('current_inventory').reset_index()
+    # Dealer info lookup (enriched) from the dealer dimension
+    merged = join_dealers(filtered, dealer_dim).merge(inv_counts, on='mc_dealer_id', how='left')
     merged['current_inventory'] = merged['current_inventory'].fillna(0).astype(int)
+    merged = merged.merge(area, on='mc_dealer_id', how='left')
     print(f"[ANALYSIS] Merged competitor analysis rows: {len(merged)}")
     # Show top competitors
-    print(f"\nDealers in zip group {target_zip} +/- {zip_group} who sold {make} {model}:")
-    display_cols = ['seller_name', 'city', 'state', 'zip', 'current_inventory', 'sales_count']
+    print(f"\nDealers within {radius_miles} miles of zip {target_zip} who sold {make} {model}:")
+    display_cols = ['seller_name', 'city', 'state', 'zip', 'distance_miles', 'current_inventory', 'sales_count']
     for col in [
         'mc_dealership_group_name', 'dealer_type', 'source',
         'latitude', 'longitude', 'seller_phone', 'seller_email',
@@ -75,8 +76,10 @@ def main():
     model = input("Enter model (e.g., Silverado 1500): ")
     target_zip = int(input("Enter target zip code: "))
     client_dealer_id = int(input("Enter your dealer_id: "))
-    zip_group = int(input("Enter zip code group/radius (e.g., 0 for exact, 10 for +/-10): "))
-    competitor_analysis(make, model, target_zip, client_dealer_id, zip_group)
+    radius_miles = float(input("Enter radius in miles (e.g., 25): ") or 25)
+    start_date = input("Sold from date (YYYY-MM-DD, blank for all): ").strip() or None
+    end_date = input("Sold to date (YYYY-MM-DD, blank for all): ").strip() or None
+    competitor_analysis(make, model, target_zip, client_dealer_id, radius_miles, start_date, end_date)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,29 +1,22 @@
-import pandas as pd
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.kpi_snapshot import load_kpi_snapshot, leaderboard, KPI_SNAPSHOT_PATH
 
-SUMMARY_PATH = "state/dealer_sales_summary.parquet"
-BY_MODEL_PATH = "state/dealer_sales_by_model.parquet"
-
-# Load summaries
-def load_summaries():
-    if not os.path.exists(SUMMARY_PATH):
-        print(f"Summary file not found: {SUMMARY_PATH}")
-        return None, None
-    summary = pd.read_parquet(SUMMARY_PATH)
-    by_model = pd.read_parquet(BY_MODEL_PATH) if os.path.exists(BY_MODEL_PATH) else None
-    return summary, by_model
-
-def print_top_dealers(summary, top_n=10):
+# Leaderboards come from the ETL's KPI snapshot (top_n is capped at its top_k)
+def print_top_dealers(snapshot, top_n=10, period="All Time", inventory_type="All"):
+    columns = {'key': 'mc_dealer_id', 'inventory': 'active_inventory', 'sales': 'total_sold'}
     print("\nTop Dealers by Total Sold:")
-    print(summary.sort_values('total_sold', ascending=False).head(top_n)[['mc_dealer_id', 'active_inventory', 'total_sold']])
+    print(leaderboard(snapshot, 'dealer', 'sales', period, inventory_type).head(top_n).rename(columns=columns))
     print("\nTop Dealers by Active Inventory:")
-    print(summary.sort_values('active_inventory', ascending=False).head(top_n)[['mc_dealer_id', 'active_inventory', 'total_sold']])
+    print(leaderboard(snapshot, 'dealer', 'inventory', period, inventory_type).head(top_n).rename(columns=columns))
 
 def main():
-    summary, by_model = load_summaries()
-    if summary is None:
+    snapshot = load_kpi_snapshot()
+    if snapshot is None:
+        print(f"KPI snapshot not found: {KPI_SNAPSHOT_PATH}")
         return
-    print_top_dealers(summary)
+    print_top_dealers(snapshot)
     # Add more business analysis as needed
 
 if __name__ == "__main__":
@@ -0,0 +1,31 @@
+import time
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.loader import load_inventory_csv, iter_csv_record_batches
+
+# Usage: python benchmarks/bench_csv_loader.py data/yourfile.csv
+# Reports MB/s of the pandas loader, the Arrow loader yielding pandas frames, and raw Arrow record batches.
+
+def run(label, path, iterator):
+    size_mb = os.path.getsize(path) / 1e6
+    t0 = time.time()
+    rows = 0
+    for chunk in iterator:
+        rows += chunk.num_rows if hasattr(chunk, 'num_rows') else len(chunk)
+    elapsed = time.time() - t0
+    print(f"[BENCH] {label:<22} {elapsed:7.2f}s  {size_mb / elapsed:8.1f} MB/s  rows: {rows}")
+    return elapsed
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python benchmarks/bench_csv_loader.py input.csv")
+        sys.exit(1)
+    path = sys.argv[1]
+    print(f"[BENCH] File: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    t_pandas = run("pandas (chunked)", path, load_inventory_csv(path, engine="pandas"))
+    t_arrow = run("arrow -> pandas", path, load_inventory_csv(path, engine="arrow"))
+    t_batches = run("arrow record batches", path, iter_csv_record_batches(path))
+    print(f"[BENCH] Speedup vs pandas: arrow->pandas {t_pandas / t_arrow:.1f}x, record batches {t_pandas / t_batches:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import time
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.sales_cube import cube_tables, query_sales, PERIODS
+from core.dealers import join_dealers
+from core.query_engine import build_query_index, run_query, result_frame, models_for_makes, page_positions
+
+# Usage: python benchmarks/bench_query_engine.py [listings] [sold] [queries] [skip_legacy]
+# Latency of dashboard filter interactions on a synthetic national dataset (default 5M listings,
+# 10M sold VINs over 24 months, 50k dealers): the query engine against the previous per-interaction
+# path (cube groupby + isin filters + main-record copy/groupby + merges).
+
+N_DEALERS = 50_000
+N_MAKES = 60
+MODELS_PER_MAKE = 20
+
+def synthetic_data(listings, sold, seed=0):
+    rng = np.random.default_rng(seed)
+    makes = np.array([f"Make{i:02d}" for i in range(N_MAKES)], dtype=object)
+    models = np.array([f"Model{i:04d}" for i in range(N_MAKES * MODELS_PER_MAKE)], dtype=object)
+    dealer_ids = np.sort(rng.choice(10_000_000, N_DEALERS, replace=False)).astype('int64')
+
+    def rows(n):
+        model = rng.zipf(1.3, n) % len(models)
+        return {
+            'mc_dealer_id': dealer_ids[rng.integers(0, N_DEALERS, n)],
+            'neo_make': pd.Categorical(makes[model // MODELS_PER_MAKE], categories=makes),
+            'neo_model': pd.Categorical(models[model], categories=models),
+            'make_id': (model // MODELS_PER_MAKE).astype(np.int32),
+            'model_id': model.astype(np.int32),
+        }
+    main_df = pd.DataFrame(rows(listings))
+    sold_df = pd.DataFrame(rows(sold))
+    sold_df['inventory_type'] = 'new'
+    sold_df['zip'] = rng.integers(10_000, 99_999, sold)
+    sold_df['sold_date'] = pd.Timestamp('2023-08-01') + pd.to_timedelta(rng.integers(0, 730, sold), unit='D')
+    dealer_dim = pd.DataFrame({
+        'mc_dealer_id': dealer_ids,
+        'seller_name': [f"Dealer {i}" for i in range(N_DEALERS)],
+        'city': 'City', 'state': 'ST', 'zip': rng.integers(10_000, 99_999, N_DEALERS),
+    })
+    # Make/model dictionary of the synthetic IDs (one spelling each)
+    dictionary = {
+        'makes': pd.DataFrame({'spelling': makes, 'key': makes, 'make_id': np.arange(len(makes), dtype=np.int32)}),
+        'models': pd.DataFrame({'spelling': models, 'key': models, 'model_id': np.arange(len(models), dtype=np.int32)}),
+    }
+    return main_df, cube_tables(sold_df), dealer_dim, dictionary
+
+def random_specs(index, dealer_dim, n, seed=1):
+    rng = np.random.default_rng(seed)
+    specs = []
+    for i in range(n):
+        makes = list(rng.choice(index['makes'], rng.integers(0, 3), replace=False))
+        models = models_for_makes(index, makes)
+        specs.append({
+            'period': PERIODS[i % len(PERIODS)],
+            'makes': makes,
+            'models': list(rng.choice(models, min(len(models), rng.integers(0, 3)), replace=False)) if i % 3 else [],
+            # A radius search returns a few hundred dealers
+            'area_dealers': pd.Series(rng.choice(dealer_dim['mc_dealer_id'], 300, replace=False)) if i % 2 else None,
+            'dealer': int(rng.choice(dealer_dim['mc_dealer_id'])),
+            'min_sales': 0, 'max_sales': 1_000_000, 'top_n': 10,
+        })
+    return specs
+
+def engine_query(index, dealer_dim, spec):
+    result = run_query(index, spec)
+    return result_frame(index, result, dealer_dim), result
+
+# "Show Top N: All", sorted by inventory, third page of 50
+def engine_page(index, dealer_dim, spec):
+    result = run_query(index, dict(spec, top_n=None))
+    positions = page_positions(index, result, 100, 150, 'current_inventory')
+    return result_frame(index, result, dealer_dim, positions)
+
+# The pre-engine dashboard path, as it ran on every interaction (the cube is keyed by make/model ID,
+# so selected names are translated through the dictionary first)
+def legacy_query(cube, main_df, dealer_dim, dictionary, spec):
+    filtered = query_sales(cube, ['mc_dealer_id', 'make_id', 'model_id'], spec['period'])
+    inv = main_df.copy()
+    if spec['makes']:
+        make_ids = dictionary['makes']['make_id'][dictionary['makes']['spelling'].isin(spec['makes'])]
+        filtered = filtered[filtered['make_id'].isin(make_ids)]
+        inv = inv[inv['neo_make'].isin(spec['makes'])]
+    if spec['models']:
+        model_ids = dictionary['models']['model_id'][dictionary['models']['spelling'].isin(spec['models'])]
+        filtered = filtered[filtered['model_id'].isin(model_ids)]
+        inv = inv[inv['neo_model'].isin(spec['models'])]
+    if spec['area_dealers'] is not None:
+        filtered = filtered[filtered['mc_dealer_id'].isin(spec['area_dealers'])]
+        inv = inv[inv['mc_dealer_id'].isin(spec['area_dealers'])]
+    filtered = filtered[(filtered['sales_count'] >= spec['min_sales']) & (filtered['sales_count'] <= spec['max_sales'])]
+    inv_counts = inv.groupby('mc_dealer_id').size().reset_index(name='current_inventory')
+    merged = join_dealers(filtered, dealer_dim).merge(inv_counts, on='mc_dealer_id', how='left')
+    merged['current_inventory'] = merged['current_inventory'].fillna(0).astype(int)
+    return merged.sort_values('sales_count', ascending=False).head(spec['top_n'])
+
+def timed(fn, specs):
+    latencies = []
+    for spec in specs:
+        t0 = time.time()
+        fn(spec)
+        latencies.append(time.time() - t0)
+    return np.percentile(latencies, 50) * 1e3, np.percentile(latencies, 95) * 1e3
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) >= 2 else 5_000_000
+    sold = int(sys.argv[2]) if len(sys.argv) >= 3 else 10_000_000
+    queries = int(sys.argv[3]) if len(sys.argv) >= 4 else 200
+    skip_legacy = len(sys.argv) >= 5 and sys.argv[4] == 'skip_legacy'
+    print(f"[BENCH] Building synthetic data: {listings} listings, {sold} sold VINs, {N_DEALERS} dealers")
+    main_df, cube, dealer_dim, dictionary = synthetic_data(listings, sold)
+    t0 = time.time()
+    index = build_query_index(main_df, cube, dictionary)
+    print(f"[BENCH] Query index build: {time.time() - t0:.2f}s")
+    specs = random_specs(index, dealer_dim, queries)
+    p50, p95 = timed(lambda spec: engine_query(index, dealer_dim, spec), specs)
+    print(f"[BENCH] Query engine: p50 {p50:.1f} ms, p95 {p95:.1f} ms over {queries} queries")
+    p50, p95 = timed(lambda spec: engine_page(index, dealer_dim, spec), specs)
+    print(f"[BENCH] Paged, sorted by inventory: p50 {p50:.1f} ms, p95 {p95:.1f} ms over {queries} queries")
+    if skip_legacy:
+        return
+    p50, p95 = timed(lambda spec: legacy_query(cube, main_df, dealer_dim, dictionary, spec), specs[:max(1, queries // 10)])
+    print(f"[BENCH] Legacy filters: p50 {p50:.1f} ms, p95 {p95:.1f} ms over {max(1, queries // 10)} queries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import time
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.main_record import update_main_record_chunk, deduplicate_by_vin
+
+# Usage: python benchmarks/bench_update_chunk.py [sizes] [legacy_sample]
+# Throughput of update_main_record_chunk at 10k, 100k and 1M overlapping VINs (comma-separated sizes).
+# The old per-VIN loop is timed on a sample of legacy_sample overlaps (default 2000) and extrapolated.
+
+def synthetic_pair(n_overlap, seed=0):
+    rng = np.random.default_rng(seed)
+    n_main = n_overlap * 2
+    vins = np.char.add('2T1BURHE', np.char.zfill(np.arange(n_main).astype(str), 9)).astype(object)
+    main_df = pd.DataFrame({
+        'vin': vins,
+        'mc_dealer_id': rng.integers(1, 50_000, n_main),
+        'price': rng.uniform(10_000, 80_000, n_main),
+        'status_date': pd.Timestamp('2025-07-01') + pd.to_timedelta(rng.integers(0, 20, n_main), unit='D'),
+    }).set_index('vin', drop=False)
+    today = pd.DataFrame({
+        'vin': vins[rng.choice(n_main, n_overlap, replace=False)],
+        'mc_dealer_id': rng.integers(1, 50_000, n_overlap),
+        'price': rng.uniform(10_000, 80_000, n_overlap),
+        'status_date': pd.Timestamp('2025-07-10') + pd.to_timedelta(rng.integers(0, 20, n_overlap), unit='D'),
+    })
+    return main_df, today
+
+# The pre-vectorization implementation, kept here only for comparison
+def legacy_update_main_record_chunk(main_df, today_chunk):
+    today_chunk = deduplicate_by_vin(today_chunk)
+    today_chunk = today_chunk.set_index('vin', drop=False)
+    overlap = main_df.index.intersection(today_chunk.index)
+    for vin in overlap:
+        main_date = pd.to_datetime(main_df.at[vin, 'status_date'], errors='coerce')
+        today_date = pd.to_datetime(today_chunk.at[vin, 'status_date'], errors='coerce')
+        if today_date > main_date:
+            main_df.loc[vin] = today_chunk.loc[vin]
+    return main_df
+
+def main():
+    sizes = [int(x) for x in sys.argv[1].split(',')] if len(sys.argv) >= 2 else [10_000, 100_000, 1_000_000]
+    legacy_sample = int(sys.argv[2]) if len(sys.argv) >= 3 else 2000
+    main_df, today = synthetic_pair(legacy_sample)
+    t0 = time.time()
+    legacy_update_main_record_chunk(main_df.copy(), today)
+    legacy_rate = legacy_sample / (time.time() - t0)
+    print(f"[BENCH] Legacy per-VIN loop: {legacy_rate:,.0f} VINs/s (measured on {legacy_sample} overlaps)")
+    for n in sizes:
+        main_df, today = synthetic_pair(n)
+        expected = legacy_update_main_record_chunk(main_df.copy(), today) if n <= legacy_sample else None
+        t0 = time.time()
+        result = update_main_record_chunk(main_df, today)
+        elapsed = time.time() - t0
+        line = f"[BENCH] {n:>9,} overlaps: {elapsed:.3f}s, {n / elapsed:,.0f} VINs/s, est. legacy {n / legacy_rate:,.1f}s"
+        if expected is not None:
+            line += f", matches legacy: {expected.sort_index().equals(result.sort_index())}"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import time
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.upsert import prepare_batch, upsert_sorted
+
+# Usage: python benchmarks/bench_upsert.py [main_vins] [feed_vins] [batches] [skip_legacy]
+# Compares the old per-batch concat/sort/drop_duplicates merge with the sort-merge upsert engine
+# on a synthetic main record (default 10M VINs, feed of 1M VINs in 10 batches).
+
+def synthetic_main(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vins = np.char.add('1FTFW1E5', np.char.zfill(np.arange(n).astype(str), 9))
+    df = pd.DataFrame({
+        'vin': vins.astype(object),
+        'mc_dealer_id': rng.integers(1, 50_000, n),
+        'price': rng.uniform(10_000, 80_000, n),
+        'status_date': pd.Timestamp('2025-07-01') + pd.to_timedelta(rng.integers(0, 20, n), unit='D'),
+    })
+    return df.sort_values('vin', kind='mergesort').reset_index(drop=True)
+
+def synthetic_feed(main_df, n, batches, seed=1):
+    rng = np.random.default_rng(seed)
+    # 80% updates to existing VINs, 20% brand-new VINs
+    n_old = int(n * 0.8)
+    old = main_df['vin'].to_numpy()[rng.choice(len(main_df), n_old, replace=False)]
+    new = np.char.add('5YJ3E1EA', np.char.zfill(np.arange(n - n_old).astype(str), 9)).astype(object)
+    vins = np.concatenate([old, new])
+    rng.shuffle(vins)
+    feed = pd.DataFrame({
+        'vin': vins,
+        'mc_dealer_id': rng.integers(1, 50_000, n),
+        'price': rng.uniform(10_000, 80_000, n),
+        'status_date': pd.Timestamp('2025-07-21') + pd.to_timedelta(rng.integers(0, 3, n), unit='D'),
+    })
+    bounds = np.linspace(0, n, batches + 1).astype(int)
+    return [feed.iloc[bounds[i]:bounds[i + 1]] for i in range(batches)]
+
+# The pre-engine path: every batch is concatenated with, and re-sorted together with, the whole main record
+def legacy_merge(main_df, batches):
+    for batch_df in batches:
+        batch_df = batch_df.sort_values(['vin', 'status_date'], ascending=[True, False]).drop_duplicates('vin', keep='first')
+        combined = pd.concat([main_df, batch_df], axis=0)
+        combined['status_date'] = pd.to_datetime(combined['status_date'], errors='coerce')
+        combined = combined.reset_index(drop=True)
+        combined = combined.sort_values(['vin', 'status_date'], ascending=[True, False])
+        main_df = combined.drop_duplicates('vin', keep='first')
+    return main_df
+
+def engine_merge(main_df, batches):
+    delta = None
+    for batch_df in batches:
+        batch_df = prepare_batch(batch_df)
+        delta = batch_df if delta is None else upsert_sorted(delta, batch_df)[0]
+    merged, _ = upsert_sorted(main_df, delta)
+    return merged
+
+# Regression check: null and blank VINs in a feed are dropped instead of breaking the sort-merge
+def check_missing_vins(main_df):
+    batch = main_df.head(5).copy()
+    batch['status_date'] = pd.Timestamp('2025-07-25')
+    batch.loc[batch.index[0], 'vin'] = np.nan
+    batch.loc[batch.index[1], 'vin'] = ''
+    batch.loc[batch.index[2], 'vin'] = '   '
+    merged = engine_merge(main_df, [batch, batch.iloc[:2]])
+    ok = len(merged) == len(main_df) and merged['vin'].notna().all() and merged['vin'].is_monotonic_increasing
+    print(f"[BENCH] Null/blank VIN rows dropped: {ok}")
+    return ok
+
+def main():
+    main_vins = int(sys.argv[1]) if len(sys.argv) >= 2 else 10_000_000
+    feed_vins = int(sys.argv[2]) if len(sys.argv) >= 3 else main_vins // 10
+    batches = int(sys.argv[3]) if len(sys.argv) >= 4 else 10
+    skip_legacy = len(sys.argv) >= 5 and sys.argv[4] == 'skip_legacy'
+    print(f"[BENCH] Building synthetic main record: {main_vins} VINs, feed: {feed_vins} VINs in {batches} batches")
+    main_df = synthetic_main(main_vins)
+    feed = synthetic_feed(main_df, feed_vins, batches)
+    check_missing_vins(main_df)
+    t0 = time.time()
+    merged = engine_merge(main_df, feed)
+    t_engine = time.time() - t0
+    print(f"[BENCH] Sort-merge upsert: {t_engine:.2f}s, rows: {len(merged)}")
+    if skip_legacy:
+        return
+    t0 = time.time()
+    legacy = legacy_merge(main_df, feed)
+    t_legacy = time.time() - t0
+    print(f"[BENCH] Legacy concat/sort:  {t_legacy:.2f}s, rows: {len(legacy)}")
+    print(f"[BENCH] Speedup: {t_legacy / t_engine:.1f}x")
+    legacy = legacy.sort_values('vin').reset_index(drop=True)
+    same = legacy['status_date'].equals(merged['status_date']) and legacy['vin'].equals(merged['vin'])
+    print(f"[BENCH] Results match: {same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import shutil
+import tempfile
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.config import ESSENTIAL_COLUMNS
+from core.main_record import MAIN_RECORD_PATH
+from core.partition_store import read_manifest
+import core.partition_store as partition_store
+import core.summarizer as summarizer
+import features.etl as etl
+
+# Usage: python benchmarks/check_summary_recovery.py [listings] [days]
+# Runs the daily ETL over synthetic feeds in a scratch directory and makes it die at the points where
+# the stores can fall out of step: after the main record's manifest is published but before its staged
+# partitions are moved into place, after the main and sold records (and the active VIN index) are
+# written but before the summary step, and half-way through writing the summary tables. After each
+# crash the next day's run must bring the summaries, by-model table and sales cube back in line with a
+# full rebuild (core/summarizer.verify_dealer_summaries), and every main record partition must hold
+# the rows its manifest entry says.
+
+MAKES = {'Toyota': ['Camry', 'RAV4'], 'Ford': ['F-150', 'Escape'], 'Honda': ['Civic', 'CR-V']}
+
+def synthetic_feed(vins, day, seed):
+    rng = np.random.default_rng(seed)
+    n = len(vins)
+    make = rng.choice(list(MAKES), n)
+    return pd.DataFrame({
+        'vin': vins,
+        'mc_dealer_id': rng.integers(1000, 1040, n),
+        'seller_name': 'Dealer',
+        'neo_make': make,
+        'neo_model': [MAKES[m][k] for m, k in zip(make, rng.integers(0, 2, n))],
+        'neo_year': rng.integers(2020, 2026, n),
+        'inventory_type': rng.choice(['new', 'used'], n),
+        'status_date': day,
+        'price': rng.uniform(1e4, 6e4, n).round(2),
+        'msrp': rng.uniform(1e4, 6e4, n).round(2),
+        'city': 'Austin', 'state': 'TX',
+        'zip': rng.integers(75000, 75100, n),
+        'mc_dealership_group_name': 'Group', 'dealer_type': 'franchise', 'source': 'site.com',
+        'latitude': rng.uniform(29, 33, n).round(5), 'longitude': rng.uniform(-98, -95, n).round(5),
+        'seller_phone': '555', 'seller_email': 'a@b.c', 'car_seller_name': 'x',
+        'car_address': '1 Main St', 'photo_links': 'http://x/1.jpg',
+    })[ESSENTIAL_COLUMNS]
+
+# One feed file per day: each day ~5% of the listings disappear (sold) and new ones are listed;
+# dealers and models are redrawn, so some VINs also move between dealers
+def write_feeds(data_dir, listings, days):
+    rng = np.random.default_rng(0)
+    active = np.arange(listings)
+    next_vin = listings
+    feeds = []
+    for i in range(days):
+        day = (pd.Timestamp('2025-07-01') + pd.Timedelta(days=i)).strftime("%Y-%m-%d")
+        path = os.path.join(data_dir, f"feed_{day}.csv")
+        vins = pd.Series(active).map(lambda k: f"1HGCM{k:012d}")
+        synthetic_feed(vins.to_numpy(), day, seed=i).to_csv(path, index=False)
+        feeds.append((path, day))
+        sold = rng.random(len(active)) < 0.05
+        new = np.arange(next_vin, next_vin + int(len(active) * 0.05))
+        next_vin += len(new)
+        active = np.concatenate([active[~sold], new])
+    return feeds
+
+def crash(*args, **kwargs):
+    raise RuntimeError("simulated crash")
+
+# Writes the manifest, then dies before the staged partitions it lists are moved into place
+def crash_after(write):
+    def crashing(*args, **kwargs):
+        write(*args, **kwargs)
+        crash()
+    return crashing
+
+def main_record_consistent():
+    manifest = read_manifest(MAIN_RECORD_PATH)
+    return all(pq.ParquetFile(os.path.join(MAIN_RECORD_PATH, info['file'])).metadata.num_rows == info['rows']
+               for info in manifest['partitions'].values())
+
+# Runs one day's ETL with `target` (module, attribute[, wrapper]) replaced by a function that raises
+def run_crashing(path, day, target):
+    module, name = target[:2]
+    original = getattr(module, name)
+    setattr(module, name, target[2](original) if len(target) > 2 else crash)
+    try:
+        etl.process_daily_feed(path, day)
+        return False
+    except RuntimeError as e:
+        print(f"[CHECK] {day}: ETL died as planned ({name}: {e})")
+        return True
+    finally:
+        setattr(module, name, original)
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) >= 2 else 20_000
+    days = max(int(sys.argv[2]) if len(sys.argv) >= 3 else 6, 6)
+    # Where each simulated crash happens, by day number
+    crashes = {
+        1: (partition_store, 'write_manifest', crash_after),  # main record half published
+        2: (etl, 'update_dealer_summaries'),       # records written, summary step never ran
+        4: (summarizer, 'add_to_sales_cube'),      # summary tables half written
+    }
+    work_dir = tempfile.mkdtemp(prefix="summary_recovery_")
+    cwd = os.getcwd()
+    ok = True
+    try:
+        os.chdir(work_dir)  # state/ paths are relative to the working directory
+        os.makedirs("data")
+        for i, (path, day) in enumerate(write_feeds("data", listings, days)):
+            if i in crashes:
+                ok &= run_crashing(path, day, crashes[i])
+                continue
+            etl.process_daily_feed(path, day)
+            matches = summarizer.verify_dealer_summaries()
+            consistent = main_record_consistent()
+            print(f"[CHECK] {day}: summaries match a full rebuild: {matches}, main record matches its manifest: {consistent}")
+            ok &= matches and consistent
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"[CHECK] Summary recovery after crashes: {'OK' if ok else 'FAILED'}")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
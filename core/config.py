@@ -8,34 +8,52 @@ ESSENTIAL_COLUMNS = [
     'car_seller_name', 'car_address', 'photo_links'
 ]
 
+# Canonical make/model IDs assigned at ingest from the persistent dictionary (core/make_model_dictionary.py);
+# carried by the main and sold records next to the feed columns
+MAKE_MODEL_ID_COLUMNS = ['make_id', 'model_id', 'make_model_id']
+
+# Declared storage types (see core/schema.py). 'category' columns are dictionary-encoded in memory and
+# in parquet, 'Int*' are nullable integers and dates are real datetime64 columns.
 COLUMN_DTYPES = {
-    'vin': str,
-    'mc_dealer_id': int,
-    'seller_name': str,
-    'neo_make': str,
-    'neo_model': str,
-    'neo_year': int,
-    'inventory_type': str,
-    'status_date': str,  # parse as date later
-    'price': float,
-    'msrp': float,
-    'city': str,
-    'state': str,
-    'zip': int,
-    'mc_dealership_group_name': str,
-    'dealer_type': str,
-    'source': str,
-    'latitude': float,
-    'longitude': float,
-    'seller_phone': str,
-    'seller_email': str,
-    'car_seller_name': str,
-    'car_address': str,
-    'photo_links': str
+    'vin': 'str',
+    'mc_dealer_id': 'Int64',
+    'seller_name': 'str',
+    'neo_make': 'category',
+    'neo_model': 'category',
+    'neo_year': 'Int16',
+    'inventory_type': 'category',
+    'status_date': 'datetime64[ns]',
+    'price': 'float64',
+    'msrp': 'float64',
+    'city': 'category',
+    'state': 'category',
+    'zip': 'Int32',
+    'mc_dealership_group_name': 'category',
+    'dealer_type': 'category',
+    'source': 'category',
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'seller_phone': 'str',
+    'seller_email': 'str',
+    'car_seller_name': 'str',
+    'car_address': 'str',
+    'photo_links': 'str',
+    'make_id': 'Int32',
+    'model_id': 'Int32',
+    'make_model_id': 'Int32',
+    'sold_date': 'datetime64[ns]'
 }
 
 DATE_FORMAT = "%Y-%m-%d"
 VIN_DISAPPEAR_DAYS = 5
 RAW_DATA_PATH = "data/"
-STATE_PATH = "state/vin_tracker.parquet"
+STATE_PATH = "state/vin_tracker"  # directory of .npy arrays, see core/vin_tracker.py
+MAIN_RECORD_DIR = "state/main_record"  # partitioned by VIN hash, see core/partition_store.py
+MAIN_RECORD_PARTITIONS = 64  # bounds the merge to one partition in memory; a daily feed still rewrites nearly all of them
+MAKE_MODEL_DICTIONARY_DIR = "state/make_model_dictionary"
+CSV_ENGINE = "pandas"  # "arrow" for the multithreaded pyarrow reader in core/loader.py
+ARROW_BLOCK_SIZE = 64 << 20  # bytes of CSV parsed per Arrow record batch
+PARQUET_ROW_GROUP_SIZE = 128_000  # rows per row group in converted feed datasets
+PARQUET_COMPRESSION = "zstd"  # or "snappy"
+PARQUET_WRITERS = 4  # parallel part-file writers in features/preprocess_csv_to_parquet.py
 DB_URL = "mssql+pyodbc://..." 
\ No newline at end of file
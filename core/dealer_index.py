@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import os
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.geo import haversine_miles, bounding_box
+
+# Dealer-level spatial index for radius queries. Each dealer's location (see core/dealers.py) gets
+# a grid cell of GRID_DEGREES; dealers are stored sorted by cell key
+# (lat_row * GRID_COLS + lon_col), so the cells of one grid row form a contiguous key range and a
+# radius query is one searchsorted per grid row of its bounding box, then a vectorized haversine on
+# the few candidates. Rebuilt from the dealer dimension on each ETL run.
+DEALER_INDEX_PATH = "state/dealer_geo_index.parquet"
+GRID_DEGREES = 0.5
+GRID_COLS = int(360 / GRID_DEGREES) + 1
+
+def grid_row(lat):
+    return np.floor((np.asarray(lat, dtype='float64') + 90) / GRID_DEGREES).astype(np.int64)
+
+def grid_col(lon):
+    return np.floor((np.asarray(lon, dtype='float64') + 180) / GRID_DEGREES).astype(np.int64)
+
+# Dealers with a valid location (from the dealer dimension, core/dealers.py), sorted by grid cell
+def dealer_locations(dealers):
+    df = dealers[['mc_dealer_id', 'zip', 'latitude', 'longitude']].dropna(subset=['mc_dealer_id', 'latitude', 'longitude'])
+    df = df[df['latitude'].between(-90, 90) & df['longitude'].between(-180, 180)]
+    df = df.assign(cell=grid_row(df['latitude']) * GRID_COLS + grid_col(df['longitude']))
+    return df.sort_values(['cell', 'mc_dealer_id'], kind='mergesort').reset_index(drop=True)
+
+# Arrays used by the queries
+def index_arrays(dealers):
+    return {
+        'dealer_id': dealers['mc_dealer_id'].to_numpy(dtype='int64'),
+        'zip': dealers['zip'].to_numpy(dtype='float64', na_value=np.nan),
+        'lat': dealers['latitude'].to_numpy(dtype='float64'),
+        'lon': dealers['longitude'].to_numpy(dtype='float64'),
+        'cell': dealers['cell'].to_numpy(dtype='int64'),
+    }
+
+def build_dealer_index(dealers):
+    dealers = dealer_locations(dealers)
+    os.makedirs(os.path.dirname(DEALER_INDEX_PATH), exist_ok=True)
+    tmp = DEALER_INDEX_PATH + ".tmp"
+    dealers.to_parquet(tmp, index=False)
+    os.replace(tmp, DEALER_INDEX_PATH)
+    print(f"[GEO] Dealer index saved. Dealers with location: {len(dealers)}, cells: {dealers['cell'].nunique()}")
+    return index_arrays(dealers)
+
+def load_dealer_index():
+    if not os.path.exists(DEALER_INDEX_PATH):
+        return None
+    return index_arrays(pd.read_parquet(DEALER_INDEX_PATH))
+
+def empty_result():
+    return pd.DataFrame({'mc_dealer_id': pd.array([], dtype='Int64'), 'distance_miles': np.array([], dtype='float64')})
+
+# Dealers within radius_miles of (lat, lon): DataFrame of mc_dealer_id and distance_miles, nearest first
+def dealers_within(index, lat, lon, radius_miles):
+    if radius_miles < 0 or len(index['cell']) == 0:
+        return empty_result()
+    lat_min, lat_max, lon_min, lon_max = bounding_box(lat, lon, radius_miles)
+    rows = np.arange(grid_row(max(lat_min, -90)), grid_row(min(lat_max, 90)) + 1)
+    col_lo = grid_col(max(lon_min, -180))
+    col_hi = grid_col(min(lon_max, 180))
+    starts = np.searchsorted(index['cell'], rows * GRID_COLS + col_lo, side='left')
+    ends = np.searchsorted(index['cell'], rows * GRID_COLS + col_hi, side='right')
+    # Positions of all candidate ranges in one go (starts[i]..ends[i] for each grid row)
+    lengths = ends - starts
+    candidates = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    distance = haversine_miles(lat, lon, index['lat'][candidates], index['lon'][candidates])
+    keep = distance <= radius_miles
+    order = np.argsort(distance[keep], kind='stable')
+    return pd.DataFrame({
+        'mc_dealer_id': pd.array(index['dealer_id'][candidates][keep][order], dtype='Int64'),
+        'distance_miles': distance[keep][order],
+    })
+
+# Location of a dealer, or None if it has none in the index
+def dealer_location(index, dealer_id):
+    hit = np.flatnonzero(index['dealer_id'] == int(dealer_id))
+    return (index['lat'][hit[0]], index['lon'][hit[0]]) if len(hit) else None
+
+# Centroid of the dealers in a zip code, or None if there are none
+def zip_location(index, zip_code):
+    hit = index['zip'] == int(zip_code)
+    return (index['lat'][hit].mean(), index['lon'][hit].mean()) if hit.any() else None
+
+def dealers_near_dealer(index, dealer_id, radius_miles):
+    location = dealer_location(index, dealer_id)
+    return dealers_within(index, *location, radius_miles) if location is not None else empty_result()
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import os
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.schema import enforce_schema
+from core.main_record import load_main_record
+
+# Dealer dimension: one row per mc_dealer_id, sorted by it, built from the main record on each ETL run.
+# Attributes come from the dealer's most recent listing (last_status_date); the location is the median
+# of its listings' coordinates, so one mis-geocoded listing does not move the dealer. Consumers join
+# against this small table instead of deduplicating the listing rows of the main record.
+DEALERS_PATH = "state/dealers.parquet"
+DEALER_COLUMNS = [
+    'mc_dealer_id', 'seller_name', 'car_address', 'city', 'state', 'zip', 'latitude', 'longitude',
+    'mc_dealership_group_name', 'dealer_type', 'source', 'seller_phone', 'seller_email', 'car_seller_name',
+]
+
+def build_dealers(main_df):
+    columns = [c for c in DEALER_COLUMNS + ['status_date'] if c in main_df.columns]
+    df = main_df[columns].dropna(subset=['mc_dealer_id']).reset_index(drop=True)
+    df = df.sort_values(['mc_dealer_id', 'status_date'], kind='mergesort', na_position='first')
+    dealers = df.drop_duplicates('mc_dealer_id', keep='last').rename(columns={'status_date': 'last_status_date'})
+    grouped = df.groupby('mc_dealer_id', observed=True, sort=True)
+    dealers = dealers.set_index('mc_dealer_id')
+    dealers['latitude'] = grouped['latitude'].median()
+    dealers['longitude'] = grouped['longitude'].median()
+    dealers['listings'] = grouped.size()
+    return dealers.reset_index()
+
+def save_dealers(dealers):
+    os.makedirs(os.path.dirname(DEALERS_PATH), exist_ok=True)
+    tmp = DEALERS_PATH + ".tmp"
+    dealers.to_parquet(tmp, index=False)
+    os.replace(tmp, DEALERS_PATH)
+    print(f"[DEALERS] Dealer dimension saved. Dealers: {len(dealers)}")
+
+# main_df may be omitted: only the dealer columns of the main record are then read
+def update_dealers(main_df=None):
+    if main_df is None:
+        main_df = load_main_record(columns=DEALER_COLUMNS + ['status_date'], memory_map=True)
+    dealers = build_dealers(main_df)
+    save_dealers(dealers)
+    return dealers
+
+def load_dealers(columns=None):
+    if not os.path.exists(DEALERS_PATH):
+        return None
+    return enforce_schema(pd.read_parquet(DEALERS_PATH, columns=columns))
+
+# Row positions of dealer IDs in the (sorted) dimension, -1 where the dealer is unknown
+def dealer_positions(dealers, dealer_ids):
+    keys = dealers['mc_dealer_id'].to_numpy(dtype='int64')
+    ids = pd.to_numeric(pd.Series(dealer_ids, copy=False), errors='coerce')
+    valid = ids.notna().to_numpy()
+    ids = ids.fillna(-1).to_numpy(dtype='int64')
+    pos = np.searchsorted(keys, ids)
+    pos[pos == len(keys)] = 0
+    found = valid & (keys[pos] == ids) if len(keys) else np.zeros(len(ids), dtype=bool)
+    return np.where(found, pos, -1)
+
+# One dealer's attributes as a Series, or None
+def get_dealer(dealers, dealer_id):
+    pos = dealer_positions(dealers, [dealer_id])[0]
+    return dealers.iloc[pos] if pos >= 0 else None
+
+# Attach dealer attributes to df by its mc_dealer_id (left join, one lookup per row, no sort or hash of df)
+def join_dealers(df, dealers, columns=None):
+    columns = [c for c in (columns or dealers.columns) if c != 'mc_dealer_id' and c not in df.columns]
+    pos = dealer_positions(dealers, df['mc_dealer_id'])
+    attrs = dealers[columns].iloc[np.maximum(pos, 0)].reset_index(drop=True)
+    if (pos < 0).any():
+        attrs.iloc[np.flatnonzero(pos < 0)] = np.nan
+    attrs.index = df.index
+    return pd.concat([df, attrs], axis=1)
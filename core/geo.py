@@ -0,0 +1,64 @@
+import numpy as np
+
+# Great-circle distances in miles on NumPy arrays (no per-row Python). Radius searches prefilter
+# with a lat/lon bounding box, so the trigonometry only runs on points that can be in range.
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+MAX_BLOCK_ELEMENTS = 8_000_000  # targets x points evaluated at once by pairs_within_radius
+
+# Haversine distance between points; arguments broadcast against each other
+def haversine_miles(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype='float64')) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+# (lat_min, lat_max, lon_min, lon_max) containing every point within radius_miles of (lat, lon);
+# arguments may be arrays (one box per target)
+def bounding_box(lat, lon, radius_miles):
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    lat_pad = radius_miles / MILES_PER_DEGREE_LAT
+    # Longitude degrees shrink towards the poles; use the widest latitude the box reaches
+    widest = np.radians(np.minimum(np.abs(lat) + lat_pad, 89.9))
+    lon_pad = radius_miles / (MILES_PER_DEGREE_LAT * np.maximum(np.cos(widest), 1e-6))
+    return lat - lat_pad, lat + lat_pad, lon - lon_pad, lon + lon_pad
+
+# Positions (into lats/lons, ascending) of the points within radius_miles of (lat, lon), and their distances.
+# Points with missing coordinates never match.
+def within_radius(lats, lons, lat, lon, radius_miles):
+    lats = np.asarray(lats, dtype='float64')
+    lons = np.asarray(lons, dtype='float64')
+    lat_min, lat_max, lon_min, lon_max = bounding_box(lat, lon, radius_miles)
+    candidates = np.flatnonzero((lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) & (lons <= lon_max))
+    distance = haversine_miles(lat, lon, lats[candidates], lons[candidates])
+    keep = distance <= radius_miles
+    return candidates[keep], distance[keep]
+
+# Full matrix of distances: one row per target, one column per point
+def distance_matrix(target_lats, target_lons, lats, lons):
+    target_lats = np.asarray(target_lats, dtype='float64')[:, None]
+    target_lons = np.asarray(target_lons, dtype='float64')[:, None]
+    return haversine_miles(target_lats, target_lons, np.asarray(lats, dtype='float64')[None, :], np.asarray(lons, dtype='float64')[None, :])
+
+# All (target, point) pairs within radius_miles, for many targets at once (e.g. every client dealer
+# against every competitor). Returns (target_idx, point_idx, distance). Targets are processed in blocks
+# so the box masks stay within MAX_BLOCK_ELEMENTS.
+def pairs_within_radius(target_lats, target_lons, lats, lons, radius_miles):
+    target_lats = np.asarray(target_lats, dtype='float64')
+    target_lons = np.asarray(target_lons, dtype='float64')
+    lats = np.asarray(lats, dtype='float64')
+    lons = np.asarray(lons, dtype='float64')
+    block = max(1, MAX_BLOCK_ELEMENTS // max(len(lats), 1))
+    targets, points, distances = [], [], []
+    for start in range(0, len(target_lats), block):
+        lat_min, lat_max, lon_min, lon_max = (b[:, None] for b in bounding_box(target_lats[start:start + block], target_lons[start:start + block], radius_miles))
+        t, p = np.nonzero((lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) & (lons <= lon_max))
+        t += start
+        distance = haversine_miles(target_lats[t], target_lons[t], lats[p], lons[p])
+        keep = distance <= radius_miles
+        targets.append(t[keep])
+        points.append(p[keep])
+        distances.append(distance[keep])
+    if not targets:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype='float64')
+    return np.concatenate(targets), np.concatenate(points), np.concatenate(distances)
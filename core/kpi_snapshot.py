@@ -0,0 +1,142 @@
+import pandas as pd
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.main_record import load_main_record
+from core.sales_cube import load_sales_cube, query_sales, latest_month, PERIODS
+from core.make_model_dictionary import load_make_model_dictionary, display_names, names_for_ids
+
+# KPI snapshot written by the ETL after the summaries and the cube: record counts and top-K
+# leaderboards (by inventory and by sales) of makes, models, dealers and zips, for every inventory
+# type and period. It is a few hundred rows of JSON, so the dashboard's KPI tabs and the CLI reports
+# read their numbers instead of scanning the main record or sorting the summaries on every render.
+KPI_SNAPSHOT_PATH = "state/kpi_snapshot.json"
+KPI_TOP_K = 20
+ALL_TYPES = "All"
+# dimension -> (main record column, sales cube table holding it next to inventory_type, dictionary table
+# naming its keys). Makes and models are counted by dictionary ID; their entries also carry the display name.
+KPI_DIMENSIONS = {
+    'make': ('make_id', 'cube', 'makes'),
+    'model': ('model_id', 'cube', 'models'),
+    'dealer': ('mc_dealer_id', 'cube', None),
+    'zip': ('zip', 'zip_month', None),
+}
+# Sales over all inventory types come from a table without inventory_type where there is one, so sales
+# whose type (or make/model) is unknown still count for their dealer
+KPI_ALL_TYPES_TABLES = {'dealer': 'dealer_month'}
+RANKINGS = ['inventory', 'sales']
+# Main record columns the snapshot reads
+KPI_MAIN_COLUMNS = [column for column, _, _ in KPI_DIMENSIONS.values()] + ['inventory_type']
+
+def _key(value):
+    return value.item() if hasattr(value, 'item') else value
+
+# Top-k rows of a (inventory, sales) table by one of its columns, as JSON-ready records (with the
+# display name of each key if names are given)
+def _top(table, ranking, top_k, names=None):
+    top = table.sort_values([ranking, 'key'], ascending=[False, True], kind='mergesort').head(top_k)
+    records = [{'key': _key(k), 'inventory': int(i), 'sales': int(s)} for k, i, s in zip(top['key'], top['inventory'], top['sales'])]
+    if names is not None:
+        for record, name in zip(records, names_for_ids(top['key'], names)):
+            record['name'] = name
+    return records
+
+# Per (value, inventory_type) counts -> per value counts of one inventory type (or all of them, including
+# rows without a type)
+def _for_type(counts, column, value, inventory_type):
+    if inventory_type != ALL_TYPES:
+        counts = counts[(counts['inventory_type'].astype(str) == inventory_type).to_numpy()]
+    return counts.groupby(column, observed=True)[value].sum()
+
+# Inventory and sales per value of one dimension (outer join: a key may have only one of them)
+def _dimension_table(inventory, sales):
+    table = pd.concat([inventory.rename('inventory'), sales.rename('sales')], axis=1).fillna(0).astype('int64')
+    table.index.name = 'key'
+    return table.reset_index()
+
+# main_df: the main record (one row per VIN); tables: the sales cube (loaded if None); dictionary: the
+# make/model dictionary (loaded if None). The main record is grouped once per dimension by
+# (value, inventory_type), keeping listings without a type for the 'All' counts; everything after works
+# on those small tables.
+def build_kpi_snapshot(main_df, tables=None, top_k=KPI_TOP_K, dictionary=None):
+    tables = load_sales_cube() if tables is None else tables
+    dictionary = load_make_model_dictionary() if dictionary is None else dictionary
+    names = {dimension: display_names(dictionary, table) for dimension, (_, _, table) in KPI_DIMENSIONS.items() if table is not None}
+    types = sorted(set(main_df['inventory_type'].dropna().astype(str)) | set(tables['cube']['inventory_type'].dropna().astype(str)))
+    inventory = {
+        dimension: main_df.groupby([column, 'inventory_type'], observed=True, dropna=False).size().reset_index(name='inventory')
+        for dimension, (column, _, _) in KPI_DIMENSIONS.items()
+    }
+    sales = {
+        (period, dimension): query_sales(tables, [column, 'inventory_type'], period, table=table)
+        for period in PERIODS for dimension, (column, table, _) in KPI_DIMENSIONS.items()
+    }
+    all_types_sales = {
+        (period, dimension): _for_type(query_sales(tables, [KPI_DIMENSIONS[dimension][0]], period, table=table), KPI_DIMENSIONS[dimension][0], 'sales_count', ALL_TYPES)
+        for period in PERIODS for dimension, table in KPI_ALL_TYPES_TABLES.items()
+    }
+    type_counts = main_df['inventory_type'].astype(str).value_counts()
+    snapshot = {
+        'generated_at': pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'as_of_month': latest_month(tables).strftime("%Y-%m"),
+        'top_k': top_k,
+        'inventory_types': [ALL_TYPES] + types,
+        'periods': PERIODS,
+        'counts': {},
+        'leaderboards': {},
+    }
+    for inventory_type in [ALL_TYPES] + types:
+        type_inventory = {
+            dimension: _for_type(inventory[dimension], column, 'inventory', inventory_type)
+            for dimension, (column, _, _) in KPI_DIMENSIONS.items()
+        }
+        boards = snapshot['leaderboards'][inventory_type] = {}
+        for period in PERIODS:
+            boards[period] = {}
+            for dimension, (column, _, _) in KPI_DIMENSIONS.items():
+                if inventory_type == ALL_TYPES and dimension in KPI_ALL_TYPES_TABLES:
+                    type_sales = all_types_sales[(period, dimension)]
+                else:
+                    type_sales = _for_type(sales[(period, dimension)], column, 'sales_count', inventory_type)
+                table = _dimension_table(type_inventory[dimension], type_sales)
+                boards[period][dimension] = {ranking: _top(table, ranking, top_k, names.get(dimension)) for ranking in RANKINGS}
+                if period == "All Time" and dimension == 'dealer':
+                    dealers = len(table)  # dealers with inventory or sales, as in the dealer summary
+        snapshot['counts'][inventory_type] = {
+            'vins': int(len(main_df) if inventory_type == ALL_TYPES else type_counts.get(inventory_type, 0)),
+            'dealers': int(dealers),
+            'makes': int(len(type_inventory['make'])),
+            'models': int(len(type_inventory['model'])),
+            'zips': int(len(type_inventory['zip'])),
+        }
+    return snapshot
+
+def save_kpi_snapshot(snapshot):
+    os.makedirs(os.path.dirname(KPI_SNAPSHOT_PATH), exist_ok=True)
+    tmp = KPI_SNAPSHOT_PATH + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f, indent=1)
+    os.replace(tmp, KPI_SNAPSHOT_PATH)
+    print(f"[KPI] Snapshot saved. VINs: {snapshot['counts'][ALL_TYPES]['vins']}, dealers: {snapshot['counts'][ALL_TYPES]['dealers']}")
+
+# main_df may be omitted: only KPI_MAIN_COLUMNS of the main record are then read
+def update_kpi_snapshot(main_df=None, tables=None):
+    if main_df is None:
+        main_df = load_main_record(columns=KPI_MAIN_COLUMNS, memory_map=True)
+    snapshot = build_kpi_snapshot(main_df, tables)
+    save_kpi_snapshot(snapshot)
+    return snapshot
+
+# None if the ETL has not written a snapshot yet
+def load_kpi_snapshot():
+    if not os.path.exists(KPI_SNAPSHOT_PATH):
+        return None
+    with open(KPI_SNAPSHOT_PATH) as f:
+        return json.load(f)
+
+# One leaderboard as a DataFrame (key, inventory, sales, plus name for makes and models), best first
+def leaderboard(snapshot, dimension, ranking, period="All Time", inventory_type=ALL_TYPES):
+    rows = snapshot['leaderboards'][inventory_type][period][dimension][ranking]
+    named = KPI_DIMENSIONS[dimension][2] is not None
+    return pd.DataFrame(rows, columns=['key', 'name', 'inventory', 'sales'] if named else ['key', 'inventory', 'sales'])
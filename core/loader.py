@@ -1,36 +1,139 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import hashlib
 import os
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from core.config import ESSENTIAL_COLUMNS, COLUMN_DTYPES
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-def load_inventory_csv(path, chunksize=100_000):
-    # CSV loader (legacy)
-    for chunk in pd.read_csv(path, usecols=ESSENTIAL_COLUMNS, chunksize=chunksize, dtype=str):
-        for col, dtype in COLUMN_DTYPES.items():
-            if col in chunk.columns:
-                try:
-                    chunk[col] = chunk[col].astype(dtype)
-                except Exception:
-                    pass
-        yield chunk
-
-def load_parquet_dataset(dataset_dir):
+from core.config import ESSENTIAL_COLUMNS, CSV_ENGINE, ARROW_BLOCK_SIZE
+from core.partition_store import read_manifest
+from core.schema import compile_coercer, CoercionReport, arrow_schema, cast_record_batch, arrow_to_pandas
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+def load_inventory_csv(path, chunksize=100_000, report=None, engine=CSV_ENGINE):
+    # CSV loader: each column is parsed once into its schema type; rejected values are counted in report.
+    # engine="arrow" uses the multithreaded Arrow reader (chunksize is then ARROW_BLOCK_SIZE bytes per batch).
+    own_report = report is None
+    report = CoercionReport() if own_report else report
+    if engine == "arrow":
+        for batch in iter_csv_record_batches(path, report=report):
+            yield arrow_to_pandas(batch)
+    else:
+        coerce = compile_coercer(ESSENTIAL_COLUMNS)
+        for chunk in pd.read_csv(path, usecols=ESSENTIAL_COLUMNS, chunksize=chunksize, dtype=str):
+            chunk, _ = coerce(chunk, report)
+            yield chunk
+    if own_report:
+        report.log("[LOADER]")
+
+def iter_csv_record_batches(path, block_size=ARROW_BLOCK_SIZE, report=None):
+    # Arrow CSV reader: multithreaded parsing, projected to ESSENTIAL_COLUMNS, yields typed RecordBatches.
+    # Text and dictionary columns are typed by the reader itself; numeric and date columns are read as
+    # strings and cast per batch, so one bad value nulls a cell instead of aborting the whole file.
+    target = arrow_schema(ESSENTIAL_COLUMNS)
+    column_types = {
+        field.name: field.type if pa.types.is_string(field.type) or pa.types.is_dictionary(field.type) else pa.string()
+        for field in target
+    }
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True, block_size=block_size),
+        convert_options=pacsv.ConvertOptions(include_columns=ESSENTIAL_COLUMNS, column_types=column_types, strings_can_be_null=True),
+    )
+    for batch in reader:
+        yield cast_record_batch(batch, target, report)
+
+def file_sha256(path, block_size=8 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def verify_dataset_manifest(dataset_dir, checksums=False):
+    # Checks a converted feed against the manifest written by features/preprocess_csv_to_parquet.py:
+    # the set of part files and each file's row count from its footer. checksums=True also hashes every
+    # file against the manifest (a full extra read of the dataset).
+    # Only legacy chunk_*.parquet dirs may lack a manifest; part files without one are a conversion that
+    # did not finish and are refused.
+    manifest = read_manifest(dataset_dir)
+    if manifest is None:
+        files = [f for f in os.listdir(dataset_dir) if f.endswith('.parquet')]
+        if files and all(f.startswith('chunk_') for f in files):
+            print(f"[LOADER] Legacy dataset {dataset_dir} has no manifest, skipping verification.")
+            return None
+        raise ValueError(f"Dataset {dataset_dir} has no manifest ({len(files)} parquet files); the conversion did not complete")
+    expected = {entry['file']: entry for entry in manifest['files']}
+    on_disk = set(f for f in os.listdir(dataset_dir) if f.endswith('.parquet'))
+    if on_disk != set(expected):
+        raise ValueError(f"Dataset {dataset_dir} does not match its manifest: missing {sorted(set(expected) - on_disk)}, unexpected {sorted(on_disk - set(expected))}")
+    for name, entry in expected.items():
+        path = os.path.join(dataset_dir, name)
+        rows = pq.ParquetFile(path).metadata.num_rows
+        if rows != entry['rows']:
+            raise ValueError(f"{path}: {rows} rows, manifest says {entry['rows']}")
+        if checksums and file_sha256(path) != entry['sha256']:
+            raise ValueError(f"{path}: checksum mismatch")
+    print(f"[LOADER] Dataset {dataset_dir} verified: {len(expected)} files, {manifest['rows']} rows{', checksums' if checksums else ''}.")
+    return manifest
+
+def dataset_files(dataset_dir):
+    return sorted([os.path.join(dataset_dir, f) for f in os.listdir(dataset_dir) if f.endswith('.parquet')])
+
+def read_parquet_chunk(path, columns=None, filters=None):
+    # Only the requested columns are decoded, and row groups whose statistics cannot match the filters are skipped
+    table = pq.read_table(path, columns=columns, filters=filters)
+    return arrow_to_pandas(table)
+
+def load_parquet_dataset(dataset_dir, columns=None, filters=None):
     # Loads each Parquet file in a dataset directory as a chunk
-    files = sorted([f for f in os.listdir(dataset_dir) if f.endswith('.parquet')])
-    for f in files:
-        chunk = pd.read_parquet(os.path.join(dataset_dir, f))
-        yield chunk
-
-def parallel_chunk_process(dataset_dir, func, max_workers=4):
-    # Processes files in batches of max_workers, yielding results batch by batch
-    files = sorted([os.path.join(dataset_dir, f) for f in os.listdir(dataset_dir) if f.endswith('.parquet')])
-    for i in range(0, len(files), max_workers):
-        batch = files[i:i+max_workers]
-        results = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(func, f) for f in batch]
-            for future in as_completed(futures):
-                results.append(future.result())
-        yield results 
\ No newline at end of file
+    for f in dataset_files(dataset_dir):
+        yield read_parquet_chunk(f, columns=columns, filters=filters)
+
+def apply_to_chunk(func, columns, filters, path):
+    # Top-level (picklable) wrapper so pushdown reads also work in a process pool
+    return func(read_parquet_chunk(path, columns=columns, filters=filters))
+
+def parallel_chunk_process(dataset_dir, func, max_workers=4, columns=None, filters=None, ordered=False,
+                           max_in_flight=None, use_processes=False):
+    # Runs func over every file on one persistent pool and yields results one at a time.
+    # A new file starts as soon as a worker is free; at most max_in_flight (default 2 * max_workers)
+    # results are pending or unconsumed, so a slow consumer applies backpressure instead of piling up frames.
+    # ordered=True yields in file order, otherwise in completion order. use_processes=True runs func in a
+    # process pool for CPU-bound work (func must then be a picklable top-level function).
+    # With columns/filters, each file is read with pushdown and func receives the DataFrame instead of the path.
+    files = iter(dataset_files(dataset_dir))
+    if columns is not None or filters is not None:
+        task = partial(apply_to_chunk, func, columns, filters)
+    else:
+        task = func
+    max_in_flight = max_in_flight or 2 * max_workers
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    pending = deque()
+    with executor_cls(max_workers=max_workers) as executor:
+        def submit_next():
+            path = next(files, None)
+            if path is not None:
+                pending.append(executor.submit(task, path))
+        try:
+            for _ in range(max_in_flight):
+                submit_next()
+            while pending:
+                if ordered:
+                    future = pending[0]
+                else:
+                    future = next((f for f in pending if f.done()), None)
+                    if future is None:
+                        wait(pending, return_when=FIRST_COMPLETED)
+                        future = next(f for f in pending if f.done())
+                pending.remove(future)
+                result = future.result()
+                submit_next()
+                yield result
+        finally:
+            # Consumer stopped early or a task failed: drop work that has not started yet
+            for future in pending:
+                future.cancel()
@@ -1,45 +1,76 @@
 import pandas as pd
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from core.config import ESSENTIAL_COLUMNS, COLUMN_DTYPES
-from core.loader import load_inventory_csv, load_parquet_dataset, parallel_chunk_process
-
-MAIN_RECORD_PATH = "state/main_record.parquet"
-
-
-def enforce_types(df):
-    for col, dtype in COLUMN_DTYPES.items():
-        if col in df.columns:
-            if dtype is int:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(-1).astype(int)
-            elif dtype is float:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            else:
-                df[col] = df[col].astype(dtype, errors='ignore')
-            # Print warning if any values could not be converted
-            if df[col].isnull().any():
-                print(f"[WARN] Nulls found in column {col} after type conversion.")
-    return df
+import pyarrow.parquet as pq
+from core.config import ESSENTIAL_COLUMNS, MAKE_MODEL_ID_COLUMNS, MAIN_RECORD_DIR, MAIN_RECORD_PARTITIONS
+from core.loader import load_inventory_csv, read_parquet_chunk, parallel_chunk_process
+from core.partition_store import vin_partition, read_manifest, load_partitions, save_partitions, begin_partition_write, stage_partitions, commit_partitions, finish_pending_partitions
+from core.schema import enforce_schema, concat_frames, compile_coercer, CoercionReport
+from core.upsert import prepare_batch, ensure_sorted, upsert_sorted, count_changes, drop_missing_vins
+from core.make_model_dictionary import assign_make_model_ids, load_make_model_dictionary
+from core.vin_index import vin_array, vin_array_unsorted, member_mask
+
+MAIN_RECORD_PATH = MAIN_RECORD_DIR
+LEGACY_MAIN_RECORD_PATH = "state/main_record.parquet"  # monolithic file, migrated on first save
+
 
-# Load the main record (VIN-indexed DataFrame)
-def load_main_record():
-    print("[MAIN] Loading main record...")
-    if os.path.exists(MAIN_RECORD_PATH):
-        df = pd.read_parquet(MAIN_RECORD_PATH)
-        if 'vin' in df.columns:
-            df = df.set_index('vin', drop=False)
-        print(f"[MAIN] Main record loaded. Rows: {len(df)}")
-        return df
+def main_record_partitions(vins):
+    return vin_partition(vins, MAIN_RECORD_PARTITIONS)
+
+# Load the main record (VIN-indexed DataFrame); pass partitions to read only part of the store.
+# columns projects the read for readers that only need a few columns (e.g. the dashboard); without
+# 'vin' among them the frame keeps a plain RangeIndex. memory_map maps the parquet files instead of
+# copying them into read buffers.
+def load_main_record(partitions=None, columns=None, memory_map=False):
+    print("[MAIN] Loading main record..." + (f" (columns: {', '.join(columns)})" if columns else ""))
+    if read_manifest(MAIN_RECORD_PATH) is not None:
+        df = load_partitions(MAIN_RECORD_PATH, partitions, columns=columns, memory_map=memory_map)
+    elif os.path.exists(LEGACY_MAIN_RECORD_PATH):
+        print(f"[MAIN] Partitioned store not found, reading legacy file {LEGACY_MAIN_RECORD_PATH}")
+        df = pd.read_parquet(LEGACY_MAIN_RECORD_PATH, memory_map=memory_map)
+        if partitions is not None and len(df):
+            df = df[pd.Series(main_record_partitions(df['vin'])).isin(list(partitions)).values]
     else:
         print("[MAIN] No main record found. Initializing empty DataFrame.")
-        return pd.DataFrame(columns=ESSENTIAL_COLUMNS).set_index('vin', drop=False)
+        df = None
+    if df is None or not set(columns or ['vin']).issubset(df.columns):
+        df = pd.DataFrame(columns=ESSENTIAL_COLUMNS + MAKE_MODEL_ID_COLUMNS)
+    if columns:
+        df = df[list(columns)].reset_index(drop=True)
+    df = enforce_schema(df)
+    if 'vin' in df.columns:
+        df = df.set_index('vin', drop=False)
+    print(f"[MAIN] Main record loaded. Rows: {len(df)}" + (f" (partitions: {len(set(partitions))})" if partitions is not None else ""))
+    return df
+
+# Version of the stored main record (bumped by every save), None if there is no partitioned store yet
+def main_record_version():
+    manifest = read_manifest(MAIN_RECORD_PATH)
+    return manifest.get('version', 0) if manifest is not None else None
 
-# Save the main record
-def save_main_record(df):
-    os.makedirs(os.path.dirname(MAIN_RECORD_PATH), exist_ok=True)
-    df = enforce_types(df)
-    df.reset_index(drop=True).to_parquet(MAIN_RECORD_PATH, index=False)
-    print(f"[MAIN] Main record saved. Rows: {len(df)}")
+# Row count from the manifest, no data is read
+def count_main_records():
+    manifest = read_manifest(MAIN_RECORD_PATH)
+    if manifest is None:
+        return len(load_main_record(columns=['vin']))
+    return sum(info['rows'] for info in manifest['partitions'].values())
+
+# Rows of the given VINs, read from only the partitions that hold them (columns as in load_main_record)
+def load_main_record_vins(vins, columns=None):
+    vins = pd.Series(vins, copy=False)
+    df = load_main_record(partitions=set(main_record_partitions(vins).tolist()) if len(vins) else [], columns=columns)
+    return df[member_mask(vin_array_unsorted(df['vin']), vin_array(vins))]
+
+# Save the main record; only the given partitions are rewritten (all of them if None or if the store is new).
+# Frames are already typed by the loaders, so nothing is re-coerced here.
+def save_main_record(df, partitions=None):
+    if read_manifest(MAIN_RECORD_PATH) is None:
+        partitions = None
+    elif partitions is not None and len(partitions) == 0:
+        print("[MAIN] No partitions changed. Nothing to save.")
+        return
+    written = save_partitions(MAIN_RECORD_PATH, df, MAIN_RECORD_PARTITIONS, partitions)
+    print(f"[MAIN] Main record saved. Rows: {len(df)}, partitions rewritten: {written}/{MAIN_RECORD_PARTITIONS}")
 
 # Deduplicate a DataFrame by VIN, keeping the latest status_date
 # Assumes status_date is a string in YYYY-MM-DD or similar format
@@ -57,80 +88,171 @@ def deduplicate_by_vin(df):
         df = df.drop_duplicates('vin', keep='first')
     return df
 
-# Update main record with today's chunk (in-place, chunked)
+# Update main record with today's chunk (in-place, chunked).
+# Overlapping VINs are updated in one bulk assignment where today's status_date is newer.
 def update_main_record_chunk(main_df, today_chunk):
     today_chunk = deduplicate_by_vin(today_chunk)
     today_chunk = today_chunk.set_index('vin', drop=False)
-    # For overlapping VINs, keep the record with the latest status_date
     overlap = main_df.index.intersection(today_chunk.index)
-    for vin in overlap:
-        # Compare status_date, update only if new is newer
-        try:
-            main_date = pd.to_datetime(main_df.at[vin, 'status_date'], errors='coerce')
-            today_date = pd.to_datetime(today_chunk.at[vin, 'status_date'], errors='coerce')
-            if today_date > main_date:
-                main_df.loc[vin] = today_chunk.loc[vin]
-        except Exception:
-            # If any error, just update
-            main_df.loc[vin] = today_chunk.loc[vin]
+    if len(overlap) > 0:
+        main_dates = pd.to_datetime(main_df['status_date'].reindex(overlap), errors='coerce')
+        today_dates = pd.to_datetime(today_chunk['status_date'].reindex(overlap), errors='coerce')
+        newer = (today_dates > main_dates).to_numpy()
+        updated_vins = overlap[newer]
+        if len(updated_vins) > 0:
+            aligned = today_chunk.loc[updated_vins].reindex(columns=main_df.columns)
+            # Categoricals that differ only in their categories share the union (as in core/schema.concat_frames);
+            # other dtype conflicts are widened to object, as the old row-by-row assignment did implicitly
+            for col in main_df.columns:
+                main_type, today_type = main_df[col].dtype, aligned[col].dtype
+                if main_type == today_type:
+                    continue
+                if isinstance(main_type, pd.CategoricalDtype) and isinstance(today_type, pd.CategoricalDtype):
+                    categories = main_type.categories.union(today_type.categories)
+                    main_df[col] = main_df[col].cat.set_categories(categories)
+                    aligned[col] = aligned[col].cat.set_categories(categories)
+                else:
+                    main_df[col] = main_df[col].astype(object)
+            main_df.loc[updated_vins, :] = aligned
     # Add new VINs
     new_vins = today_chunk.index.difference(main_df.index)
     if len(new_vins) > 0:
-        main_df = pd.concat([main_df, today_chunk.loc[new_vins]], axis=0)
+        main_df = concat_frames([main_df, today_chunk.loc[new_vins]], axis=0)
     return main_df
 
-# Full update for a day's feed (chunked, parallel for Parquet)
-def update_main_record_from_feed(today_path, chunksize=100_000, max_workers=4):
-    import time
-    t0 = time.time()
-    main_df = load_main_record()
-    print(f"[MAIN] Main record shape: {main_df.shape}")
-    t1 = time.time()
-    print(f"[MAIN] Loading today's data from: {today_path}")
+# Read today's feed as a stream of frames (Parquet chunks read on a worker pool, or CSV chunks)
+def iter_feed_chunks(today_path, chunksize=100_000, max_workers=4):
     if os.path.isdir(today_path) or today_path.endswith('.parquet/'):
-        print(f"[MAIN] Processing Parquet chunks in batches (max_workers={max_workers})...")
-        batch_num = 0
-        total_rows = 0
-        for batch_chunks in parallel_chunk_process(today_path, lambda f: pd.read_parquet(f), max_workers=max_workers):
-            batch_num += 1
-            batch_df = pd.concat(batch_chunks, ignore_index=True)
-            print(f"[MAIN] Batch {batch_num}: Loaded {len(batch_df)} rows from {len(batch_chunks)} chunks.")
-            batch_df = deduplicate_by_vin(batch_df)
-            print(f"[MAIN] Batch {batch_num}: Deduplicated to {len(batch_df)} rows.")
-            # Merge batch with main_df (vectorized)
-            batch_df = batch_df.set_index('vin', drop=False)
-            combined = pd.concat([main_df, batch_df], axis=0)
-            combined['status_date'] = pd.to_datetime(combined['status_date'], errors='coerce')
-            combined = combined.reset_index(drop=True)
-            print(f"[MAIN] Reset index before sorting/merge. Shape: {combined.shape}")
-            combined = combined.sort_values(['vin', 'status_date'], ascending=[True, False])
-            combined = combined.drop_duplicates('vin', keep='first')
-            main_df = combined
-            total_rows += len(batch_df)
-            print(f"[MAIN] Batch {batch_num}: Main record updated. Current shape: {main_df.shape}")
-        print(f"[MAIN] All batches processed. Total rows processed: {total_rows}")
+        print(f"[MAIN] Processing Parquet chunks (max_workers={max_workers})...")
+        # Chunks written by the preprocessor are already typed, so this is a no-op for them
+        coerce = compile_coercer(ESSENTIAL_COLUMNS)
+        report = CoercionReport()
+        for chunk in parallel_chunk_process(today_path, read_parquet_chunk, max_workers=max_workers):
+            chunk, _ = coerce(chunk, report)
+            yield chunk
+        report.log("[MAIN]")
     else:
         print(f"[MAIN] Loading CSV in chunks...")
-        chunk_list = []
-        for i, chunk in enumerate(load_inventory_csv(today_path, chunksize=chunksize)):
-            print(f"[MAIN] Loaded CSV chunk {i+1}, rows: {len(chunk)}")
-            chunk_list.append(chunk)
-        all_today = pd.concat(chunk_list, ignore_index=True)
-        print(f"[MAIN] All CSV chunks concatenated. Shape: {all_today.shape}")
-        print(f"[MAIN] Deduplicating today's data by VIN (latest status_date)...")
-        all_today = deduplicate_by_vin(all_today)
-        print(f"[MAIN] Deduplication complete. Shape: {all_today.shape}")
-        print(f"[MAIN] Merging today's data with main record (vectorized)...")
-        all_today = all_today.set_index('vin', drop=False)
-        combined = pd.concat([main_df, all_today], axis=0)
-        combined['status_date'] = pd.to_datetime(combined['status_date'], errors='coerce')
-        combined = combined.reset_index(drop=True)
-        print(f"[MAIN] Reset index before sorting/merge. Shape: {combined.shape}")
-        combined = combined.sort_values(['vin', 'status_date'], ascending=[True, False])
-        combined = combined.drop_duplicates('vin', keep='first')
-        main_df = combined
-        print(f"[MAIN] Merge complete. Combined shape: {main_df.shape}")
-    t4 = time.time()
-    save_main_record(main_df)
-    print(f"[MAIN] Update complete. Time breakdown (s): load_main={t1-t0:.2f}, process={t4-t1:.2f}, save={time.time()-t4:.2f}")
-    return main_df 
\ No newline at end of file
+        for chunk in load_inventory_csv(today_path, chunksize=chunksize):
+            yield chunk
+
+# Pass-through over the feed stream that keeps what the ETL needs besides the delta
+# (input row count and the monitoring sample), so the feed is only read once
+def scan_feed(chunks, scan, sample_size=100):
+    for chunk in chunks:
+        if scan['sample_rows'] is None:
+            scan['sample_rows'] = chunk.head(sample_size).copy()
+        scan['input_rows'] += len(chunk)
+        yield chunk
+
+# Collapse the feed into one sorted, deduplicated delta. Each batch is sorted on its own and
+# merged into the running delta, so the main record is never touched here. The delta gets its
+# make/model IDs here, once per run, from the persistent dictionary.
+def build_feed_delta(chunks):
+    delta = None
+    total_rows = 0
+    dropped_rows = 0
+    for batch_num, chunk in enumerate(chunks, start=1):
+        total_rows += len(chunk)
+        chunk, dropped = drop_missing_vins(chunk)
+        dropped_rows += dropped
+        batch_df = prepare_batch(chunk)
+        delta = batch_df if delta is None else upsert_sorted(delta, batch_df)[0]
+        print(f"[MAIN] Batch {batch_num}: {len(chunk) + dropped} rows, {len(batch_df)} unique VINs. Delta size: {len(delta)}")
+    print(f"[MAIN] All batches processed. Total rows processed: {total_rows}")
+    if dropped_rows:
+        print(f"[MAIN] Dropped {dropped_rows} rows with a null or blank VIN.")
+    if delta is None:
+        delta = enforce_schema(pd.DataFrame(columns=ESSENTIAL_COLUMNS))
+    return assign_make_model_ids(delta)
+
+# Single sort-merge pass of the delta into the main record, one partition at a time: each partition
+# holding delta VINs is loaded, merged and, if any of its VINs changed, staged next to the live file
+# before the next one is read, so memory holds the delta plus one partition and nothing is kept once
+# merged. The staged partitions are published together with one manifest update (one version bump).
+# Returns the partitions that were loaded, the ones that were rewritten, the net change in rows per
+# mc_dealer_id (new VINs and VINs that moved dealer), which drives the summaries, and up to
+# sample_size merged rows for monitoring.
+def upsert_main_record(delta, sample_size=100):
+    if read_manifest(MAIN_RECORD_PATH) is None:
+        # First run or legacy single-file record: merge against everything, every partition gets written
+        main_df = ensure_sorted(load_main_record())
+        if 'make_model_id' not in main_df.columns:
+            main_df = assign_make_model_ids(main_df)
+        merged, changed_vins = upsert_sorted(main_df, delta)
+        save_main_record(merged)
+        all_parts = set(range(MAIN_RECORD_PARTITIONS))
+        return all_parts, all_parts, count_changes(main_df, merged, changed_vins, 'mc_dealer_id'), merged.head(sample_size)
+    changed_parts = set()
+    dealer_changes = []
+    sample = None
+    # Changed partitions are staged as they are merged and published together by one manifest update
+    version = begin_partition_write(MAIN_RECORD_PATH, MAIN_RECORD_PARTITIONS)
+    staged = {}
+    groups = delta.groupby(main_record_partitions(delta['vin']), sort=True).indices
+    for part, rows in groups.items():
+        part_df = load_partitions(MAIN_RECORD_PATH, [part])
+        if len(part_df):
+            part_df = ensure_sorted(part_df)
+        merged, changed_vins = upsert_sorted(part_df, delta.iloc[rows])
+        if sample is None:
+            sample = merged.head(sample_size)
+        if len(changed_vins):
+            staged.update(stage_partitions(MAIN_RECORD_PATH, merged, MAIN_RECORD_PARTITIONS, version, [part]))
+            changed_parts.add(int(part))
+            dealer_changes.append(count_changes(part_df, merged, changed_vins, 'mc_dealer_id'))
+    commit_partitions(MAIN_RECORD_PATH, MAIN_RECORD_PARTITIONS, version, staged)
+    dealer_changes = pd.concat(dealer_changes).groupby(level=0).sum() if dealer_changes else pd.Series(dtype='int64')
+    return set(int(p) for p in groups), changed_parts, dealer_changes, sample
+
+# Partitions written before make/model IDs were assigned at ingest get them once: each such partition
+# is read, given its IDs from the dictionary and rewritten (files that have the columns are skipped)
+def add_make_model_ids_to_main_record():
+    manifest = read_manifest(MAIN_RECORD_PATH)
+    if manifest is None:
+        return
+    missing = [int(p) for p, info in manifest['partitions'].items()
+               if 'make_model_id' not in pq.read_schema(os.path.join(MAIN_RECORD_PATH, info['file'])).names]
+    if not missing:
+        return
+    print(f"[MAIN] Adding make/model IDs to {len(missing)} main record partitions...")
+    dictionary = load_make_model_dictionary()
+    version = begin_partition_write(MAIN_RECORD_PATH, MAIN_RECORD_PARTITIONS)
+    staged = {}
+    for part in sorted(missing):
+        part_df = assign_make_model_ids(load_partitions(MAIN_RECORD_PATH, [part]), dictionary)
+        staged.update(stage_partitions(MAIN_RECORD_PATH, part_df, MAIN_RECORD_PARTITIONS, version, [part]))
+    commit_partitions(MAIN_RECORD_PATH, MAIN_RECORD_PARTITIONS, version, staged)
+
+# Full update for a day's feed (chunked, parallel for Parquet) from a single scan of the feed.
+# The feed is reduced to a delta first, then merged into the main record in one pass, partition by
+# partition; partitions holding no delta VINs are neither read nor written. The partitions are VIN-hash
+# buckets, so a feed of more than a few hundred VINs lands in nearly all of them and they are all
+# rewritten: the partitioning bounds the memory of the merge, not the volume written.
+# Returns the delta (today's rows, one per VIN, sorted) and the scan results: today's unique VINs
+# (sorted), a sample of input rows and of merged main record rows, the input row count, the per-dealer
+# inventory changes and the main record versions they lead from and to. The full main record is not
+# returned; later stages read the columns or partitions they need from the store.
+def ingest_daily_feed(today_path, chunksize=100_000, max_workers=4):
+    import time
+    t0 = time.time()
+    print(f"[MAIN] Loading today's data from: {today_path}")
+    # A write a failed run left half published is completed before anything reads the partitions
+    finish_pending_partitions(MAIN_RECORD_PATH)
+    add_make_model_ids_to_main_record()
+    scan = {'sample_rows': None, 'input_rows': 0}
+    base_version = main_record_version()
+    delta = build_feed_delta(scan_feed(iter_feed_chunks(today_path, chunksize=chunksize, max_workers=max_workers), scan))
+    scan['today_vins'] = delta['vin'].to_numpy()
+    t1 = time.time()
+    print(f"[MAIN] Merging {len(delta)} VINs into main record (sort-merge upsert)...")
+    loaded_parts, changed_parts, scan['inventory_changes'], scan['main_sample'] = upsert_main_record(delta)
+    scan['main_versions'] = (base_version, main_record_version())
+    print(f"[MAIN] Partitions loaded: {len(loaded_parts)}, rewritten: {len(changed_parts)} of {MAIN_RECORD_PARTITIONS}")
+    print(f"[MAIN] Update complete. Main record rows: {count_main_records()}. Time breakdown (s): feed={t1-t0:.2f}, merge+save={time.time()-t1:.2f}")
+    return delta, scan
+
+# Runs the day's update and returns the whole updated main record (read back from the store)
+def update_main_record_from_feed(today_path, chunksize=100_000, max_workers=4):
+    ingest_daily_feed(today_path, chunksize=chunksize, max_workers=max_workers)
+    return load_main_record()
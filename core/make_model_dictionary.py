@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.config import MAKE_MODEL_DICTIONARY_DIR
+
+# Persistent make/model dictionary: canonical integer IDs for makes, models and make+model pairs.
+# Every spelling seen in a feed ('Toyota', ' TOYOTA') is stored with its normalized key (stripped,
+# lowercased) and the ID of that key, so normalization runs once per new spelling; after that a
+# spelling is a lookup. IDs are never reassigned: new keys get the next free ID and the tables only grow.
+#   makes.parquet   spelling, key, make_id
+#   models.parquet  spelling, key, model_id
+#   pairs.parquet   make_id, model_id, make_model_id
+DICTIONARY_TABLES = {
+    'makes': {'spelling': 'object', 'key': 'object', 'make_id': 'int32'},
+    'models': {'spelling': 'object', 'key': 'object', 'model_id': 'int32'},
+    'pairs': {'make_id': 'int32', 'model_id': 'int32', 'make_model_id': 'int32'},
+}
+
+NAME_ID_COLUMNS = {'makes': 'make_id', 'models': 'model_id'}
+
+def dictionary_path(name):
+    return os.path.join(MAKE_MODEL_DICTIONARY_DIR, f"{name}.parquet")
+
+def normalize_name(values):
+    return pd.Index(values, dtype=object).astype(str).str.strip().str.lower()
+
+def empty_table(name):
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in DICTIONARY_TABLES[name].items()})
+
+def load_make_model_dictionary():
+    return {
+        name: pd.read_parquet(dictionary_path(name)) if os.path.exists(dictionary_path(name)) else empty_table(name)
+        for name in DICTIONARY_TABLES
+    }
+
+# Tables are written one at a time; makes and models go first, so a pair never refers to a missing ID
+def save_make_model_dictionary(dictionary):
+    os.makedirs(MAKE_MODEL_DICTIONARY_DIR, exist_ok=True)
+    for name in DICTIONARY_TABLES:
+        path = dictionary_path(name)
+        tmp = path + ".tmp"
+        dictionary[name].to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+def _next_ids(table, id_column, n):
+    start = int(table[id_column].max()) + 1 if len(table) else 0
+    return np.arange(start, start + n, dtype=np.int32)
+
+# Spellings -> IDs of one name table (makes or models). Unknown spellings are normalized and get the
+# ID of their key, or a new ID for a new key. Returns (ids aligned with spellings, table, new spellings).
+def _spelling_ids(spellings, table, id_column):
+    known = pd.Index(table['spelling']).get_indexer(spellings)
+    new = known < 0
+    if new.any():
+        keys = normalize_name(spellings[new])
+        key_ids = table.drop_duplicates('key').set_index('key')[id_column]
+        ids = key_ids.reindex(keys).to_numpy(dtype=np.float64, copy=True)
+        missing = np.isnan(ids)
+        new_keys = pd.unique(keys[missing])
+        ids[missing] = pd.Series(_next_ids(table, id_column, len(new_keys)), index=new_keys).reindex(keys[missing]).to_numpy()
+        added = pd.DataFrame({'spelling': np.asarray(spellings[new], dtype=object), 'key': np.asarray(keys, dtype=object), id_column: ids.astype(np.int32)})
+        table = pd.concat([table, added], ignore_index=True)
+        known = pd.Index(table['spelling']).get_indexer(spellings)
+    return table[id_column].to_numpy()[known], table, int(new.sum())
+
+# IDs for a name column (categorical or strings), -1 where the value is missing
+def _column_ids(values, table, id_column):
+    codes, spellings = pd.factorize(values)
+    if len(spellings) == 0:
+        return np.full(len(codes), -1, dtype=np.int32), table, 0
+    spellings = pd.Index(np.asarray(spellings, dtype=object)).astype(str)
+    spelling_ids, table, new = _spelling_ids(spellings, table, id_column)
+    return np.where(codes >= 0, spelling_ids[codes], -1).astype(np.int32), table, new
+
+# make_model_id of each (make_id, model_id) row, -1 where either is missing; new pairs are appended
+def _pair_ids(make_ids, model_ids, table):
+    valid = (make_ids >= 0) & (model_ids >= 0)
+    combined = (make_ids.astype(np.int64) << 32) | model_ids.astype(np.int64)
+    codes, uniques = pd.factorize(combined[valid])
+    known = pd.Index((table['make_id'].to_numpy(np.int64) << 32) | table['model_id'].to_numpy(np.int64)).get_indexer(uniques)
+    new = known < 0
+    if new.any():
+        added = pd.DataFrame({
+            'make_id': (uniques[new] >> 32).astype(np.int32),
+            'model_id': (uniques[new] & 0xFFFFFFFF).astype(np.int32),
+            'make_model_id': _next_ids(table, 'make_model_id', int(new.sum())),
+        })
+        table = pd.concat([table, added], ignore_index=True)
+        known[new] = np.arange(len(table) - len(added), len(table))
+    ids = np.full(len(combined), -1, dtype=np.int32)
+    ids[valid] = table['make_model_id'].to_numpy()[known][codes]
+    return ids, table, int(new.sum())
+
+def _nullable(ids):
+    return pd.arrays.IntegerArray(np.where(ids >= 0, ids, 0).astype(np.int32), ids < 0)
+
+# Add make_id, model_id and make_model_id to df (in place, from neo_make/neo_model) and persist any
+# new entries. Categorical columns are resolved per category, so the work is per distinct spelling.
+def assign_make_model_ids(df, dictionary=None, save=True):
+    dictionary = load_make_model_dictionary() if dictionary is None else dictionary
+    make_ids, dictionary['makes'], new_makes = _column_ids(df['neo_make'], dictionary['makes'], 'make_id')
+    model_ids, dictionary['models'], new_models = _column_ids(df['neo_model'], dictionary['models'], 'model_id')
+    pair_ids, dictionary['pairs'], new_pairs = _pair_ids(make_ids, model_ids, dictionary['pairs'])
+    df['make_id'] = _nullable(make_ids)
+    df['model_id'] = _nullable(model_ids)
+    df['make_model_id'] = _nullable(pair_ids)
+    if save and (new_makes or new_models or new_pairs):
+        save_make_model_dictionary(dictionary)
+        print(f"[MAKE_MODEL] Dictionary updated. New spellings: {new_makes} makes, {new_models} models; new pairs: {new_pairs}")
+    return df
+
+# IDs of a make/model typed by a user, or None for a value the dictionary has never seen
+def lookup_make_id(make, dictionary):
+    return _key_id(make, dictionary['makes'], 'make_id')
+
+def lookup_model_id(model, dictionary):
+    return _key_id(model, dictionary['models'], 'model_id')
+
+def lookup_make_model_id(make, model, dictionary):
+    make_id, model_id = lookup_make_id(make, dictionary), lookup_model_id(model, dictionary)
+    if make_id is None or model_id is None:
+        return None
+    pairs = dictionary['pairs']
+    match = pairs['make_model_id'][(pairs['make_id'] == make_id) & (pairs['model_id'] == model_id)]
+    return int(match.iloc[0]) if len(match) else None
+
+def _key_id(value, table, id_column):
+    match = table[id_column][table['key'] == normalize_name([value])[0]]
+    return int(match.iloc[0]) if len(match) else None
+
+# Canonical display name of each ID of a name table ('makes' or 'models'): the first spelling recorded
+# for its key, stripped. Entries are only appended, so a name never changes once shown. Series indexed by ID.
+def display_names(dictionary, name):
+    id_column = NAME_ID_COLUMNS[name]
+    first = dictionary[name].drop_duplicates(id_column, keep='first')
+    return pd.Series(first['spelling'].astype(str).str.strip().to_numpy(), index=first[id_column].to_numpy(dtype=np.int64), name=name)
+
+# Display names for an array of IDs (the ID as text where the dictionary has no entry)
+def names_for_ids(ids, names):
+    ids = np.asarray(ids, dtype=np.int64)
+    found = names.reindex(ids).to_numpy(dtype=object)
+    missing = pd.isna(found)
+    found[missing] = ids[missing].astype(str)
+    return found
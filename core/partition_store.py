@@ -0,0 +1,156 @@
+import pandas as pd
+import json
+import os
+import shutil
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.schema import concat_frames
+
+MANIFEST_FILE = "_manifest.json"
+
+# Stable VIN -> partition id (hash_pandas_object uses a fixed key, so ids survive restarts)
+def vin_partition(vins, num_partitions):
+    vins = pd.Series(vins, copy=False).astype(str)
+    hashes = pd.util.hash_pandas_object(vins, index=False).values
+    return (hashes % num_partitions).astype('int32')
+
+def partition_file(part):
+    return f"part-{part:03d}.parquet"
+
+def read_manifest(store_dir):
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_manifest(store_dir, manifest):
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+# Directory stores that are rewritten whole (VIN tracker state, postings, converted feeds) are built in
+# staging_dir(path) and swapped in through path + ".old", so a crash never leaves a mix of old and new
+# files. A crash between the two renames leaves only the ".old" copy; readers resolve the directory
+# with current_dir, which falls back to it.
+def staging_dir(path):
+    return os.path.normpath(path) + ".tmp"
+
+def swap_in_dir(tmp_dir, path):
+    path = os.path.normpath(path)
+    old_dir = path + ".old"
+    if os.path.exists(path):
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(path, old_dir)
+    os.replace(tmp_dir, path)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def current_dir(path):
+    path = os.path.normpath(path)
+    if not os.path.exists(path) and os.path.exists(path + ".old"):
+        return path + ".old"
+    return path
+
+# Per-partition stats kept in the manifest (row count, min/max status_date)
+def partition_stats(df):
+    stats = {'rows': int(len(df)), 'min_status_date': None, 'max_status_date': None}
+    if len(df) and 'status_date' in df.columns:
+        dates = pd.to_datetime(df['status_date'], errors='coerce')
+        if dates.notna().any():
+            stats['min_status_date'] = dates.min().strftime("%Y-%m-%d")
+            stats['max_status_date'] = dates.max().strftime("%Y-%m-%d")
+    return stats
+
+# Read the given partitions (all partitions in the manifest if parts is None); columns projects the
+# read, memory_map maps the files instead of reading them into buffers first
+def load_partitions(store_dir, parts=None, columns=None, memory_map=False):
+    manifest = read_manifest(store_dir)
+    if manifest is None:
+        return None
+    available = sorted(int(p) for p in manifest['partitions'])
+    if parts is not None:
+        wanted = set(int(p) for p in parts)
+        available = [p for p in available if p in wanted]
+    frames = []
+    for part in available:
+        path = os.path.join(store_dir, partition_file(part))
+        if os.path.exists(path):
+            frames.append(pd.read_parquet(path, columns=columns, memory_map=memory_map))
+    if not frames:
+        return pd.DataFrame(columns=columns) if columns else pd.DataFrame()
+    return concat_frames(frames, ignore_index=True)
+
+# Staged files carry the manifest version they belong to, so a file left by a run that died before its
+# commit is never taken for one of a later commit ('_' prefix: ignored by dataset readers)
+def _staged_file(store_dir, part, version):
+    return os.path.join(store_dir, f"_{partition_file(part)}.v{version}.tmp")
+
+# Start a write of the store: completes a commit a failed run left half done, drops files staged by a run
+# that died before its commit, and returns the version the next commit will have
+def begin_partition_write(store_dir, num_partitions):
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = finish_pending_partitions(store_dir)
+    if manifest is not None and manifest['num_partitions'] != num_partitions:
+        raise ValueError(f"Store {store_dir} has {manifest['num_partitions']} partitions, expected {num_partitions}")
+    for name in os.listdir(store_dir):
+        if name.startswith("_part-") and name.endswith(".tmp"):
+            os.remove(os.path.join(store_dir, name))
+    return (manifest.get('version', 0) if manifest is not None else 0) + 1
+
+# Write the given partitions of df next to the live files for the commit of `version`, without touching
+# the manifest or the live files. Returns the manifest entries of the staged partitions.
+def stage_partitions(store_dir, df, num_partitions, version, parts=None):
+    df = df.reset_index(drop=True)
+    part_ids = vin_partition(df['vin'], num_partitions)
+    if parts is None:
+        parts = range(num_partitions)
+    groups = df.groupby(part_ids, sort=False).indices
+    staged = {}
+    for part in sorted(set(int(p) for p in parts)):
+        rows = groups.get(part)
+        part_df = df.iloc[rows] if rows is not None else df.iloc[0:0]
+        part_df = part_df.sort_values('vin', kind='mergesort')
+        part_df.to_parquet(_staged_file(store_dir, part, version), index=False)
+        staged[part] = {'file': partition_file(part), **partition_stats(part_df)}
+    return staged
+
+# Publish staged partitions: the manifest (new stats, version bumped once) is written first and lists
+# them as pending, then each staged file replaces its live file. A run that dies part-way leaves the
+# manifest describing the new state; finish_pending_partitions completes the renames before the next
+# read-modify-write, so the version always ends up matching one complete state of the store.
+def commit_partitions(store_dir, num_partitions, version, staged):
+    if not staged:
+        return 0
+    manifest = read_manifest(store_dir) or {'num_partitions': num_partitions, 'partitions': {}}
+    if manifest['num_partitions'] != num_partitions:
+        raise ValueError(f"Store {store_dir} has {manifest['num_partitions']} partitions, expected {num_partitions}")
+    if manifest.get('version', 0) + 1 != version:
+        raise ValueError(f"Store {store_dir} is at version {manifest.get('version', 0)}, staged partitions are for version {version}")
+    for part, entry in staged.items():
+        manifest['partitions'][str(part)] = entry
+    manifest['version'] = version
+    manifest['pending'] = sorted(int(p) for p in staged)
+    write_manifest(store_dir, manifest)
+    finish_pending_partitions(store_dir, manifest)
+    return len(staged)
+
+# Move the staged files of the manifest's pending partitions into place (those already moved are skipped).
+# Returns the manifest.
+def finish_pending_partitions(store_dir, manifest=None):
+    manifest = read_manifest(store_dir) if manifest is None else manifest
+    if manifest is None:
+        return None
+    for part in manifest.get('pending', []):
+        staged = _staged_file(store_dir, part, manifest['version'])
+        if os.path.exists(staged):
+            os.replace(staged, os.path.join(store_dir, partition_file(part)))
+    return manifest
+
+# Rewrite only the given partitions of df; untouched partitions stay on disk as they are.
+# Every save bumps the manifest's version, so readers can tell whether the store changed since they last saw it.
+def save_partitions(store_dir, df, num_partitions, parts=None):
+    version = begin_partition_write(store_dir, num_partitions)
+    staged = stage_partitions(store_dir, df, num_partitions, version, parts)
+    return commit_partitions(store_dir, num_partitions, version, staged)
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.config import DATE_FORMAT
+from core.main_record import load_main_record
+from core.partition_store import staging_dir, swap_in_dir, current_dir
+from core.sold_record import sold_partition_stats, load_sold_record, partition_day, UNKNOWN_DATE
+from core.vin_index import vin_array, vin_array_unsorted, member_mask, merge_vins
+
+# Posting-list (inverted) indexes over the main and sold records: for each make, model and make+model
+# ID (core/make_model_dictionary.py), dealer ID and zip, the sorted row IDs holding it. Row IDs are
+# positions in the record as its loader returns it (main: partitions in order; sold: day files in
+# order). Each field is stored CSR-style as three .npy files (sorted keys, offsets, rows), so a lookup
+# is a searchsorted plus a slice of a memory-mapped array, and a filter combination is an intersection
+# of sorted arrays that only touches the matching rows. The main record's index is rebuilt every run;
+# the sold record only grows, so a new day's rows are appended. Sold postings hold only the first sale
+# of each VIN, as the summaries count them (the indexed VINs are kept next to the postings for the appends).
+POSTINGS_DIR = "state/postings"
+POSTING_FIELDS = {'make': 'make_id', 'model': 'model_id', 'make_model': 'make_model_id', 'dealer': 'mc_dealer_id', 'zip': 'zip'}
+META_FILE = "meta.json"
+VINS_FILE = "vins.npy"
+
+def postings_path(record):
+    return os.path.join(POSTINGS_DIR, record)
+
+# Every indexed field is an integer ID (missing values stay NaN and are not indexed)
+def posting_keys(values):
+    return pd.to_numeric(pd.Series(values, copy=False), errors='coerce')
+
+def _key_array(keys):
+    return np.asarray(keys, dtype='int64')
+
+def _row_dtype(n):
+    return np.int32 if n < 2 ** 31 else np.int64
+
+# CSR postings of one field from the column's values; row IDs start at base, and only rows in mask
+# (all if None) are indexed
+def build_field(values, base=0, n_total=None, mask=None):
+    keys = posting_keys(values)
+    valid = keys.notna().to_numpy()
+    valid = np.flatnonzero(valid & mask if mask is not None else valid)
+    codes, uniques = pd.factorize(keys.iloc[valid], sort=True)
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes, minlength=len(uniques))
+    dtype = _row_dtype(n_total if n_total is not None else base + len(keys))
+    return {
+        'keys': _key_array(uniques),
+        'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'rows': (valid[order] + base).astype(dtype),
+    }
+
+def build_postings(df, base=0, n_total=None, mask=None):
+    return {field: build_field(df[column], base, n_total, mask) for field, column in POSTING_FIELDS.items()}
+
+# Postings of rows appended after the existing ones (all new row IDs are larger), merged per key
+def merge_field(old, new):
+    keys = np.union1d(old['keys'], new['keys'])
+    labels = np.concatenate([
+        np.repeat(np.searchsorted(keys, old['keys']), np.diff(old['offsets'])),
+        np.repeat(np.searchsorted(keys, new['keys']), np.diff(new['offsets'])),
+    ])
+    rows = np.concatenate([old['rows'], new['rows']]).astype(new['rows'].dtype)
+    order = np.argsort(labels, kind='stable')  # old rows stay ahead of new ones within a key
+    counts = np.bincount(labels, minlength=len(keys))
+    return {'keys': _key_array(keys), 'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64), 'rows': rows[order]}
+
+def save_postings(record, postings, meta, vins=None):
+    # Written to a sibling directory and swapped in, like the VIN tracker state
+    path = postings_path(record)
+    tmp_dir = staging_dir(path)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for field, arrays in postings.items():
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{field}_{name}.npy"), np.ascontiguousarray(array))
+    if vins is not None:
+        np.save(os.path.join(tmp_dir, VINS_FILE), vins)
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    swap_in_dir(tmp_dir, path)
+    print(f"[POSTINGS] Postings saved: {record}. Rows: {meta['rows']}, keys: " + ", ".join(f"{field}={len(a['keys'])}" for field, a in postings.items()))
+
+def read_postings_meta(record):
+    path = os.path.join(current_dir(postings_path(record)), META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+# {'meta': ..., field: {'keys', 'offsets', 'rows'}}; rows are memory-mapped unless mmap=False. None if not
+# built, or built over other fields
+def load_postings(record, mmap=True):
+    meta = read_postings_meta(record)
+    if meta is None or meta.get('fields') != list(POSTING_FIELDS):
+        return None
+    postings = {'meta': meta}
+    for field in POSTING_FIELDS:
+        postings[field] = {
+            name: np.load(os.path.join(current_dir(postings_path(record)), f"{field}_{name}.npy"), mmap_mode='r' if mmap and name == 'rows' else None)
+            for name in ('keys', 'offsets', 'rows')
+        }
+    return postings
+
+# Main record postings, rebuilt from the stored record (only the indexed columns are read, so row IDs
+# follow the on-disk order). main_df may be passed if it was read with load_main_record, in that order.
+def update_main_postings(main_df=None):
+    df = load_main_record(columns=list(POSTING_FIELDS.values()), memory_map=True) if main_df is None else main_df
+    postings = build_postings(df)
+    save_postings('main', postings, {'rows': int(len(df)), 'fields': list(POSTING_FIELDS)})
+    return postings
+
+# Sold record postings: when the stored index covers exactly the leading day files, only the new days
+# are read and appended; anything else (first run, a day rewritten, a backfilled day) rebuilds it
+def update_sold_postings():
+    files = sold_partition_stats()
+    meta = read_postings_meta('sold')
+    if meta is not None and meta.get('fields') != list(POSTING_FIELDS):
+        meta = None
+    covered = [tuple(f) for f in meta['files']] if meta is not None else []
+    if meta is not None and covered == files:
+        print("[POSTINGS] Sold postings up to date.")
+        return load_postings('sold')
+    columns = ['vin'] + list(POSTING_FIELDS.values())
+    n_total = sum(rows for _, rows, _ in files)
+    if meta is not None and covered and covered == files[:len(covered)]:
+        new_days = [partition_day(name) for name, _, _ in files[len(covered):]]
+        print(f"[POSTINGS] Appending {len(new_days)} sold day(s) to the sold postings...")
+        df = load_sold_record(new_days[0], new_days[-1], columns=columns)
+        indexed = np.load(os.path.join(current_dir(postings_path('sold')), VINS_FILE))
+        first = ~df['vin'].duplicated().to_numpy() & ~member_mask(vin_array_unsorted(df['vin']), indexed)
+        old = load_postings('sold', mmap=False)
+        postings = {
+            field: merge_field(old[field], build_field(df[column], meta['rows'], n_total, first))
+            for field, column in POSTING_FIELDS.items()
+        }
+        vins = merge_vins(indexed, vin_array(df['vin'][first]))
+    else:
+        print("[POSTINGS] Building sold postings from the sold record...")
+        df = load_sold_record(columns=columns)
+        first = ~df['vin'].duplicated().to_numpy()
+        postings = build_postings(df, n_total=n_total, mask=first)
+        vins = vin_array(df['vin'])
+    save_postings('sold', postings, {'rows': int(n_total), 'fields': list(POSTING_FIELDS), 'files': [list(f) for f in files]}, vins)
+    return postings
+
+# Row-ID range [start, stop) of the sold days in [start_date, end_date] (either bound optional); the
+# day files are contiguous in row-ID order, so a date range is one range of row IDs. The unknown-date
+# file (first, if present) only falls in an unbounded range, as in list_sold_partitions.
+def sold_row_range(postings, start_date=None, end_date=None):
+    files = postings['meta']['files']
+    bounds = np.concatenate([[0], np.cumsum([rows for _, rows, _ in files], dtype=np.int64)])
+    if start_date is None and end_date is None:
+        return 0, int(bounds[-1])
+    lo = pd.Timestamp(start_date).strftime(DATE_FORMAT) if start_date is not None else None
+    hi = pd.Timestamp(end_date).strftime(DATE_FORMAT) if end_date is not None else None
+    selected = [i for i, (name, _, _) in enumerate(files)
+                if partition_day(name) != UNKNOWN_DATE and (lo is None or partition_day(name) >= lo) and (hi is None or partition_day(name) <= hi)]
+    return (int(bounds[selected[0]]), int(bounds[selected[-1] + 1])) if selected else (0, 0)
+
+# Rows of a sorted row-ID array that fall in [start, stop)
+def rows_in_range(rows, start, stop):
+    return rows[np.searchsorted(rows, start):np.searchsorted(rows, stop)]
+
+# Sorted row IDs holding any of the keys
+def lookup(postings, field, keys):
+    arrays = postings[field]
+    keys = np.unique(_key_array(posting_keys(list(keys)).dropna()))
+    pos = np.searchsorted(arrays['keys'], keys)
+    found = pos < len(arrays['keys'])
+    pos = pos[found][arrays['keys'][pos[found]] == keys[found]]
+    parts = [arrays['rows'][arrays['offsets'][p]:arrays['offsets'][p + 1]] for p in pos]
+    if not parts:
+        return np.array([], dtype=arrays['rows'].dtype)
+    return np.asarray(parts[0]) if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+# Intersection of sorted, duplicate-free row-ID arrays; the smaller side is searched in the larger
+def intersect(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a[:0]
+    pos = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[pos] == a]
+
+# Count of `rows` (sorted) per dealer, for the given dealers: each dealer's posting list is searched
+# in rows, so only the dealers' own postings are read. Returns a Series indexed by mc_dealer_id.
+def count_by_dealer(postings, rows, dealer_ids):
+    dealer_ids = pd.Series(dealer_ids, copy=False).dropna().astype('int64').unique()
+    counts = np.zeros(len(dealer_ids), dtype=np.int64)
+    if len(rows):
+        arrays = postings['dealer']
+        for i, dealer_id in enumerate(dealer_ids):
+            p = np.searchsorted(arrays['keys'], dealer_id)
+            if p < len(arrays['keys']) and arrays['keys'][p] == dealer_id:
+                counts[i] = len(intersect(np.asarray(arrays['rows'][arrays['offsets'][p]:arrays['offsets'][p + 1]]), rows))
+    return pd.Series(counts, index=pd.Index(dealer_ids, name='mc_dealer_id'))
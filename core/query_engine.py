@@ -0,0 +1,315 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.sales_cube import query_sales, PERIODS
+from core.dealers import join_dealers
+from core.make_model_dictionary import load_make_model_dictionary, display_names, names_for_ids
+
+# Query engine behind the dashboard. Everything it answers comes from one pre-aggregated fact table:
+# one row per (make, model, dealer) with the current inventory and the sales of every period, held as
+# plain arrays sorted by (make code, model code, dealer). Makes and models are keyed by their dictionary
+# IDs (core/make_model_dictionary.py); selections and results use the IDs' canonical display names,
+# so every spelling of a make or model is one entry. A make or make/model selection is then a
+# contiguous row range found with searchsorted, a dealer's rows are a range of a second (dealer-sorted)
+# order, and a query only touches the selected rows; no frame is copied or merged until the few
+# rows that are displayed get their dealer attributes.
+
+FACT_KEYS = ['make_id', 'model_id', 'mc_dealer_id']
+# Listings and sales without a make or model ID are kept under this ID (and name), so the totals of
+# an unfiltered query match the dealer's sales in the cube; rows without a dealer are left out.
+UNKNOWN_ID = -1
+UNKNOWN_NAME = "(unknown)"
+
+# (codes, distinct values) of a key column
+def _factorize(column, dtype=object):
+    codes, values = pd.factorize(column)
+    return codes, np.asarray(values, dtype=dtype)
+
+# Map each source's local codes onto the sorted union of its values
+def _global_codes(parts):
+    categories = np.unique(np.concatenate([values for _, values in parts]))
+    return categories, [np.searchsorted(categories, values)[codes] for codes, values in parts]
+
+def _fact_rows(df):
+    df = df.dropna(subset=['mc_dealer_id'])
+    return df.assign(make_id=df['make_id'].fillna(UNKNOWN_ID), model_id=df['model_id'].fillna(UNKNOWN_ID))
+
+def _names(ids, names):
+    names = names_for_ids(ids, names)
+    names[ids == UNKNOWN_ID] = UNKNOWN_NAME
+    return names
+
+# inventory_df: main record rows (mc_dealer_id, make_id, model_id); cube: core/sales_cube tables;
+# dictionary: the make/model dictionary (loaded if None), for display names. Keys are factorized to
+# integer codes and the (make, model, dealer) cells summed with bincount, so the rows come out sorted
+# by make, model, dealer without a sort of the rows.
+def build_query_index(inventory_df, cube, dictionary=None):
+    dictionary = load_make_model_dictionary() if dictionary is None else dictionary
+    sources = {'inventory': _fact_rows(inventory_df)}
+    for period in PERIODS:
+        sources[period] = _fact_rows(query_sales(cube, FACT_KEYS, period))
+    make_ids, make_codes = _global_codes([_factorize(df['make_id'], 'int64') for df in sources.values()])
+    model_ids, model_codes = _global_codes([_factorize(df['model_id'], 'int64') for df in sources.values()])
+    makes, models = _names(make_ids, display_names(dictionary, 'makes')), _names(model_ids, display_names(dictionary, 'models'))
+    dealers, dealer_codes = _global_codes([_factorize(df['mc_dealer_id'], 'int64') for df in sources.values()])
+    keys = [(make * len(models) + model) * len(dealers) + dealer for make, model, dealer in zip(make_codes, model_codes, dealer_codes)]
+    cells, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    bounds = np.cumsum([0] + [len(k) for k in keys])
+    counts = {}
+    for i, (name, df) in enumerate(sources.items()):
+        weights = None if name == 'inventory' else df['sales_count'].to_numpy(dtype='float64')
+        counts[name] = np.bincount(inverse[bounds[i]:bounds[i + 1]], weights=weights, minlength=len(cells)).astype(np.int32)
+    key, dealer_code = np.divmod(cells, len(dealers))
+    dealer_code = dealer_code.astype(np.int32)
+    dealer_order = np.argsort(dealer_code, kind='stable')
+    index = {
+        # Display names by code (codes follow the sorted IDs, so names are not sorted)
+        'makes': makes,
+        'models': models,
+        'make_ids': make_ids,
+        'model_ids': model_ids,
+        'dealers': dealers,
+        'key': key,
+        'make_code': (key // len(models)).astype(np.int32),
+        'model_code': (key % len(models)).astype(np.int32),
+        'dealer_code': dealer_code,
+        'inventory': counts['inventory'],
+        'sales': {period: counts[period] for period in PERIODS},
+        # Rows of dealer d are dealer_order[dealer_starts[d]:dealer_starts[d + 1]]
+        'dealer_order': dealer_order,
+        'dealer_starts': np.searchsorted(dealer_code[dealer_order], np.arange(len(dealers) + 1)),
+    }
+    # Inventory per dealer over every row, for queries without a make/model/area selection
+    index['dealer_inventory'] = np.bincount(dealer_code, weights=index['inventory'], minlength=len(dealers)).astype(np.int64)
+    # ... and, per period, the rows with sales ranked by sales ascending: a sales range is then a slice
+    index['ranked'] = {}
+    for period in PERIODS:
+        sales = counts[period]
+        ranked = np.flatnonzero(sales > 0)
+        ranked = ranked[np.argsort(sales[ranked], kind='stable')]
+        index['ranked'][period] = {
+            'rows': ranked.astype(np.int32),
+            'sales': sales[ranked],
+            'inventory': index['dealer_inventory'][dealer_code[ranked]].astype(np.int32),
+        }
+    print(f"[QUERY] Index built. Rows: {len(cells)}, makes: {len(makes)}, models: {len(models)}, dealers: {len(dealers)}")
+    return index
+
+# Codes of the given display names, sorted (names not in the index are skipped)
+def _codes(values, names):
+    return np.flatnonzero(np.isin(names, np.asarray(list(values), dtype=object)))
+
+def _codes_int(values, categories):
+    values = np.asarray(values, dtype='int64')
+    pos = np.minimum(np.searchsorted(categories, values), max(len(categories) - 1, 0))
+    return pos[categories[pos] == values] if len(categories) else pos[:0]
+
+def _ranges(starts, ends):
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+# Row ids for a make/model selection (empty selection = everything), in fact-table order
+def select_rows(index, makes=None, models=None):
+    n_models = len(index['models'])
+    make_codes = _codes(makes, index['makes']) if makes else None
+    model_codes = _codes(models, index['models']) if models else None
+    if make_codes is None and model_codes is None:
+        return np.arange(len(index['key']))
+    if make_codes is None:
+        mask = np.zeros(n_models, dtype=bool)
+        mask[model_codes] = True
+        return np.flatnonzero(mask[index['model_code']])
+    if model_codes is None:
+        lo, hi = make_codes * n_models, (make_codes + 1) * n_models
+    else:
+        lo = (make_codes[:, None] * n_models + model_codes[None, :]).ravel()
+        hi = lo + 1
+    return _ranges(np.searchsorted(index['key'], lo, side='left'), np.searchsorted(index['key'], hi, side='left'))
+
+# Names of the models present for the given makes (all models if none), sorted
+def models_for_makes(index, makes=None):
+    rows = select_rows(index, makes)
+    return sorted(index['models'][np.unique(index['model_code'][rows])].tolist())
+
+# Row ids of the given dealers, from the dealer-sorted order
+def dealer_rows(index, dealer_ids):
+    codes = np.unique(_codes_int(pd.Series(dealer_ids).dropna().to_numpy(dtype='int64'), index['dealers']))
+    starts = index['dealer_starts']
+    return index['dealer_order'][_ranges(starts[codes], starts[codes + 1])]
+
+# Answer a filter spec: dict with period, makes, models, area_dealers (dealer IDs or None), dealer,
+# min_sales, max_sales, top_n (None = all). Returns the matching (make, model, dealer) rows with their
+# sales and the dealer's inventory of the selected makes/models, totals over all matching rows, and the
+# client dealer's own matching rows under 'client'. Rows are only ordered (by top_positions) when shown,
+# so a top-N view never sorts the whole match.
+def run_query(index, spec):
+    makes, models, area = spec.get('makes'), spec.get('models'), spec.get('area_dealers')
+    period = spec.get('period', PERIODS[0])
+    min_sales = max(spec.get('min_sales', 0), 1)  # the cube only holds sales
+    max_sales = spec.get('max_sales')
+    if area is None and not makes and not models:
+        # No selection: the sales range is a slice of the period's ranking, read backwards (best first)
+        ranked = index['ranked'][period]
+        lo = np.searchsorted(ranked['sales'], min_sales, side='left')
+        hi = np.searchsorted(ranked['sales'], max_sales, side='right') if max_sales is not None else len(ranked['sales'])
+        take = slice(hi - 1, lo - 1 if lo > 0 else None, -1) if hi > lo else slice(0, 0)
+        rows, sales, current_inventory = ranked['rows'][take], ranked['sales'][take], ranked['inventory'][take]
+        inventory, ordered = index['dealer_inventory'], True
+    else:
+        if not makes and not models:
+            # Area only: read the area dealers' row ranges instead of scanning every row
+            rows = dealer_rows(index, area)
+        else:
+            rows = select_rows(index, makes, models)
+            if area is not None:
+                rows = rows[_in_area(index, area)[index['dealer_code'][rows]]]
+        dealer_code = index['dealer_code'][rows]
+        # Inventory of the selected makes/models per dealer (all selected rows, with or without sales)
+        inventory = np.bincount(dealer_code, weights=index['inventory'][rows], minlength=len(index['dealers'])).astype(np.int64)
+        sales = index['sales'][period][rows]
+        hit = _sales_mask(sales, min_sales, max_sales)
+        rows, sales = rows[hit], sales[hit]
+        current_inventory, ordered = inventory[dealer_code[hit]], False
+    result = {
+        'rows': rows,
+        'sales_count': sales,
+        'current_inventory': current_inventory,
+        'ordered': ordered,
+        'total_rows': len(rows),
+        'total_sales': int(sales.sum()),
+        'total_inventory': int(current_inventory.sum()),
+        'top_n': spec.get('top_n'),
+    }
+    if spec.get('dealer') is not None:
+        result['client'] = _client_rows(index, spec, inventory, min_sales, max_sales)
+    return result
+
+def _in_area(index, area):
+    in_area = np.zeros(len(index['dealers']), dtype=bool)
+    in_area[_codes_int(pd.Series(area).dropna().to_numpy(dtype='int64'), index['dealers'])] = True
+    return in_area
+
+def _sales_mask(sales, min_sales, max_sales):
+    hit = sales >= min_sales
+    if max_sales is not None:
+        hit &= sales <= max_sales
+    return hit
+
+# The client dealer's matching rows, checked on its own row range rather than found in the result
+def _client_rows(index, spec, inventory, min_sales, max_sales):
+    makes, models, area = spec.get('makes'), spec.get('models'), spec.get('area_dealers')
+    rows = dealer_rows(index, [spec['dealer']])
+    keep = np.ones(len(rows), dtype=bool)
+    if makes:
+        keep &= np.isin(index['make_code'][rows], _codes(makes, index['makes']))
+    if models:
+        keep &= np.isin(index['model_code'][rows], _codes(models, index['models']))
+    if area is not None:
+        keep &= _in_area(index, area)[index['dealer_code'][rows]]
+    sales = index['sales'][spec.get('period', PERIODS[0])][rows]
+    keep &= _sales_mask(sales, min_sales, max_sales)
+    rows = rows[keep]
+    return {
+        'rows': rows,
+        'sales_count': sales[keep],
+        'current_inventory': inventory[index['dealer_code'][rows]],
+        'ordered': False,
+        'top_n': None,
+    }
+
+# Positions of the n best-selling rows of a result (all rows if n is None), by sales_count descending
+def top_positions(result, n=None):
+    sales = result['sales_count']
+    if result['ordered']:
+        return np.arange(len(sales) if n is None else min(n, len(sales)))
+    if n is not None and n < len(sales):
+        candidates = np.argpartition(-sales, n - 1)[:n]
+        return candidates[np.argsort(-sales[candidates], kind='stable')]
+    return np.argsort(-sales, kind='stable')
+
+# Positions (into the result) of rows start..stop of the result ordered by `by` (a result column, or
+# per-dealer values from dealer_sort_values), ties broken by position. With a top_n only the top_n rows
+# by sales are paged. Only the rows up to `stop` are ordered, so a page never sorts the whole result.
+def page_positions(index, result, start, stop, by='sales_count', ascending=False, dealer_values=None):
+    pool = top_positions(result, result['top_n']) if result['top_n'] is not None else None
+    if pool is None and by == 'sales_count' and not ascending and result['ordered']:
+        n = len(result['rows'])
+        return np.arange(min(start, n), min(stop, n))
+    positions = slice(None) if pool is None else pool
+    if by in ('sales_count', 'current_inventory'):
+        key = result[by][positions].astype('float64')
+    else:
+        key = dealer_values[index['dealer_code'][result['rows'][positions]]]
+    order = _smallest(key if ascending else -key, stop)[start:stop]
+    return order if pool is None else pool[order]
+
+# Positions of the n smallest keys in (key, position) order; missing keys (NaN) come last
+def _smallest(key, n):
+    if n < len(key):
+        kth = np.partition(key, n - 1)[n - 1]
+        if np.isnan(kth):
+            below, ties = np.flatnonzero(~np.isnan(key)), np.flatnonzero(np.isnan(key))
+        else:
+            below, ties = np.flatnonzero(key < kth), np.flatnonzero(key == kth)
+        candidates = np.concatenate([below, ties[:n - len(below)]])
+    else:
+        candidates = np.arange(len(key))
+    return candidates[np.lexsort((candidates, key[candidates]))]
+
+# Sort values per index dealer for page_positions, from a Series indexed by mc_dealer_id (a dealer
+# attribute or a distance); strings sort by their rank. Dealers without a value get NaN.
+def dealer_sort_values(index, values):
+    values = values[values.index.notna()]
+    if not pd.api.types.is_numeric_dtype(values):
+        values = values.astype(object).where(values.notna()).rank(method='dense')
+    out = np.full(len(index['dealers']), np.nan)
+    ids = values.index.to_numpy(dtype='int64')
+    pos = np.minimum(np.searchsorted(index['dealers'], ids), max(len(index['dealers']) - 1, 0))
+    found = index['dealers'][pos] == ids if len(index['dealers']) else np.zeros(len(ids), dtype=bool)
+    out[pos[found]] = values.to_numpy(dtype='float64')[found]
+    return out
+
+# Frame of result rows (positions into the result, default: its top_n by sales) with dealer attributes,
+# and distance_miles if an area (dealers_within result) is given. Only these rows are materialized and
+# joined to the dealer dimension. Also takes result['client'].
+def result_frame(index, result, dealer_dim, positions=None, area=None):
+    if positions is None:
+        positions = top_positions(result, result['top_n'])
+    rows = result['rows'][positions]
+    df = pd.DataFrame({
+        'mc_dealer_id': pd.array(index['dealers'][index['dealer_code'][rows]], dtype='Int64'),
+        'neo_make': index['makes'][index['make_code'][rows]],
+        'neo_model': index['models'][index['model_code'][rows]],
+        'sales_count': result['sales_count'][positions],
+        'current_inventory': result['current_inventory'][positions],
+    })
+    df = join_dealers(df, dealer_dim)
+    if area is not None:
+        df = df.merge(area, on='mc_dealer_id', how='left')
+    return df
+
+EXPORT_CHUNK_ROWS = 100_000
+
+# Write every row of a result (top_n only, if set), best-selling first, to path as 'csv' or 'parquet'.
+# Rows are materialized EXPORT_CHUNK_ROWS at a time, so memory stays bounded on large results.
+def export_result(index, result, dealer_dim, path, fmt='csv', area=None):
+    positions = top_positions(result, result['top_n'])
+    writer = None
+    try:
+        for start in range(0, max(len(positions), 1), EXPORT_CHUNK_ROWS):
+            chunk = result_frame(index, result, dealer_dim, positions[start:start + EXPORT_CHUNK_ROWS], area)
+            if fmt == 'csv':
+                chunk.to_csv(path, index=False, header=start == 0, mode='w' if start == 0 else 'a')
+                continue
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    print(f"[QUERY] Exported {len(positions)} rows to {path}")
+    return path
@@ -0,0 +1,125 @@
+import pandas as pd
+import json
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.sold_record import load_sold_record
+from core.schema import enforce_schema, concat_frames
+
+# Monthly sales cube built from the sold record's sold_date, plus rollups of it. Every table holds
+# sales_count per key and month, so a period filter is a month-range sum over a few small tables
+# instead of a rescan of the sold record. Like the dealer summaries, the tables are extended with
+# each day's newly sold VINs (core/summarizer.update_dealer_summaries) and can be rebuilt in full.
+# Makes and models are keyed by their dictionary IDs (core/make_model_dictionary.py), so every spelling
+# of a make or model adds to the same rows; readers take display names from the dictionary.
+# Sales with a missing key (no make/model ID, inventory type, zip or sold month) keep it as a null key
+# of their own, so every table adds up to the same number of sales.
+SALES_CUBE_DIR = "state/sales_cube"
+LAYOUT_PATH = os.path.join(SALES_CUBE_DIR, "_layout.json")
+# Bumped when the tables change meaning; a stored cube of another layout is rebuilt
+CUBE_LAYOUT_VERSION = 2
+CUBE_TABLES = {
+    'cube': ['mc_dealer_id', 'make_id', 'model_id', 'inventory_type'],
+    'dealer_month': ['mc_dealer_id'],
+    'model_month': ['make_id', 'model_id'],
+    'zip_month': ['zip', 'inventory_type'],
+}
+CUBE_COLUMNS = ['vin', 'mc_dealer_id', 'make_id', 'model_id', 'inventory_type', 'zip', 'sold_date']
+PERIODS = ["All Time", "Last 3 Months", "Rolling 12", "YTD"]
+
+def cube_path(name):
+    return os.path.join(SALES_CUBE_DIR, f"{name}.parquet")
+
+# Sales per key and month for each table, from sold rows (already deduplicated by VIN)
+def cube_tables(sold_df):
+    sold_df = sold_df.assign(month=sold_df['sold_date'].values.astype('datetime64[M]').astype('datetime64[ns]'))
+    return {
+        name: sold_df.groupby(keys + ['month'], observed=True, dropna=False).size().reset_index(name='sales_count')
+        for name, keys in CUBE_TABLES.items()
+    }
+
+def save_sales_cube(tables):
+    os.makedirs(SALES_CUBE_DIR, exist_ok=True)
+    for name, df in tables.items():
+        tmp = os.path.join(SALES_CUBE_DIR, f"_{name}.parquet.tmp")
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, cube_path(name))
+    with open(LAYOUT_PATH + ".tmp", "w") as f:
+        json.dump({'version': CUBE_LAYOUT_VERSION}, f)
+    os.replace(LAYOUT_PATH + ".tmp", LAYOUT_PATH)
+    print(f"[CUBE] Sales cube saved. Rows: " + ", ".join(f"{name}={len(df)}" for name, df in tables.items()))
+
+def _layout_version():
+    try:
+        with open(LAYOUT_PATH) as f:
+            return json.load(f).get('version')
+    except (OSError, ValueError):
+        return None
+
+# Tables by name; None if the cube has not been built yet, or was built with other keys or an older
+# layout (it is then rebuilt)
+def load_sales_cube():
+    if not all(os.path.exists(cube_path(name)) for name in CUBE_TABLES):
+        return None
+    if _layout_version() != CUBE_LAYOUT_VERSION:
+        print("[CUBE] Stored sales cube has an older layout.")
+        return None
+    tables = {name: enforce_schema(pd.read_parquet(cube_path(name))) for name in CUBE_TABLES}
+    if any(not set(keys).issubset(tables[name].columns) for name, keys in CUBE_TABLES.items()):
+        print("[CUBE] Stored sales cube has an older layout.")
+        return None
+    return tables
+
+# Full rebuild from the sold record (a VIN sold more than once counts at its first sale, as in the summaries).
+# sold_df is read from disk unless the caller passes it.
+def build_sales_cube(sold_df=None):
+    print("[CUBE] Building sales cube from the sold record...")
+    if sold_df is None:
+        sold_df = load_sold_record(columns=CUBE_COLUMNS)
+    tables = cube_tables(sold_df.drop_duplicates('vin', keep='first'))
+    save_sales_cube(tables)
+    return tables
+
+# Add newly sold rows to the stored cube (built in full if it does not exist yet)
+def add_to_sales_cube(new_sold):
+    tables = load_sales_cube()
+    if tables is None:
+        return build_sales_cube()
+    if len(new_sold) == 0:
+        return tables
+    for name, delta in cube_tables(new_sold).items():
+        keys = CUBE_TABLES[name] + ['month']
+        combined = concat_frames([tables[name], delta], ignore_index=True)
+        tables[name] = combined.groupby(keys, observed=True, dropna=False)['sales_count'].sum().reset_index()
+    save_sales_cube(tables)
+    return tables
+
+# First and last month (inclusive) of a named period, relative to the month of as_of.
+# "All Time" has no bounds.
+def period_months(period, as_of):
+    end = pd.Timestamp(as_of).to_period('M')
+    if period == "All Time":
+        return None, None
+    if period == "Last 3 Months":
+        start = end - 2
+    elif period == "Rolling 12":
+        start = end - 11
+    elif period == "YTD":
+        start = pd.Period(year=end.year, month=1, freq='M')
+    else:
+        raise ValueError(f"Unknown period: {period}")
+    return start.to_timestamp(), end.to_timestamp()
+
+# Latest month with sales in the cube; periods are anchored there so a stale dataset still shows data
+def latest_month(tables):
+    months = tables['cube']['month']
+    return months.max() if len(months) else pd.Timestamp.today()
+
+# Sales per `by` keys over a period, summed from one cube table (e.g. by=['mc_dealer_id'] on dealer_month).
+# Null keys are kept as their own group.
+def query_sales(tables, by, period="All Time", table='cube', as_of=None):
+    df = tables[table]
+    start, end = period_months(period, latest_month(tables) if as_of is None else as_of)
+    if start is not None:
+        months = df['month'].values
+        df = df[(months >= start.to_datetime64()) & (months <= end.to_datetime64())]
+    return df.groupby(by, observed=True, dropna=False)['sales_count'].sum().reset_index()
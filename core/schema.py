@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.config import COLUMN_DTYPES
+
+# Schema layer: turns the declarations in core/config.COLUMN_DTYPES into pandas and Arrow types
+
+ARROW_TYPES = {
+    'str': pa.string(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+    'Int64': pa.int64(),
+    'Int32': pa.int32(),
+    'Int16': pa.int16(),
+    'float64': pa.float64(),
+    'datetime64[ns]': pa.timestamp('ns'),
+}
+
+def column_dtype(col):
+    return COLUMN_DTYPES.get(col)
+
+# Arrow schema for the given columns (all declared columns if None)
+def arrow_schema(columns=None):
+    columns = columns if columns is not None else list(COLUMN_DTYPES)
+    return pa.schema([(col, ARROW_TYPES[COLUMN_DTYPES[col]]) for col in columns if col in COLUMN_DTYPES])
+
+def has_dtype(series, dtype):
+    if dtype == 'category':
+        return isinstance(series.dtype, pd.CategoricalDtype)
+    if dtype.startswith('datetime64'):
+        return pd.api.types.is_datetime64_any_dtype(series.dtype)
+    if dtype == 'str':
+        return pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)
+    return str(series.dtype) == dtype
+
+def convert_column(series, dtype):
+    if dtype == 'category':
+        return series.astype('category')
+    if dtype.startswith('Int'):
+        values = pd.to_numeric(series, errors='coerce')
+        # Non-integral numbers cannot be held by an integer column
+        values = values.where(values.isna() | (values % 1 == 0))
+        info = np.iinfo(dtype.lower())
+        values = values.where(values.isna() | values.between(info.min, info.max))
+        return values.astype(dtype)
+    if dtype == 'float64':
+        return pd.to_numeric(series, errors='coerce').astype('float64')
+    if dtype.startswith('datetime64'):
+        return pd.to_datetime(series, errors='coerce')
+    return series.astype(str).where(series.notna(), None)
+
+# Per-column rejection counts accumulated over a whole file (values that were present but failed to parse)
+class CoercionReport:
+    def __init__(self):
+        self.rows = 0
+        self.rejected = {}
+
+    def add(self, rows, rejected):
+        self.rows += rows
+        for col, count in rejected.items():
+            self.rejected[col] = self.rejected.get(col, 0) + count
+
+    def to_frame(self):
+        return pd.DataFrame(
+            [{'column': col, 'rejected': count, 'rejected_pct': round(100 * count / max(self.rows, 1), 4)}
+             for col, count in sorted(self.rejected.items())],
+            columns=['column', 'rejected', 'rejected_pct'])
+
+    def log(self, tag):
+        if not self.rejected:
+            print(f"{tag} Type coercion: {self.rows} rows, no rejected values.")
+            return
+        print(f"{tag} Type coercion: {self.rows} rows, rejected values per column:")
+        for col, count in sorted(self.rejected.items()):
+            print(f"{tag}   {col}: {count}")
+
+# Resolve the converter for every column once; the returned function parses each column a single time
+# into its target type and counts the values that could not be parsed.
+def compile_coercer(columns=None):
+    columns = columns if columns is not None else list(COLUMN_DTYPES)
+    plan = [(col, COLUMN_DTYPES[col]) for col in columns if col in COLUMN_DTYPES]
+    # str/category conversions cannot reject a value, so their counts are skipped
+    checked = {col for col, dtype in plan if dtype not in ('str', 'category')}
+
+    def coerce(df, report=None):
+        rejected = {}
+        for col, dtype in plan:
+            if col not in df.columns or has_dtype(df[col], dtype):
+                continue
+            raw = df[col]
+            typed = convert_column(raw, dtype)
+            if col in checked:
+                bad = int((raw.notna() & typed.isna()).sum())
+                if bad:
+                    rejected[col] = bad
+            df[col] = typed
+        if report is not None:
+            report.add(len(df), rejected)
+        return df, rejected
+    return coerce
+
+_default_coercer = compile_coercer()
+
+# Bring every declared column of df to its schema type (columns already typed are left alone)
+def enforce_schema(df):
+    return _default_coercer(df)[0]
+
+# Cast a record batch to the target Arrow schema. Values that fail the fast Arrow cast are handled
+# by the pandas converters for that column only (they become null and are counted in report).
+def cast_record_batch(batch, target, report=None):
+    arrays = []
+    rejected = {}
+    for field in target:
+        arr = batch.column(batch.schema.get_field_index(field.name))
+        if not arr.type.equals(field.type):
+            try:
+                arr = pc.cast(arr, field.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                typed = convert_column(arr.to_pandas(), COLUMN_DTYPES[field.name])
+                bad = int(typed.isna().sum()) - arr.null_count
+                if bad:
+                    rejected[field.name] = bad
+                arr = pa.Array.from_pandas(typed, type=field.type)
+        arrays.append(arr)
+    if report is not None:
+        report.add(batch.num_rows, rejected)
+    return pa.RecordBatch.from_arrays(arrays, schema=target)
+
+# Arrow -> pandas without going through object columns: dictionaries become categoricals,
+# integers become nullable Int*, strings stay Arrow-backed
+_PANDAS_TYPES = {
+    pa.int64(): pd.Int64Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.string(): pd.StringDtype('pyarrow'),
+}
+
+def arrow_to_pandas(data):
+    return data.to_pandas(types_mapper=_PANDAS_TYPES.get)
+
+# pd.concat falls back to object when categoricals have different categories; union them first
+def concat_frames(frames, **kwargs):
+    frames = [f for f in frames if f is not None]
+    if len(frames) > 1:
+        for col in frames[0].columns:
+            if not all(col in f.columns and isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+                continue
+            categories = frames[0][col].cat.categories
+            for f in frames[1:]:
+                categories = categories.union(f[col].cat.categories)
+            frames = [f.assign(**{col: f[col].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, **kwargs)
@@ -1,46 +1,131 @@
 import pandas as pd
+import pyarrow.parquet as pq
 import os
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from core.config import ESSENTIAL_COLUMNS, COLUMN_DTYPES
-
-SOLD_RECORD_PATH = "state/sold_record.parquet"
-
-def enforce_types(df):
-    for col, dtype in COLUMN_DTYPES.items():
-        if col in df.columns:
-            if dtype is int:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(-1).astype(int)
-            elif dtype is float:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            else:
-                df[col] = df[col].astype(dtype, errors='ignore')
-            if df[col].isnull().any():
-                print(f"Warning: Nulls found in column {col} after type conversion.")
-    return df
-
-# Load the sold record
-def load_sold_record():
-    if os.path.exists(SOLD_RECORD_PATH):
-        return pd.read_parquet(SOLD_RECORD_PATH)
-    else:
-        return pd.DataFrame(columns=ESSENTIAL_COLUMNS + ['sold_date'])
+from core.config import ESSENTIAL_COLUMNS, MAKE_MODEL_ID_COLUMNS, DATE_FORMAT
+from core.schema import enforce_schema, concat_frames
+from core.make_model_dictionary import assign_make_model_ids, load_make_model_dictionary
+from core.main_record import load_main_record, load_main_record_vins
+from core.vin_index import vin_array, vin_array_unsorted, member_mask, absent_vins, load_active_vins, save_active_vins
+
+# The sold record only grows, so it is stored append-only: one parquet file per sold_date.
+# A day's run writes (or rewrites) only its own file, and readers pick files by date from their names.
+SOLD_RECORD_PATH = "state/sold_record"
+LEGACY_SOLD_RECORD_PATH = "state/sold_record.parquet"  # single file, split into partitions on first use
+# Legacy rows without a sold_date: kept in their own file, read only when no date range is asked for
+UNKNOWN_DATE = "unknown"
+
+def sold_partition_file(sold_date):
+    day = UNKNOWN_DATE if pd.isna(sold_date) else pd.Timestamp(sold_date).strftime(DATE_FORMAT)
+    return f"sold_{day}.parquet"
+
+# Day of a partition file ('YYYY-MM-DD', or UNKNOWN_DATE)
+def partition_day(path):
+    return os.path.basename(path)[len("sold_"):-len(".parquet")]
+
+# Partition files whose sold_date lies in [start_date, end_date] (either bound optional), oldest first.
+# The unknown-date file is listed first, and only when neither bound is given.
+def list_sold_partitions(start_date=None, end_date=None):
+    migrate_legacy_sold_record()
+    if not os.path.isdir(SOLD_RECORD_PATH):
+        return []
+    start = pd.Timestamp(start_date).strftime(DATE_FORMAT) if start_date is not None else None
+    end = pd.Timestamp(end_date).strftime(DATE_FORMAT) if end_date is not None else None
+    files = []
+    for f in sorted(os.listdir(SOLD_RECORD_PATH)):
+        if not (f.startswith("sold_") and f.endswith(".parquet")):
+            continue
+        day = partition_day(f)
+        if day == UNKNOWN_DATE:
+            if start is None and end is None:
+                files.insert(0, os.path.join(SOLD_RECORD_PATH, f))
+        elif (start is None or day >= start) and (end is None or day <= end):
+            files.append(os.path.join(SOLD_RECORD_PATH, f))
+    return files
+
+def empty_sold_record(columns=None):
+    df = enforce_schema(pd.DataFrame(columns=ESSENTIAL_COLUMNS + MAKE_MODEL_ID_COLUMNS + ['sold_date']))
+    return df[columns] if columns is not None else df
+
+# Load the sold record, optionally only a sold_date range and a subset of columns
+def load_sold_record(start_date=None, end_date=None, columns=None):
+    return load_sold_partitions(list_sold_partitions(start_date, end_date), columns=columns)
 
-def save_sold_record(df):
-    os.makedirs(os.path.dirname(SOLD_RECORD_PATH), exist_ok=True)
-    df = enforce_types(df)
-    df.to_parquet(SOLD_RECORD_PATH, index=False)
+# Load the given partition files (paths, or file names under SOLD_RECORD_PATH), in the order given
+def load_sold_partitions(files, columns=None):
+    if not files:
+        return empty_sold_record(columns)
+    frames = [pd.read_parquet(os.path.join(SOLD_RECORD_PATH, os.path.basename(f)), columns=columns) for f in files]
+    return enforce_schema(concat_frames(frames, ignore_index=True))
 
-# Update sold record: find VINs in main_df but not in today_df, mark as sold
+# (file name, rows, mtime) of each partition, in list_sold_partitions order; a day rewritten by a rerun
+# no longer matches its earlier entry. Derived indexes record these to tell which days they cover.
+def sold_partition_stats():
+    return [(os.path.basename(f), pq.ParquetFile(f).metadata.num_rows, os.stat(f).st_mtime_ns) for f in list_sold_partitions()]
+
+# Row count from parquet footers only, no data is read
+def count_sold_records(start_date=None, end_date=None):
+    return sum(pq.ParquetFile(f).metadata.num_rows for f in list_sold_partitions(start_date, end_date))
+
+def save_sold_partition(df, sold_date):
+    os.makedirs(SOLD_RECORD_PATH, exist_ok=True)
+    path = os.path.join(SOLD_RECORD_PATH, sold_partition_file(sold_date))
+    tmp = os.path.join(SOLD_RECORD_PATH, "_" + sold_partition_file(sold_date) + ".tmp")
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+    print(f"[SOLD] Sold partition saved: {path} (rows: {len(df)})")
+
+def migrate_legacy_sold_record():
+    if os.path.isdir(SOLD_RECORD_PATH) or not os.path.exists(LEGACY_SOLD_RECORD_PATH):
+        return
+    print(f"[SOLD] Splitting legacy {LEGACY_SOLD_RECORD_PATH} into per-day partitions...")
+    legacy = enforce_schema(pd.read_parquet(LEGACY_SOLD_RECORD_PATH))
+    for sold_date, rows in legacy.groupby(legacy['sold_date'].dt.normalize()):
+        save_sold_partition(rows, sold_date)
+    # groupby skips NaT keys; those rows are kept rather than lost in the split
+    undated = legacy[legacy['sold_date'].isna()]
+    if len(undated):
+        print(f"[SOLD] {len(undated)} legacy rows have no sold_date; writing them to {sold_partition_file(None)}")
+        save_sold_partition(undated, None)
+    os.makedirs(SOLD_RECORD_PATH, exist_ok=True)
+
+# Day files written before make/model IDs existed get them once (rows come from the main record, so
+# later days carry the IDs already)
+def add_make_model_ids_to_sold_record():
+    missing = [f for f in list_sold_partitions() if 'make_model_id' not in pq.read_schema(f).names]
+    if not missing:
+        return
+    print(f"[SOLD] Adding make/model IDs to {len(missing)} sold partitions...")
+    dictionary = load_make_model_dictionary()
+    for f in missing:
+        df = assign_make_model_ids(enforce_schema(pd.read_parquet(f)), dictionary)
+        day = partition_day(f)
+        save_sold_partition(df, None if day == UNKNOWN_DATE else day)
+
+# Update sold record: VINs active in the previous feed (state/active_vins.npy) but absent from today_df are sold.
+# On the first run there is no index yet, so every VIN in the main record that is not in today's feed counts.
+# The sold rows are taken from main_df if given, otherwise read from only the main record partitions that
+# hold the sold VINs. Only today's partition is written; returns today's sold rows.
 def update_sold_record(main_df, today_df, today_date):
-    today_vins = set(today_df['vin'])
-    main_vins = set(main_df['vin'])
-    sold_vins = main_vins - today_vins
-    if not sold_vins:
-        return load_sold_record()
-    sold_rows = main_df[main_df['vin'].isin(sold_vins)].copy()
-    sold_rows['sold_date'] = today_date
-    sold_record = load_sold_record()
-    sold_record = pd.concat([sold_record, sold_rows], ignore_index=True)
-    save_sold_record(sold_record)
-    return sold_record 
\ No newline at end of file
+    migrate_legacy_sold_record()
+    add_make_model_ids_to_sold_record()
+    today_vins = vin_array(today_df['vin'])
+    prev_vins = load_active_vins()
+    if prev_vins is None:
+        print("[SOLD] No active VIN index found. Bootstrapping from the main record.")
+        prev_vins = vin_array((main_df if main_df is not None else load_main_record(columns=['vin'], memory_map=True))['vin'])
+    sold_vins = absent_vins(prev_vins, today_vins)
+    print(f"[SOLD] Active yesterday: {len(prev_vins)}, today: {len(today_vins)}, sold: {len(sold_vins)}")
+    if len(sold_vins) == 0:
+        save_active_vins(today_vins)
+        return empty_sold_record()
+    if main_df is None:
+        sold_rows = load_main_record_vins(sold_vins.astype(str)).reset_index(drop=True)
+    else:
+        sold_rows = main_df[member_mask(vin_array_unsorted(main_df['vin']), sold_vins)].reset_index(drop=True)
+    sold_rows['sold_date'] = pd.Timestamp(today_date)
+    save_sold_partition(sold_rows, today_date)
+    # Advance the index only after the sold rows are safely written
+    save_active_vins(today_vins)
+    return sold_rows
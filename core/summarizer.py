@@ -1,48 +1,204 @@
 import pandas as pd
+import pyarrow.parquet as pq
+import json
 import os
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from core.main_record import load_main_record
-from core.sold_record import load_sold_record
+from core.main_record import load_main_record, main_record_version
+from core.sold_record import load_sold_record, load_sold_partitions, sold_partition_stats
+from core.schema import enforce_schema
+from core.sales_cube import build_sales_cube, add_to_sales_cube, cube_tables, cube_path, CUBE_TABLES, CUBE_COLUMNS
+from core.vin_index import vin_array, vin_array_unsorted, member_mask, merge_vins, load_vin_array, save_vin_array
 
 SUMMARY_PATH = "state/dealer_sales_summary.parquet"
 BY_MODEL_PATH = "state/dealer_sales_by_model.parquet"
+# Makes and models by dictionary ID, so spellings of one make/model count together; make_model_id is
+# determined by the pair, so carrying it as a key does not split any counts
+BY_MODEL_KEYS = ['mc_dealer_id', 'make_id', 'model_id', 'make_model_id']
+# Sold record columns read by a full rebuild (cube and both summaries)
+SOLD_SUMMARY_COLUMNS = CUBE_COLUMNS + ['make_model_id']
+# Sorted VINs already counted in the sales summaries, so a VIN that is sold twice is only counted once
+COUNTED_SOLD_VINS_PATH = "state/summary_sold_vins.npy"
+# What the stored summaries cover: the sold day files applied (name, rows, mtime) and the main record version
+SUMMARY_WATERMARK_PATH = "state/summary_watermark.json"
 
-# Update dealer sales summary (total and sold cars by dealer)
-def update_dealer_sales_summary():
-    print("[SUMMARY] Loading main and sold records...")
-    main_df = load_main_record()
-    sold_df = load_sold_record()
-    print(f"[SUMMARY] Main record rows: {len(main_df)}, Sold record rows: {len(sold_df)}")
+# The summaries are maintained from each day's delta (update_dealer_summaries): newly sold VINs add to
+# total_sold/sales_count and to the monthly sales cube (core/sales_cube.py), and the main record's
+# per-dealer row changes adjust active_inventory.
+# The main and sold records are written before the summaries, so the watermark is what ties them together:
+# it is removed before the summary tables are written and saved after them. Sold days the watermark does
+# not cover (e.g. of a run that died before its summary step) are applied on the next run, and a main
+# record version it does not match makes active_inventory be recounted; without a watermark (a run died
+# while writing the tables) everything is rebuilt.
+# The update_* functions below rebuild them from the full records and stay available for verification.
+
+def read_watermark():
+    if not os.path.exists(SUMMARY_WATERMARK_PATH):
+        return None
+    with open(SUMMARY_WATERMARK_PATH) as f:
+        return json.load(f)
+
+def save_watermark(sold_files, main_version):
+    tmp = SUMMARY_WATERMARK_PATH + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'sold_files': [list(f) for f in sold_files], 'main_version': main_version}, f)
+    os.replace(tmp, SUMMARY_WATERMARK_PATH)
+
+def clear_watermark():
+    if os.path.exists(SUMMARY_WATERMARK_PATH):
+        os.remove(SUMMARY_WATERMARK_PATH)
+
+def save_summary(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_parquet(path, index=False)
+
+# Active inventory and total sold by dealer, from the full main and sold records
+def dealer_sales_summary(main_df, sold_df):
     # Deduplicate by VIN in both
     main_df = main_df.drop_duplicates('vin', keep='first')
     sold_df = sold_df.drop_duplicates('vin', keep='first')
     # Total inventory by dealer
-    inv_summary = main_df.groupby('mc_dealer_id').size().reset_index(name='active_inventory')
+    inv_summary = main_df.groupby('mc_dealer_id', observed=True).size().reset_index(name='active_inventory')
     # Total sold by dealer
-    sold_summary = sold_df.groupby('mc_dealer_id').size().reset_index(name='total_sold')
+    sold_summary = sold_df.groupby('mc_dealer_id', observed=True).size().reset_index(name='total_sold')
     # Merge
     summary = pd.merge(inv_summary, sold_summary, on='mc_dealer_id', how='outer').fillna(0)
     summary['active_inventory'] = summary['active_inventory'].astype(int)
     summary['total_sold'] = summary['total_sold'].astype(int)
     # Deduplicate by dealer
-    summary = summary.drop_duplicates('mc_dealer_id', keep='first')
-    os.makedirs(os.path.dirname(SUMMARY_PATH), exist_ok=True)
-    summary.to_parquet(SUMMARY_PATH, index=False)
+    return summary.drop_duplicates('mc_dealer_id', keep='first')
+
+# Update dealer sales summary (total and sold cars by dealer) - full rebuild.
+# Records the caller already holds in memory are used as-is; only missing ones are read from disk.
+def update_dealer_sales_summary(main_df=None, sold_df=None):
+    if main_df is None:
+        print("[SUMMARY] Loading main record...")
+        main_df = load_main_record(columns=['vin', 'mc_dealer_id'], memory_map=True)
+    if sold_df is None:
+        print("[SUMMARY] Loading sold record...")
+        sold_df = load_sold_record(columns=['vin', 'mc_dealer_id'])
+    print(f"[SUMMARY] Main record rows: {len(main_df)}, Sold record rows: {len(sold_df)}")
+    summary = dealer_sales_summary(main_df, sold_df)
+    save_summary(summary, SUMMARY_PATH)
     print(f"[SUMMARY] Dealer sales summary saved. Dealers: {len(summary)}")
     return summary
 
-# Update dealer sales by model (sold cars)
-def update_dealer_sales_by_model():
-    print("[SUMMARY] Loading sold record for by-model summary...")
-    sold_df = load_sold_record()
-    print(f"[SUMMARY] Sold record rows: {len(sold_df)}")
+def count_sales_by_model(sold_df):
     # Deduplicate by VIN
     sold_df = sold_df.drop_duplicates('vin', keep='first')
-    by_model = sold_df.groupby(['mc_dealer_id', 'neo_make', 'neo_model']).size().reset_index(name='sales_count')
+    by_model = sold_df.groupby(BY_MODEL_KEYS, observed=True).size().reset_index(name='sales_count')
     # Deduplicate by dealer/make/model
-    by_model = by_model.drop_duplicates(['mc_dealer_id', 'neo_make', 'neo_model'], keep='first')
-    os.makedirs(os.path.dirname(BY_MODEL_PATH), exist_ok=True)
-    by_model.to_parquet(BY_MODEL_PATH, index=False)
+    return by_model.drop_duplicates(BY_MODEL_KEYS, keep='first')
+
+# Dealer sales by model for a sold_date range (only the matching sold partitions are read)
+def dealer_sales_by_model(start_date=None, end_date=None):
+    sold_df = load_sold_record(start_date, end_date, columns=['vin'] + BY_MODEL_KEYS)
+    print(f"[SUMMARY] Sold record rows: {len(sold_df)}")
+    return count_sales_by_model(sold_df)
+
+# Update dealer sales by model (sold cars) - full rebuild
+def update_dealer_sales_by_model(sold_df=None):
+    if sold_df is None:
+        print("[SUMMARY] Loading sold record for by-model summary...")
+        by_model = dealer_sales_by_model()
+    else:
+        by_model = count_sales_by_model(sold_df)
+    save_summary(by_model, BY_MODEL_PATH)
     print(f"[SUMMARY] Dealer sales by model saved. Dealer-models: {len(by_model)}")
-    return by_model 
\ No newline at end of file
+    return by_model
+
+# Full rebuild of both summaries, the monthly sales cube and the counted-VIN index.
+# The sold record is read once for all of them; main_df is read only if not given.
+def rebuild_dealer_summaries(main_df=None):
+    sold_files = sold_partition_stats()
+    main_version = main_record_version()
+    sold_df = load_sold_partitions([name for name, _, _ in sold_files], columns=SOLD_SUMMARY_COLUMNS)
+    clear_watermark()
+    summary = update_dealer_sales_summary(main_df, sold_df)
+    by_model = update_dealer_sales_by_model(sold_df)
+    build_sales_cube(sold_df)
+    save_vin_array(COUNTED_SOLD_VINS_PATH, vin_array(sold_df['vin']))
+    save_watermark(sold_files, main_version)
+    return summary, by_model
+
+# Add per-key counts (a Series indexed by `keys`) to the `column` of an aggregate table
+def add_counts(table, counts, keys, column):
+    if len(counts) == 0:
+        return table
+    counts = counts.rename(column + '_delta').reset_index()
+    table = table.astype({k: object for k in keys})
+    counts = counts.astype({k: object for k in keys})
+    merged = table.merge(counts, on=keys, how='outer')
+    merged[column] = merged[column].fillna(0).astype(int) + merged[column + '_delta'].fillna(0).astype(int)
+    return merged.drop(columns=column + '_delta')
+
+# Bring the stored summaries up to date. inventory_changes is the net change in main record rows per
+# mc_dealer_id (see core/main_record.upsert_main_record) from main record version main_versions[0] to
+# main_versions[1]; it is applied when the watermark is at main_versions[0]. Sold days not yet covered by
+# the watermark (today's, and any a failed run left behind) are read and their first sales added.
+# Falls back to a full rebuild when asked to, or when the stored tables, the counted-VIN index or the
+# watermark are missing or a covered sold day changed; a caller holding the full main record may pass it
+# as main_df so a rebuild does not read it back from disk.
+def update_dealer_summaries(inventory_changes, main_versions=None, rebuild=False, main_df=None):
+    counted = load_vin_array(COUNTED_SOLD_VINS_PATH)
+    watermark = read_watermark()
+    sold_files = sold_partition_stats()
+    applied = set(tuple(f) for f in watermark['sold_files']) if watermark is not None else set()
+    # A by-model table written with other keys (before make/model IDs existed) is rebuilt once
+    if (rebuild or inventory_changes is None or counted is None or watermark is None or not applied.issubset(sold_files)
+            or not os.path.exists(SUMMARY_PATH) or not os.path.exists(BY_MODEL_PATH)
+            or not set(BY_MODEL_KEYS).issubset(pq.read_schema(BY_MODEL_PATH).names)):
+        print("[SUMMARY] Rebuilding dealer summaries from the main and sold records...")
+        return rebuild_dealer_summaries(main_df)
+    new_files = [name for name, rows, mtime in sold_files if (name, rows, mtime) not in applied]
+    sold_new = load_sold_partitions(new_files, columns=SOLD_SUMMARY_COLUMNS).drop_duplicates('vin', keep='first')
+    new_sold = sold_new[~member_mask(vin_array_unsorted(sold_new['vin']), counted)]
+    main_version = main_record_version()
+    summary = pd.read_parquet(SUMMARY_PATH)
+    if watermark['main_version'] == main_version:
+        inventory_changes = pd.Series(dtype='int64')
+    elif main_versions is None or tuple(main_versions) != (watermark['main_version'], main_version):
+        # Main record changes the summaries never saw: active_inventory is recounted from the dealer column
+        print(f"[SUMMARY] Main record is at version {main_version}, summaries at {watermark['main_version']}. Recounting active inventory...")
+        dealers = load_main_record(columns=['mc_dealer_id'], memory_map=True)
+        summary['active_inventory'] = 0
+        inventory_changes = dealers.groupby('mc_dealer_id', observed=True).size()
+    print(f"[SUMMARY] Applying delta. Sold days: {len(new_files)}, newly sold VINs: {len(new_sold)}, dealers with inventory changes: {len(inventory_changes)}")
+    summary = add_counts(summary, inventory_changes, ['mc_dealer_id'], 'active_inventory')
+    summary = add_counts(summary, new_sold.groupby('mc_dealer_id', observed=True).size(), ['mc_dealer_id'], 'total_sold')
+    summary = summary[(summary['active_inventory'] != 0) | (summary['total_sold'] != 0)]
+    summary = enforce_schema(summary.sort_values('mc_dealer_id').reset_index(drop=True))
+    by_model = pd.read_parquet(BY_MODEL_PATH)
+    by_model = add_counts(by_model, new_sold.groupby(BY_MODEL_KEYS, observed=True).size(), BY_MODEL_KEYS, 'sales_count')
+    by_model = enforce_schema(by_model.sort_values(BY_MODEL_KEYS).reset_index(drop=True))
+    clear_watermark()
+    save_summary(summary, SUMMARY_PATH)
+    save_summary(by_model, BY_MODEL_PATH)
+    add_to_sales_cube(new_sold)
+    save_vin_array(COUNTED_SOLD_VINS_PATH, merge_vins(counted, vin_array(new_sold['vin'])))
+    save_watermark(sold_files, main_version)
+    print(f"[SUMMARY] Dealer summaries updated. Dealers: {len(summary)}, Dealer-models: {len(by_model)}")
+    return summary, by_model
+
+# Compare the stored summaries with a full rebuild (nothing is written). Returns True if they match.
+def verify_dealer_summaries(main_df=None):
+    sold_df = load_sold_record(columns=SOLD_SUMMARY_COLUMNS)
+    main_df = load_main_record(columns=['vin', 'mc_dealer_id'], memory_map=True) if main_df is None else main_df
+    checks = [
+        (SUMMARY_PATH, dealer_sales_summary(main_df, sold_df), ['mc_dealer_id']),
+        (BY_MODEL_PATH, count_sales_by_model(sold_df), BY_MODEL_KEYS),
+    ]
+    rebuilt_cube = cube_tables(sold_df.drop_duplicates('vin', keep='first'))
+    checks += [(cube_path(name), rebuilt_cube[name], keys + ['month']) for name, keys in CUBE_TABLES.items()]
+    ok = True
+    for path, expected, keys in checks:
+        stored = pd.read_parquet(path).astype({k: object for k in keys})
+        expected = expected.astype({k: object for k in keys})
+        diff = stored.merge(expected, on=keys, how='outer', suffixes=('_stored', '_rebuilt'), indicator=True)
+        values = [c for c in expected.columns if c not in keys]
+        bad = diff[(diff['_merge'] != 'both') | (diff[[c + '_stored' for c in values]].values != diff[[c + '_rebuilt' for c in values]].values).any(axis=1)]
+        print(f"[SUMMARY] Verify {path}: {len(stored)} stored rows, {len(expected)} rebuilt rows, mismatches: {len(bad)}")
+        if len(bad):
+            print(bad.head(20).to_string())
+            ok = False
+    return ok
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.schema import concat_frames
+
+# Sort-merge upsert for VIN-keyed records.
+# Both sides are kept deduplicated and sorted by VIN, so combining them is a single
+# merge walk (searchsorted + one take) instead of a concat/sort over everything.
+
+def _with_dates(df):
+    if not pd.api.types.is_datetime64_any_dtype(df['status_date']):
+        df = df.assign(status_date=pd.to_datetime(df['status_date'], errors='coerce'))
+    return df
+
+# Mask of rows without a usable VIN (null or blank); they cannot be keyed, and mixing NaN with
+# strings breaks the sort and searchsorted below
+def missing_vin_mask(df):
+    vins = df['vin']
+    return (vins.isna() | (vins.astype(str).str.strip() == '')).to_numpy()
+
+def drop_missing_vins(df):
+    missing = missing_vin_mask(df)
+    return (df[~missing] if missing.any() else df), int(missing.sum())
+
+# Deduplicate a batch by VIN (latest status_date wins) and sort it by VIN; rows without a VIN are dropped
+def prepare_batch(df):
+    df = drop_missing_vins(df)[0].reset_index(drop=True)
+    if 'status_date' in df.columns:
+        df['status_date'] = pd.to_datetime(df['status_date'], errors='coerce')
+        df = df.sort_values(['vin', 'status_date'], ascending=[True, False], na_position='last', kind='mergesort')
+    else:
+        df = df.sort_values('vin', kind='mergesort')
+    return df.drop_duplicates('vin', keep='first').reset_index(drop=True)
+
+# Make sure a record is sorted by VIN (no-op when it already is)
+def ensure_sorted(df):
+    df = drop_missing_vins(df)[0].reset_index(drop=True)
+    if not df['vin'].is_monotonic_increasing:
+        df = df.sort_values('vin', kind='mergesort').reset_index(drop=True)
+    return df
+
+# Upsert a sorted, deduplicated delta into a sorted, deduplicated base.
+# A delta row replaces the base row only if its status_date is newer (or the base date is missing);
+# on equal dates the base row is kept. Returns (merged, changed_vins).
+def upsert_sorted(base_df, delta_df):
+    n = len(base_df)
+    if n == 0:
+        return delta_df.reset_index(drop=True), delta_df['vin'].to_numpy()
+    if len(delta_df) == 0:
+        return base_df.reset_index(drop=True), np.array([], dtype=object)
+    base_vins = base_df['vin'].to_numpy()
+    delta_vins = delta_df['vin'].to_numpy()
+    pos = np.searchsorted(base_vins, delta_vins)
+    hit = np.zeros(len(delta_vins), dtype=bool)
+    in_range = pos < n
+    hit[in_range] = base_vins[pos[in_range]] == delta_vins[in_range]
+    base_df = _with_dates(base_df)
+    delta_df = _with_dates(delta_df)
+    base_dates = base_df['status_date'].to_numpy(dtype='datetime64[ns]')
+    delta_dates = delta_df['status_date'].to_numpy(dtype='datetime64[ns]')
+    matched_base = base_dates[pos[hit]]
+    matched_delta = delta_dates[hit]
+    newer_hit = (matched_delta > matched_base) | (np.isnat(matched_base) & ~np.isnat(matched_delta))
+    newer = np.zeros(len(delta_vins), dtype=bool)
+    newer[hit] = newer_hit
+    # Row ids into concat([base, delta]): replaced rows point at the delta row, new VINs are inserted in order
+    order = np.arange(n)
+    order[pos[newer]] = n + np.flatnonzero(newer)
+    inserts = ~hit
+    order = np.insert(order, pos[inserts], n + np.flatnonzero(inserts))
+    combined = concat_frames([base_df.reset_index(drop=True), delta_df.reset_index(drop=True)], ignore_index=True)
+    merged = combined.take(order).reset_index(drop=True)
+    changed_vins = delta_vins[newer | inserts]
+    return merged, changed_vins
+
+# Net change in row count per value of `column` caused by an upsert: +1 for the value each changed VIN
+# has in the merged record, -1 for the value it had in the base (if it was there). Both frames are sorted by VIN.
+def count_changes(base_df, merged_df, changed_vins, column):
+    if len(changed_vins) == 0:
+        return pd.Series(dtype='int64')
+    merged_vins = merged_df['vin'].to_numpy()
+    added = merged_df[column].iloc[np.searchsorted(merged_vins, changed_vins)]
+    counts = added.value_counts()
+    if len(base_df):
+        base_vins = base_df['vin'].to_numpy()
+        pos = np.searchsorted(base_vins, changed_vins)
+        hit = pos < len(base_vins)
+        hit[hit] = base_vins[pos[hit]] == changed_vins[hit]
+        counts = counts.sub(base_df[column].iloc[pos[hit]].value_counts(), fill_value=0)
+    counts = counts[counts != 0].astype('int64')
+    counts.index.name = column
+    return counts
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import os
+
+# Persistent index of the VINs that were active in the last processed feed.
+# Stored as one sorted, fixed-width byte-string array (17 bytes per VIN) that np.load can memory-map,
+# so "active yesterday, absent today" is a merge of two sorted arrays with no Python sets.
+
+VIN_INDEX_PATH = "state/active_vins.npy"
+VIN_WIDTH = 17
+
+# Fixed-width bytes in input order (row-aligned with vins; missing VINs become b'').
+# Longer (malformed) VINs widen the array instead of being truncated.
+def vin_array_unsorted(vins):
+    vins = pd.Series(vins, copy=False).fillna('').astype(str)
+    width = max(VIN_WIDTH, int(vins.str.len().max()) if len(vins) else 0)
+    return vins.to_numpy(dtype=object).astype(f'S{width}')
+
+# Sorted, unique, fixed-width bytes (sorting is skipped when the input is already sorted, e.g. the feed delta)
+def vin_array(vins):
+    arr = vin_array_unsorted(pd.Series(vins, copy=False).dropna())
+    if len(arr) > 1 and not (arr[1:] > arr[:-1]).all():
+        arr = np.unique(arr)
+    return arr
+
+def common_width(a, b):
+    width = max(a.dtype.itemsize, b.dtype.itemsize)
+    return a.astype(f'S{width}', copy=False), b.astype(f'S{width}', copy=False)
+
+# Mask over `keys` marking the entries that appear in the sorted array `sorted_vins`
+def member_mask(keys, sorted_vins):
+    if len(sorted_vins) == 0 or len(keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    keys, sorted_vins = common_width(keys, sorted_vins)
+    pos = np.searchsorted(sorted_vins, keys)
+    pos[pos == len(sorted_vins)] = 0
+    return sorted_vins[pos] == keys
+
+# VINs in prev (sorted) that are missing from today (sorted)
+def absent_vins(prev, today):
+    return prev[~member_mask(prev, today)]
+
+# Union of two sorted VIN arrays (sorted, unique)
+def merge_vins(a, b):
+    a, b = common_width(np.asarray(a), np.asarray(b))
+    b = b[~member_mask(b, a)]
+    return np.insert(a, np.searchsorted(a, b), b)
+
+def load_vin_array(path, mmap=True):
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+def save_vin_array(path, vins):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp.npy"
+    np.save(tmp, vins)
+    os.replace(tmp, path)
+    print(f"[VIN_INDEX] VIN index saved: {path}. VINs: {len(vins)} ({vins.nbytes / 1e6:.1f} MB)")
+
+def load_active_vins(mmap=True):
+    return load_vin_array(VIN_INDEX_PATH, mmap)
+
+def save_active_vins(vins):
+    save_vin_array(VIN_INDEX_PATH, vins)
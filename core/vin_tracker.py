@@ -1,47 +1,172 @@
+import numpy as np
 import pandas as pd
-import os
+import json
+import shutil
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from core.config import STATE_PATH, VIN_DISAPPEAR_DAYS, DATE_FORMAT
+from core.vin_index import vin_array_unsorted, member_mask, common_width
+from core.partition_store import staging_dir, swap_in_dir, current_dir
 
-def load_state():
-    if os.path.exists(STATE_PATH):
-        return pd.read_parquet(STATE_PATH)
-    else:
-        return pd.DataFrame(columns=['vin', 'last_seen', 'disappear_count', 'dealer_id', 'neo_make', 'neo_model', 'neo_year'])
+# Columnar VIN tracker. The state is a set of parallel numpy arrays sorted by VIN:
+#   vin              fixed-width bytes (sorted key)
+#   disappear_count  uint8, consecutive days missing from the feed (saturates at 255)
+#   last_seen        uint16, days since EPOCH
+#   dealer_id        int64 (-1 if unknown), neo_year int16 (-1 if unknown)
+#   neo_make/model   int32 codes into the make_categories/model_categories lists (-1 if unknown)
+# Each array is saved as its own .npy file under STATE_PATH and loaded memory-mapped.
 
-def save_state(state_df):
-    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
-    state_df.to_parquet(STATE_PATH, index=False)
+EPOCH = np.datetime64('2000-01-01', 'D')
+ARRAY_COLUMNS = {
+    'vin': None,
+    'disappear_count': np.uint8,
+    'last_seen': np.uint16,
+    'dealer_id': np.int64,
+    'neo_year': np.int16,
+    'neo_make': np.int32,
+    'neo_model': np.int32,
+}
+META_FILE = "meta.json"
+LEGACY_STATE_PATH = "state/vin_tracker.parquet"  # DataFrame state, converted on first load
 
+def day_ordinal(date):
+    return np.uint16((np.datetime64(pd.Timestamp(date).date(), 'D') - EPOCH).astype(int))
+
+def empty_state():
+    state = {col: np.zeros(0, dtype=dtype or 'S17') for col, dtype in ARRAY_COLUMNS.items()}
+    state['make_categories'] = []
+    state['model_categories'] = []
+    return state
+
+def load_state(mmap=True):
+    # The previous state, if a save died between its two renames
+    state_dir = current_dir(STATE_PATH)
+    meta_path = os.path.join(state_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        if os.path.exists(LEGACY_STATE_PATH):
+            print(f"[TRACKER] Converting legacy {LEGACY_STATE_PATH} to arrays...")
+            return state_from_frame(pd.read_parquet(LEGACY_STATE_PATH))
+        return empty_state()
+    with open(meta_path) as f:
+        meta = json.load(f)
+    state = {col: np.load(os.path.join(state_dir, f"{col}.npy"), mmap_mode='r' if mmap else None) for col in ARRAY_COLUMNS}
+    state['make_categories'] = meta['make_categories']
+    state['model_categories'] = meta['model_categories']
+    return state
+
+def save_state(state):
+    # Written to a sibling directory and swapped in, so a crash never leaves a mix of old and new arrays
+    tmp_dir = staging_dir(STATE_PATH)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for col in ARRAY_COLUMNS:
+        np.save(os.path.join(tmp_dir, f"{col}.npy"), np.ascontiguousarray(state[col]))
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump({'rows': int(len(state['vin'])), 'epoch': str(EPOCH),
+                   'make_categories': state['make_categories'], 'model_categories': state['model_categories']}, f)
+    swap_in_dir(tmp_dir, STATE_PATH)
+
+# Codes of values in categories; unseen values are appended to categories (in place)
+def encode(values, categories):
+    values = pd.Series(values, copy=False).astype(object)
+    index = pd.Index(categories, dtype=object)
+    unseen = pd.Index(values.dropna().unique(), dtype=object).difference(index)
+    categories.extend(unseen.tolist())
+    return pd.Index(categories, dtype=object).get_indexer(values).astype(np.int32)
+
+# Build a state from the old DataFrame layout (vin, last_seen, disappear_count, dealer_id, neo_make, neo_model, neo_year)
+def state_from_frame(df):
+    df = df[df['vin'].notna()].drop_duplicates('vin', keep='last')
+    keys = vin_array_unsorted(df['vin'])
+    order = np.argsort(keys, kind='stable')
+    df = df.iloc[order]
+    last_seen = pd.to_datetime(df['last_seen']).to_numpy().astype('datetime64[D]')
+    state = {
+        'vin': keys[order],
+        'disappear_count': pd.to_numeric(df['disappear_count']).clip(0, 255).to_numpy(dtype=np.uint8),
+        'last_seen': (last_seen - EPOCH).astype(int).astype(np.uint16),
+        'dealer_id': pd.to_numeric(df['dealer_id'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64),
+        'neo_year': pd.to_numeric(df['neo_year'], errors='coerce').fillna(-1).to_numpy(dtype=np.int16),
+        'make_categories': [],
+        'model_categories': [],
+    }
+    state['neo_make'] = encode(df['neo_make'], state['make_categories'])
+    state['neo_model'] = encode(df['neo_model'], state['model_categories'])
+    return state
+
+def take_state(state, mask):
+    taken = {col: np.asarray(state[col])[mask] for col in ARRAY_COLUMNS}
+    taken['make_categories'] = state['make_categories']
+    taken['model_categories'] = state['model_categories']
+    return taken
+
+# Decode (part of) a state into the DataFrame layout of the old parquet tracker
+def state_to_frame(state):
+    make_cats = np.array(state['make_categories'] + [None], dtype=object)
+    model_cats = np.array(state['model_categories'] + [None], dtype=object)
+    last_seen = (EPOCH + np.asarray(state['last_seen']).astype('timedelta64[D]')).astype('datetime64[D]')
+    dealer_id = np.asarray(state['dealer_id'])
+    neo_year = np.asarray(state['neo_year'])
+    return pd.DataFrame({
+        'vin': np.char.decode(np.asarray(state['vin']), 'ascii').astype(object),
+        'last_seen': pd.to_datetime(last_seen).strftime(DATE_FORMAT),
+        'disappear_count': np.asarray(state['disappear_count']),
+        'dealer_id': pd.Series(dealer_id, dtype='Int64').mask(dealer_id == -1),
+        'neo_make': make_cats[np.asarray(state['neo_make'])],
+        'neo_model': model_cats[np.asarray(state['neo_model'])],
+        'neo_year': pd.Series(neo_year, dtype='Int16').mask(neo_year == -1),
+    })
+
+# One merge of the sorted state against today's sorted VINs:
+# seen VINs reset their count and last_seen, missing VINs count up, new VINs are inserted in key order.
+# VINs missing for VIN_DISAPPEAR_DAYS days are removed and returned as sold.
 def update_state(today_df, today_date, prev_state):
-    today_vins = set(today_df['vin'])
-    today_date_str = pd.to_datetime(today_date).strftime(DATE_FORMAT)
-    # Mark all VINs seen today
-    seen_today = prev_state['vin'].isin(today_vins)
-    prev_state.loc[seen_today, 'last_seen'] = today_date_str
-    prev_state.loc[seen_today, 'disappear_count'] = 0
-    # For VINs not seen today, increment disappear_count
-    not_seen_today = ~prev_state['vin'].isin(today_vins)
-    prev_state.loc[not_seen_today, 'disappear_count'] += 1
-    # Add new VINs
-    new_vins = today_vins - set(prev_state['vin'])
-    if new_vins:
-        new_rows = today_df[today_df['vin'].isin(new_vins)].copy()
-        new_rows['last_seen'] = today_date_str
-        new_rows['disappear_count'] = 0
-        prev_state = pd.concat([
-            prev_state,
-            new_rows[['vin', 'last_seen', 'disappear_count', 'mc_dealer_id', 'neo_make', 'neo_model', 'neo_year']].rename(columns={'mc_dealer_id':'dealer_id'})
-        ], ignore_index=True)
+    today_ord = day_ordinal(today_date)
+    today_df = today_df[today_df['vin'].notna()]
+    keys = vin_array_unsorted(today_df['vin'])
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    rows, keys = order[first], keys[first]
+    prev_vins, keys = common_width(np.asarray(prev_state['vin']), keys)
+
+    seen = member_mask(prev_vins, keys)
+    count = np.asarray(prev_state['disappear_count']).astype(np.uint16)
+    count = np.where(seen, 0, np.minimum(count + 1, 255)).astype(np.uint8)
+    last_seen = np.where(seen, today_ord, np.asarray(prev_state['last_seen'])).astype(np.uint16)
+
+    is_new = ~member_mask(keys, prev_vins)
+    new_rows = today_df.iloc[rows[is_new]]
+    new_keys = keys[is_new]
+    make_categories = list(prev_state['make_categories'])
+    model_categories = list(prev_state['model_categories'])
+    new_values = {
+        'vin': new_keys,
+        'disappear_count': np.zeros(len(new_keys), dtype=np.uint8),
+        'last_seen': np.full(len(new_keys), today_ord, dtype=np.uint16),
+        'dealer_id': pd.to_numeric(new_rows['mc_dealer_id'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64),
+        'neo_year': pd.to_numeric(new_rows['neo_year'], errors='coerce').fillna(-1).to_numpy(dtype=np.int16),
+        'neo_make': encode(new_rows['neo_make'], make_categories),
+        'neo_model': encode(new_rows['neo_model'], model_categories),
+    }
+    pos = np.searchsorted(prev_vins, new_keys)
+    current = {'vin': prev_vins, 'disappear_count': count, 'last_seen': last_seen}
+    state = {col: np.insert(current.get(col, np.asarray(prev_state[col])), pos, new_values[col]) for col in ARRAY_COLUMNS}
+    state['make_categories'] = make_categories
+    state['model_categories'] = model_categories
+
     # Mark as sold if disappear_count >= threshold
-    sold_mask = prev_state['disappear_count'] >= VIN_DISAPPEAR_DAYS
-    sold_vins = prev_state[sold_mask].copy()
+    sold_mask = state['disappear_count'] >= VIN_DISAPPEAR_DAYS
+    sold_vins = state_to_frame(take_state(state, sold_mask))
     # Remove sold VINs from state
-    state_df = prev_state[~sold_mask].reset_index(drop=True)
+    state_df = take_state(state, ~sold_mask)
+    print(f"[TRACKER] Tracked: {len(state_df['vin'])}, new today: {len(new_keys)}, sold: {len(sold_vins)}")
     return state_df, sold_vins
 
-def get_sold_vins(today_df, today_date, prev_state):
+def get_sold_vins(today_df, today_date, prev_state=None):
+    if prev_state is None:
+        prev_state = load_state()
     state_df, sold_vins = update_state(today_df, today_date, prev_state)
     save_state(state_df)
-    return sold_vins 
\ No newline at end of file
+    return sold_vins
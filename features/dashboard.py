@@ -1,120 +1,183 @@
 import streamlit as st
 import pandas as pd
 import os
-from io import BytesIO
+import tempfile
+import time
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.main_record import load_main_record
+from core.sales_cube import load_sales_cube, period_months, latest_month, PERIODS
+from core.dealer_index import load_dealer_index, dealers_within, zip_location
+from core.dealers import load_dealers
+from core.kpi_snapshot import load_kpi_snapshot, leaderboard
+from core.query_engine import build_query_index, run_query, result_frame, models_for_makes, page_positions, dealer_sort_values, export_result
 
-SUMMARY_PATH = "state/dealer_sales_summary.parquet"
-BY_MODEL_PATH = "state/dealer_sales_by_model.parquet"
-RAW_PATH = "state/main_record.parquet"
+RAW_PATH = "state/main_record"
+# The only main record columns the query engine reads
+INVENTORY_COLUMNS = ['mc_dealer_id', 'make_id', 'model_id']
+PAGE_SIZES = [25, 50, 100, 250]
+EXPORT_FORMATS = {"CSV": ('csv', "text/csv"), "Parquet": ('parquet', "application/octet-stream")}
+# Prepared exports live in one directory; files older than the TTL (ended sessions, earlier processes)
+# are removed when the app starts and whenever a new export is written
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "competitor_analysis_exports")
+EXPORT_TTL_SECONDS = 3600
 
 st.set_page_config(page_title="Dealer Competitor Analysis Dashboard", layout="wide")
 
-@st.cache_data(show_spinner=False)
-def load_data():
-    summary = pd.read_parquet(SUMMARY_PATH) if os.path.exists(SUMMARY_PATH) else None
-    by_model = pd.read_parquet(BY_MODEL_PATH) if os.path.exists(BY_MODEL_PATH) else None
-    raw_df = pd.read_parquet(RAW_PATH) if os.path.exists(RAW_PATH) else None
-    # Deduplicate for safety
-    if summary is not None:
-        summary = summary.drop_duplicates('mc_dealer_id', keep='first')
-    if by_model is not None:
-        by_model = by_model.drop_duplicates(['mc_dealer_id', 'neo_make', 'neo_model'], keep='first')
-    if raw_df is not None:
-        raw_df = raw_df.drop_duplicates('vin', keep='first')
-    return summary, by_model, raw_df
-
-def to_csv_download(df):
-    output = BytesIO()
-    df.to_csv(output, index=False)
-    return output.getvalue()
+# State files are opened on first use, memory-mapped where they are large, projected to the columns
+# above and kept once per process (st.cache_resource: shared by every session, never pickled or
+# hashed). Cached objects are shared, so callers must not modify them in place.
+# Counts and leaderboards precomputed by the ETL (tabs 2 and 3)
+@st.cache_resource(show_spinner=False)
+def load_snapshot():
+    return load_kpi_snapshot()
+
+@st.cache_resource(show_spinner=False)
+def load_cube():
+    return load_sales_cube()
+
+@st.cache_resource(show_spinner=False)
+def load_geo_index():
+    return load_dealer_index()
+
+@st.cache_resource(show_spinner=False)
+def load_dealer_dim():
+    return load_dealers()
+
+def prune_exports(max_age=EXPORT_TTL_SECONDS):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    cutoff = time.time() - max_age
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass  # removed by another session meanwhile
+
+# Runs once per process
+@st.cache_resource(show_spinner=False)
+def init_export_dir():
+    prune_exports()
+    return EXPORT_DIR
+
+# Filter interactions are answered by the query engine from this pre-aggregated index. The projected
+# main record is only read to build it and is released afterwards; only the index stays cached.
+@st.cache_resource(show_spinner=False)
+def load_query_index():
+    cube = load_cube()
+    if not os.path.exists(RAW_PATH) or cube is None:
+        return None
+    return build_query_index(load_main_record(columns=INVENTORY_COLUMNS, memory_map=True), cube)
 
 def main():
     st.title("🚗 Dealer Competitor Analysis Dashboard")
     # Add refresh button
     if st.button("🔄 Refresh Data"):
-        st.cache_data.clear()
+        st.cache_resource.clear()
         st.experimental_rerun()
+    init_export_dir()
     with st.spinner("Loading data..."):
-        summary, by_model, raw_df = load_data()
-    if summary is None or by_model is None or raw_df is None:
-        st.error("Required summary or raw file not found. Run ETL first.")
+        snapshot, cube, dealer_index, dealer_dim = load_snapshot(), load_cube(), load_geo_index(), load_dealer_dim()
+        query_index = load_query_index()
+    if snapshot is None or query_index is None or cube is None or dealer_index is None or dealer_dim is None:
+        st.error("Required KPI snapshot, sales cube, dealer tables or raw file not found. Run ETL first.")
         return
 
     tab1, tab2, tab3 = st.tabs(["Competitor Analysis", "Top 5 Dealers by Sales", "Summary Stats"])
 
     with tab1:
         st.sidebar.header("Filters")
+        period = st.sidebar.selectbox("Period", PERIODS, index=0)
+        period_start, period_end = period_months(period, latest_month(cube))
         # Multi-select for makes/models
-        makes = sorted(by_model['neo_make'].unique())
+        makes = sorted(query_index['makes'].tolist())
         selected_makes = st.sidebar.multiselect("Make(s)", makes, default=makes[:1] if makes else [])
-        if selected_makes:
-            models = sorted(by_model[by_model['neo_make'].isin(selected_makes)]['neo_model'].unique())
-        else:
-            models = sorted(by_model['neo_model'].unique())
+        models = models_for_makes(query_index, selected_makes)
         selected_models = st.sidebar.multiselect("Model(s)", models, default=models[:1] if models else [])
-        zips = sorted(raw_df['zip'].unique())
+        zips = sorted(int(z) for z in pd.unique(dealer_index['zip']) if z == z)
         selected_zip = st.sidebar.selectbox("Zip Code", ["All"] + zips)
-        zip_group = st.sidebar.slider("Zip Code Radius (+/-)", 0, 50, 10)
-        dealers = sorted(raw_df['mc_dealer_id'].unique())
+        radius_miles = st.sidebar.slider("Radius (miles)", 0, 200, 25)
+        dealers = dealer_dim['mc_dealer_id'].tolist()
         selected_dealer = st.sidebar.selectbox("Your Dealer ID", ["All"] + dealers)
         min_sales = st.sidebar.number_input("Min Sales Count", min_value=0, value=0)
         max_sales = st.sidebar.number_input("Max Sales Count", min_value=0, value=1000000)
         top_n_options = [10, 20, 50, 100, "All"]
         top_n = st.sidebar.selectbox("Show Top N", top_n_options, index=0)
 
-        # Filter logic
-        filtered_by_model = by_model.copy()
-        if selected_makes:
-            filtered_by_model = filtered_by_model[filtered_by_model['neo_make'].isin(selected_makes)]
-        if selected_models:
-            filtered_by_model = filtered_by_model[filtered_by_model['neo_model'].isin(selected_models)]
+        # Filter logic: the query engine answers from its index (sales for the period come from the
+        # monthly cube); only the rows shown are turned into a frame and joined to the dealer dimension
+        area = None
         if selected_zip != "All":
-            selected_zip = int(selected_zip)
-            dealers_in_area = raw_df[(raw_df['zip'] >= selected_zip - zip_group) & (raw_df['zip'] <= selected_zip + zip_group)]['mc_dealer_id'].unique()
-            filtered_by_model = filtered_by_model[filtered_by_model['mc_dealer_id'].isin(dealers_in_area)]
-        # Sales count filter
-        filtered_by_model = filtered_by_model[(filtered_by_model['sales_count'] >= min_sales) & (filtered_by_model['sales_count'] <= max_sales)]
-        inv = raw_df.copy()
-        if selected_makes:
-            inv = inv[inv['neo_make'].isin(selected_makes)]
-        if selected_models:
-            inv = inv[inv['neo_model'].isin(selected_models)]
-        if selected_zip != "All":
-            inv = inv[inv['mc_dealer_id'].isin(dealers_in_area)]
-        inv_counts = inv.groupby('mc_dealer_id').size().reset_index(name='current_inventory')
-        dealer_info_cols = ['mc_dealer_id', 'seller_name', 'city', 'state', 'zip']
-        for col in [
-            'mc_dealership_group_name', 'dealer_type', 'source',
-            'latitude', 'longitude', 'seller_phone', 'seller_email',
-            'car_seller_name', 'car_address', 'photo_links']:
-            if col in raw_df.columns:
-                dealer_info_cols.append(col)
-        dealer_info = raw_df.drop_duplicates('mc_dealer_id')[dealer_info_cols]
-        merged = filtered_by_model.merge(dealer_info, on='mc_dealer_id', how='left').merge(inv_counts, on='mc_dealer_id', how='left')
-        merged['current_inventory'] = merged['current_inventory'].fillna(0).astype(int)
-        # Export filtered table
-        st.download_button(
-            label="Export Table to CSV",
-            data=to_csv_download(merged),
-            file_name="competitor_analysis.csv",
-            mime="text/csv"
-        )
-        st.subheader(f"Top Dealers for {', '.join(selected_makes) if selected_makes else '[All Makes]'} {', '.join(selected_models) if selected_models else '[All Models]'}" + (f" in Zip {selected_zip} +/- {zip_group}" if selected_zip != 'All' else " (All Zips)"))
+            # Dealers within the radius of the zip's dealer centroid, from the ETL's spatial index
+            area = dealers_within(dealer_index, *zip_location(dealer_index, selected_zip), radius_miles)
+        result = run_query(query_index, {
+            'period': period,
+            'makes': selected_makes,
+            'models': selected_models,
+            'area_dealers': area['mc_dealer_id'] if area is not None else None,
+            'dealer': int(selected_dealer) if selected_dealer != "All" else None,
+            'min_sales': min_sales,
+            'max_sales': max_sales,
+            'top_n': None if top_n == "All" else int(top_n),
+        })
+        shown = result['total_rows'] if result['top_n'] is None else min(result['top_n'], result['total_rows'])
+        # Export (every row shown, best-selling first) is only written when asked for, in chunks, to a
+        # file in EXPORT_DIR. The download button is rendered in that run only, so other reruns neither
+        # rebuild nor re-read the file.
+        export_col, format_col = st.columns([1, 1])
+        export_format = format_col.selectbox("Export format", list(EXPORT_FORMATS), index=0)
+        if export_col.button(f"Prepare export ({shown} rows)"):
+            previous = st.session_state.pop('export_path', None)
+            if previous is not None and os.path.exists(previous):
+                os.remove(previous)
+            prune_exports()
+            extension, mime = EXPORT_FORMATS[export_format]
+            fd, path = tempfile.mkstemp(prefix="competitor_analysis_", suffix="." + extension, dir=EXPORT_DIR)
+            os.close(fd)
+            with st.spinner("Writing export..."):
+                export_result(query_index, result, dealer_dim, path, extension, area)
+            st.session_state['export_path'] = path
+            with open(path, 'rb') as f:
+                st.download_button(
+                    label=f"Download {export_format}",
+                    data=f,
+                    file_name=f"competitor_analysis.{extension}",
+                    mime=mime
+                )
+        st.subheader(f"Top Dealers for {', '.join(selected_makes) if selected_makes else '[All Makes]'} {', '.join(selected_models) if selected_models else '[All Models]'}" + (f" within {radius_miles} miles of Zip {selected_zip}" if selected_zip != 'All' else " (All Zips)")
+                     + (f", {period} ({period_start:%b %Y} - {period_end:%b %Y})" if period_start is not None else ""))
+        # Paged table: sorting happens on the result arrays and only the visible page is materialized
+        sort_columns = ['sales_count', 'current_inventory'] + (['distance_miles'] if area is not None else []) + ['seller_name', 'city', 'state', 'zip']
+        sort_col, order_col, size_col, page_col = st.columns(4)
+        sort_by = sort_col.selectbox("Sort by", sort_columns, index=0)
+        ascending = order_col.selectbox("Order", ["Descending", "Ascending"], index=0) == "Ascending"
+        page_size = size_col.selectbox("Rows per page", PAGE_SIZES, index=0)
+        pages = max(1, -(-shown // page_size))
+        page = page_col.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+        dealer_values = None
+        if sort_by == 'distance_miles':
+            dealer_values = dealer_sort_values(query_index, area.set_index('mc_dealer_id')['distance_miles'])
+        elif sort_by not in ('sales_count', 'current_inventory'):
+            dealer_values = dealer_sort_values(query_index, dealer_dim.set_index('mc_dealer_id')[sort_by])
+        start = (page - 1) * page_size
+        positions = page_positions(query_index, result, start, start + page_size, sort_by, ascending, dealer_values)
+        merged = result_frame(query_index, result, dealer_dim, positions, area)
         display_cols = ['seller_name', 'city', 'state', 'zip', 'current_inventory', 'sales_count']
+        if 'distance_miles' in merged.columns:
+            display_cols.append('distance_miles')
         for col in [
             'mc_dealership_group_name', 'dealer_type', 'source',
             'latitude', 'longitude', 'seller_phone', 'seller_email',
             'car_seller_name', 'car_address', 'photo_links']:
             if col in merged.columns:
                 display_cols.append(col)
-        if top_n == "All":
-            st.dataframe(merged.sort_values('sales_count', ascending=False)[display_cols], use_container_width=True)
-        else:
-            st.dataframe(merged.sort_values('sales_count', ascending=False)[display_cols].head(int(top_n)), use_container_width=True)
+        st.dataframe(merged[display_cols], use_container_width=True)
+        st.caption(f"Rows {min(start + 1, shown)}-{min(start + page_size, shown)} of {shown}")
         # Show client dealer's performance
         st.subheader("Your Dealership Performance")
         if selected_dealer != "All":
-            client_row = merged[merged['mc_dealer_id'] == int(selected_dealer)]
+            client_row = result_frame(query_index, result['client'], dealer_dim, area=area)
             if not client_row.empty:
                 st.metric("Current Inventory", client_row.iloc[0]['current_inventory'], help="Current inventory for your dealership.")
                 st.metric("Total Sold", client_row.iloc[0]['sales_count'], help="Total new car sales for your dealership.")
@@ -125,28 +188,31 @@ def main():
             st.info("Select your dealer ID to see your performance.")
         # Show overall stats
         st.subheader("Market Overview")
-        st.metric("Total Dealers in Area", len(merged), help="Number of dealers matching the current filters.")
-        st.metric("Total Sales in Area", merged['sales_count'].sum(), help="Total new car sales in the filtered area.")
-        st.metric("Total Inventory in Area", merged['current_inventory'].sum(), help="Current inventory in the filtered area.")
+        st.metric("Total Dealers in Area", result['total_rows'], help="Number of dealers matching the current filters.")
+        st.metric("Total Sales in Area", result['total_sales'], help="Total new car sales in the filtered area.")
+        st.metric("Total Inventory in Area", result['total_inventory'], help="Current inventory in the filtered area.")
 
     with tab2:
-        st.header("Top 5 Dealers by Total Sales (All Makes/Models)")
-        top5 = summary.sort_values('total_sold', ascending=False).head(5)
+        st.header(f"Top 5 Dealers by Total Sales (All Makes/Models, {period})")
+        top5 = leaderboard(snapshot, 'dealer', 'sales', period).head(5)
+        top5 = top5.rename(columns={'key': 'mc_dealer_id', 'sales': 'total_sold', 'inventory': 'active_inventory'})
         st.dataframe(top5[['mc_dealer_id', 'total_sold', 'active_inventory']], use_container_width=True)
         st.bar_chart(top5.set_index('mc_dealer_id')['total_sold'])
 
     with tab3:
         st.header("Summary Stats & KPIs")
-        st.metric("Total Unique VINs", len(raw_df['vin'].unique()), help="Total unique vehicles in the main record.")
-        st.metric("Total Dealers", len(summary['mc_dealer_id'].unique()), help="Total unique dealers in the summary.")
-        st.metric("Total Makes", len(raw_df['neo_make'].unique()), help="Total unique makes in the main record.")
-        st.metric("Total Models", len(raw_df['neo_model'].unique()), help="Total unique models in the main record.")
-        st.write("#### Top 10 Makes by Inventory")
-        st.dataframe(raw_df['neo_make'].value_counts().head(10).reset_index().rename(columns={'index': 'Make', 'neo_make': 'Inventory Count'}))
-        st.write("#### Top 10 Models by Inventory")
-        st.dataframe(raw_df['neo_model'].value_counts().head(10).reset_index().rename(columns={'index': 'Model', 'neo_model': 'Inventory Count'}))
-        st.write("#### Top 10 Dealers by Inventory")
-        st.dataframe(raw_df.groupby('mc_dealer_id').size().sort_values(ascending=False).head(10).reset_index().rename(columns={0: 'Inventory Count'}))
+        st.caption(f"Snapshot of {snapshot['generated_at']}")
+        inventory_type = st.selectbox("Inventory Type", snapshot['inventory_types'], index=0)
+        counts = snapshot['counts'][inventory_type]
+        st.metric("Total Unique VINs", counts['vins'], help="Total unique vehicles in the main record.")
+        st.metric("Total Dealers", counts['dealers'], help="Total unique dealers with inventory or sales.")
+        st.metric("Total Makes", counts['makes'], help="Total unique makes in the main record.")
+        st.metric("Total Models", counts['models'], help="Total unique models in the main record.")
+        for title, dimension, label in [("Makes", 'make', 'Make'), ("Models", 'model', 'Model'), ("Dealers", 'dealer', 'mc_dealer_id'), ("Zips", 'zip', 'Zip')]:
+            st.write(f"#### Top 10 {title} by Inventory")
+            top = leaderboard(snapshot, dimension, 'inventory', inventory_type=inventory_type).head(10)
+            key = 'name' if 'name' in top.columns else 'key'  # makes and models are shown by display name
+            st.dataframe(top[[key, 'inventory']].rename(columns={key: label, 'inventory': 'Inventory Count'}))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -5,11 +5,15 @@ import time
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from datetime import datetime
-from core.main_record import update_main_record_from_feed, load_main_record
-from core.sold_record import update_sold_record
-from core.loader import load_inventory_csv, load_parquet_dataset, parallel_chunk_process
+from core.main_record import ingest_daily_feed, count_main_records, load_main_record
+from core.sold_record import update_sold_record, count_sold_records
+from core.loader import verify_dataset_manifest
 from core.config import RAW_DATA_PATH
-from core.summarizer import update_dealer_sales_summary, update_dealer_sales_by_model
+from core.summarizer import update_dealer_summaries
+from core.dealers import update_dealers
+from core.dealer_index import build_dealer_index
+from core.kpi_snapshot import update_kpi_snapshot, KPI_MAIN_COLUMNS
+from core.postings import update_main_postings, update_sold_postings, POSTING_FIELDS
 
 def cleanup_old_files(data_dir, keep_days=2):
     print(f"[CLEANUP] Checking for old files in {data_dir} (keep {keep_days} days)...")
@@ -22,62 +26,55 @@ def cleanup_old_files(data_dir, keep_days=2):
             deleted += 1
     print(f"[CLEANUP] Done. Deleted {deleted} old files.")
 
-def process_daily_feed(today_path, today_date, max_workers=4):
+def process_daily_feed(today_path, today_date, max_workers=4, rebuild_summaries=False, verify_checksums=False):
     print(f"[ETL] Processing daily feed: {today_path}")
     start_time = time.time()
-    # Update main record from today's feed (chunked, parallel for Parquet)
-    main_df = update_main_record_from_feed(today_path, max_workers=max_workers)
-    print(f"[ETL] Main record updated. Rows: {len(main_df)}")
-    # Choose loader based on file type
-    if os.path.isdir(today_path) or today_path.endswith('.parquet/'):
-        # Parallel processing for Parquet dataset
-        def get_vins(chunk_path):
-            chunk = pd.read_parquet(chunk_path)
-            return set(chunk['vin'])
-        def get_sample_rows(chunk_path):
-            chunk = pd.read_parquet(chunk_path)
-            return chunk.head(100)
-        # VIN collection (flatten batches)
-        vin_sets = []
-        for batch in parallel_chunk_process(today_path, get_vins, max_workers=max_workers):
-            vin_sets.extend(batch)
-        today_vins = set().union(*vin_sets)
-        # Sample rows (just from the first chunk)
-        chunk_files = sorted([os.path.join(today_path, f) for f in os.listdir(today_path) if f.endswith('.parquet')])
-        sample_rows = pd.read_parquet(chunk_files[0]).head(100) if chunk_files else None
-    else:
-        # Sequential for CSV
-        today_vins = set()
-        sample_rows = None
-        for i, chunk in enumerate(load_inventory_csv(today_path)):
-            today_vins.update(chunk['vin'])
-            if i == 0:
-                sample_rows = chunk.head(100)
+    # Refuse to run on a partially converted feed dataset (file set and row counts; file checksums on request)
+    if os.path.isdir(today_path):
+        verify_dataset_manifest(today_path, checksums=verify_checksums)
+    # Single scan of today's feed: main record update, today's VIN set and the monitoring samples.
+    # Only the delta comes back; the stages below read the main record columns or partitions they need.
+    delta, scan = ingest_daily_feed(today_path, max_workers=max_workers)
+    main_record_rows = count_main_records()
+    print(f"[ETL] Main record updated. Rows: {main_record_rows}, today's VINs: {len(delta)}")
+    today_vins = scan['today_vins']
+    sample_rows = scan['sample_rows']
     print(f"[ETL] VIN collection complete. Unique VINs today: {len(today_vins)}")
-    # Use main_df for sold detection
-    sold_record = update_sold_record(main_df, pd.DataFrame({'vin': list(today_vins)}), today_date)
-    print(f"[ETL] Sold record updated. Rows: {len(sold_record)}")
-    # Update dealer summaries
-    summary = update_dealer_sales_summary()
-    print(f"[ETL] Dealer sales summary updated. Dealers: {len(summary)}")
-    by_model = update_dealer_sales_by_model()
-    print(f"[ETL] Dealer sales by model updated. Dealer-models: {len(by_model)}")
+    # Sold rows are read from the main record partitions holding the sold VINs
+    sold_record = update_sold_record(None, pd.DataFrame({'vin': today_vins}), today_date)
+    sold_record_rows = count_sold_records()
+    print(f"[ETL] Sold record updated. Sold today: {len(sold_record)}, total rows: {sold_record_rows}")
+    # Update dealer summaries from today's delta (sold days not yet applied + main record inventory changes)
+    summary, by_model = update_dealer_summaries(scan['inventory_changes'], scan['main_versions'], rebuild=rebuild_summaries)
+    print(f"[ETL] Dealer summaries updated. Dealers: {len(summary)}, Dealer-models: {len(by_model)}")
+    # Dealer dimension and the spatial index over its locations (dashboard, competitor analysis)
+    dealers = update_dealers()
+    build_dealer_index(dealers)
+    # The KPI snapshot and the main record postings use the same few ID/categorical columns: read them once
+    main_ids = load_main_record(columns=list(dict.fromkeys(KPI_MAIN_COLUMNS + list(POSTING_FIELDS.values()))), memory_map=True)
+    # KPI counts and leaderboards for the dashboard and reports (reads the cube written above)
+    update_kpi_snapshot(main_ids)
+    # Posting lists of make/model/dealer/zip over the main and sold records (competitor analysis)
+    update_main_postings(main_ids)
+    update_sold_postings()
     # Monitoring sample file
     monitor_path = "state/monitoring_sample.csv"
     monitor_rows = []
     # 100 sample rows from input, main, sold
     monitor_rows.append(pd.DataFrame({'section': 'input_today', **sample_rows}) if sample_rows is not None else pd.DataFrame())
-    monitor_rows.append(pd.DataFrame({'section': 'main_record', **main_df.head(100)}))
+    monitor_rows.append(pd.DataFrame({'section': 'main_record', **scan['main_sample']}) if scan['main_sample'] is not None else pd.DataFrame())
     monitor_rows.append(pd.DataFrame({'section': 'sold_record', **sold_record.head(100)}))
     # Summary row
     elapsed = time.time() - start_time
     elapsed_min = round(elapsed / 60, 2)
     summary_row = pd.DataFrame([{
         'section': 'summary',
-        'input_rows': len(today_vins),
-        'main_record_rows': len(main_df),
-        'sold_record_rows': len(sold_record),
-        'dealers': len(summary),
+        'input_rows': scan['input_rows'],
+        'unique_vins_today': len(today_vins),
+        'main_record_rows': main_record_rows,
+        'sold_today': len(sold_record),
+        'sold_record_rows': sold_record_rows,
+        'dealers': len(dealers),
         'dealer_models': len(by_model),
         'time_min': elapsed_min
     }])
@@ -90,7 +87,9 @@ def process_daily_feed(today_path, today_date, max_workers=4):
     print("[ETL] ETL complete.")
 
 if __name__ == "__main__":
-    # Usage: python features/etl.py [input_path] [date] [max_workers]
+    # Usage: python features/etl.py [input_path] [date] [max_workers] [rebuild] [checksums]
+    # "rebuild" recomputes the dealer summaries from the full records instead of applying the day's delta;
+    # "checksums" also checks every part file of a Parquet feed against its manifest checksum
     if len(sys.argv) >= 2:
         today_path = sys.argv[1]
     else:
@@ -103,4 +102,7 @@ if __name__ == "__main__":
         max_workers = int(sys.argv[3])
     else:
         max_workers = 4
-    process_daily_feed(today_path, today_date, max_workers=max_workers) 
\ No newline at end of file
+    options = sys.argv[4:]
+    rebuild_summaries = "rebuild" in options
+    verify_checksums = "checksums" in options
+    process_daily_feed(today_path, today_date, max_workers=max_workers, rebuild_summaries=rebuild_summaries, verify_checksums=verify_checksums) 
\ No newline at end of file
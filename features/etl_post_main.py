@@ -5,24 +5,32 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import time
 from datetime import datetime
 from core.main_record import load_main_record
-from core.sold_record import update_sold_record
-from core.loader import load_inventory_csv, load_parquet_dataset, parallel_chunk_process
+from core.sold_record import update_sold_record, count_sold_records
+from core.loader import load_inventory_csv, load_parquet_dataset, parallel_chunk_process, verify_dataset_manifest
 from core.config import RAW_DATA_PATH
-from core.summarizer import update_dealer_sales_summary, update_dealer_sales_by_model
+from core.summarizer import update_dealer_summaries
+from core.dealers import update_dealers
+from core.dealer_index import build_dealer_index
+from core.kpi_snapshot import update_kpi_snapshot
+from core.make_model_dictionary import assign_make_model_ids
+from core.postings import update_main_postings, update_sold_postings, load_postings
 
 def process_analysis(today_path, today_date, max_workers=4):
     print(f"[POST-ETL] Running analysis only. Main record will not be updated.")
     start_time = time.time()
+    if os.path.isdir(today_path):
+        verify_dataset_manifest(today_path)
     main_df = load_main_record()
+    # A record saved before make/model IDs existed gets them in memory only (the main ETL backfills the store)
+    if 'make_model_id' not in main_df.columns:
+        main_df = assign_make_model_ids(main_df)
     print(f"[POST-ETL] Main record loaded. Rows: {len(main_df)}")
     # Collect today's VINs (for sold detection)
     if os.path.isdir(today_path) or today_path.endswith('.parquet/'):
-        def get_vins(chunk_path):
-            chunk = pd.read_parquet(chunk_path)
+        # Only the vin column is decoded
+        def get_vins(chunk):
             return set(chunk['vin'])
-        vin_sets = []
-        for batch in parallel_chunk_process(today_path, get_vins, max_workers=max_workers):
-            vin_sets.extend(batch)
+        vin_sets = list(parallel_chunk_process(today_path, get_vins, max_workers=max_workers, columns=['vin']))
         today_vins = set().union(*vin_sets)
     else:
         today_vins = set()
@@ -31,12 +39,20 @@ def process_analysis(today_path, today_date, max_workers=4):
     print(f"[POST-ETL] VIN collection complete. Unique VINs today: {len(today_vins)}")
     # Update sold record
     sold_record = update_sold_record(main_df, pd.DataFrame({'vin': list(today_vins)}), today_date)
-    print(f"[POST-ETL] Sold record updated. Rows: {len(sold_record)}")
-    # Update dealer summaries
-    summary = update_dealer_sales_summary()
-    print(f"[POST-ETL] Dealer sales summary updated. Dealers: {len(summary)}")
-    by_model = update_dealer_sales_by_model()
-    print(f"[POST-ETL] Dealer sales by model updated. Dealer-models: {len(by_model)}")
+    sold_record_rows = count_sold_records()
+    print(f"[POST-ETL] Sold record updated. Sold today: {len(sold_record)}, total rows: {sold_record_rows}")
+    # Update dealer summaries; the main record is not touched here, so only today's sales change them
+    # (active inventory is recounted if the summaries are behind the stored main record)
+    summary, by_model = update_dealer_summaries(pd.Series(dtype='int64'), main_df=main_df)
+    print(f"[POST-ETL] Dealer summaries updated. Dealers: {len(summary)}, Dealer-models: {len(by_model)}")
+    dealers = update_dealers(main_df)
+    build_dealer_index(dealers)
+    # KPI counts and leaderboards for the dashboard and reports (reads the cube written above)
+    update_kpi_snapshot(main_df)
+    # Posting lists over the sold record; the main record's are rebuilt only if missing (it is unchanged here)
+    if load_postings('main') is None:
+        update_main_postings(main_df)
+    update_sold_postings()
     # Monitoring sample file
     monitor_path = "state/monitoring_sample_post.csv"
     monitor_rows = []
@@ -47,8 +63,9 @@ def process_analysis(today_path, today_date, max_workers=4):
     summary_row = pd.DataFrame([{
         'section': 'summary',
         'main_record_rows': len(main_df),
-        'sold_record_rows': len(sold_record),
-        'dealers': len(summary),
+        'sold_today': len(sold_record),
+        'sold_record_rows': sold_record_rows,
+        'dealers': len(dealers),
         'dealer_models': len(by_model),
         'time_min': elapsed_min
     }])
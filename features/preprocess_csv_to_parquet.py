@@ -1,33 +1,130 @@
 import sys
 import os
-import pandas as pd
+import queue
+import shutil
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
 import sys, os
-print(sys.path)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from core.config import ESSENTIAL_COLUMNS, COLUMN_DTYPES
+from concurrent.futures import ThreadPoolExecutor
+from core.config import ESSENTIAL_COLUMNS, ARROW_BLOCK_SIZE, PARQUET_ROW_GROUP_SIZE, PARQUET_COMPRESSION, PARQUET_WRITERS
+from core.loader import iter_csv_record_batches, file_sha256
+from core.partition_store import write_manifest, staging_dir, swap_in_dir
+from core.schema import CoercionReport, arrow_schema
 
-# Usage: python features/preprocess_csv_to_parquet.py data/yourfile.csv data/yourfile.parquet
+# Usage: python features/preprocess_csv_to_parquet.py data/yourfile.csv data/yourfile.parquet [compression] [row_group_size] [writers]
+#
+# Streaming converter: the Arrow CSV reader parses on its own threads while `writers` threads each encode
+# and compress into one part file. Row groups have a fixed size and carry column statistics, so readers can
+# skip them with predicate pushdown. A _manifest.json with row counts and checksums is written last, then the
+# finished dataset replaces the previous one; the ETL verifies it (core/loader.verify_dataset_manifest)
+# before it starts.
 
-def csv_to_parquet_dataset(csv_path, dataset_dir, chunksize=100_000):
-    os.makedirs(dataset_dir, exist_ok=True)
+def part_file(k):
+    return f"part-{k:05d}.parquet"
+
+# Writer thread: drains its queue into one part file, emitting full row groups as soon as they fill up
+def write_part(path, batches, schema, row_group_size, compression):
+    rows = 0
+    pending = []
+    pending_rows = 0
+    with pq.ParquetWriter(path, schema, compression=compression, write_statistics=True) as writer:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= row_group_size:
+                table = pa.Table.from_batches(pending, schema=schema)
+                full = (pending_rows // row_group_size) * row_group_size
+                writer.write_table(table.slice(0, full), row_group_size=row_group_size)
+                rows += full
+                rest = table.slice(full)
+                pending = rest.to_batches()
+                pending_rows = rest.num_rows
+        if pending_rows:
+            writer.write_table(pa.Table.from_batches(pending, schema=schema), row_group_size=row_group_size)
+            rows += pending_rows
+    metadata = pq.ParquetFile(path).metadata
+    return {
+        'file': os.path.basename(path),
+        'rows': rows,
+        'row_groups': metadata.num_row_groups,
+        'bytes': os.path.getsize(path),
+        'sha256': file_sha256(path),
+    }
+
+# Blocking put that gives up if the writer behind the queue has died (otherwise the reader would hang)
+def put_batch(batches, item, future):
+    while True:
+        try:
+            batches.put(item, timeout=1)
+            return
+        except queue.Full:
+            if future.done():
+                future.result()
+                raise RuntimeError("Parquet writer exited early")
+
+def csv_to_parquet_dataset(csv_path, dataset_dir, compression=PARQUET_COMPRESSION, row_group_size=PARQUET_ROW_GROUP_SIZE,
+                           writers=PARQUET_WRITERS, block_size=ARROW_BLOCK_SIZE):
+    start_time = time.time()
+    tmp_dir = staging_dir(dataset_dir)
+    shutil.rmtree(tmp_dir, ignore_errors=True)  # leftovers of a failed run
+    os.makedirs(tmp_dir)
+    schema = arrow_schema(ESSENTIAL_COLUMNS)
+    report = CoercionReport()
+    # Two batches of slack per writer keeps memory bounded when encoding is slower than parsing
+    queues = [queue.Queue(maxsize=2) for _ in range(writers)]
     total_rows = 0
-    for i, chunk in enumerate(pd.read_csv(csv_path, usecols=ESSENTIAL_COLUMNS, dtype=str, chunksize=chunksize)):
-        for col, dtype in COLUMN_DTYPES.items():
-            if col in chunk.columns:
-                try:
-                    chunk[col] = chunk[col].astype(dtype)
-                except Exception:
-                    pass
-        chunk_file = os.path.join(dataset_dir, f"chunk_{i}.parquet")
-        chunk.to_parquet(chunk_file, index=False)
-        total_rows += len(chunk)
-        print(f"[Chunk {i+1}] Processed {len(chunk)} rows into {chunk_file} (Total rows so far: {total_rows})")
-    print(f"[DONE] Parquet dataset created at: {dataset_dir} | Total chunks: {i+1}, Total rows: {total_rows}")
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        futures = [
+            executor.submit(write_part, os.path.join(tmp_dir, part_file(k)), queues[k], schema, row_group_size, compression)
+            for k in range(writers)
+        ]
+        try:
+            for i, batch in enumerate(iter_csv_record_batches(csv_path, block_size=block_size, report=report)):
+                k = i % writers
+                put_batch(queues[k], batch, futures[k])
+                total_rows += batch.num_rows
+                print(f"[Batch {i+1}] Parsed {batch.num_rows} rows -> {part_file(k)} (Total rows so far: {total_rows})")
+        finally:
+            for k in range(writers):
+                if not futures[k].done():
+                    put_batch(queues[k], None, futures[k])
+        files = [f.result() for f in futures]
+    # Writers that never received a batch leave empty part files; they are dropped from the dataset
+    for entry in [f for f in files if f['rows'] == 0]:
+        os.remove(os.path.join(tmp_dir, entry['file']))
+    files = [f for f in files if f['rows'] > 0]
+    manifest = {
+        'source': os.path.abspath(csv_path),
+        'source_bytes': os.path.getsize(csv_path),
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'rows': total_rows,
+        'compression': compression,
+        'row_group_size': row_group_size,
+        'files': files,
+        'rejected': report.rejected,
+    }
+    # Renamed into place only once the manifest is written, so a conversion that fails part-way never
+    # leaves part files behind under the dataset's name
+    write_manifest(tmp_dir, manifest)
+    swap_in_dir(tmp_dir, dataset_dir)
+    elapsed = time.time() - start_time
+    print(f"[DONE] Parquet dataset created at: {dataset_dir} | Files: {len(files)}, Total rows: {total_rows}, "
+          f"Row groups: {sum(f['row_groups'] for f in files)}, Time: {elapsed:.1f}s")
+    report.log("[DONE]")
+    return manifest
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python features/preprocess_csv_to_parquet.py input.csv output_dataset_dir")
+    if len(sys.argv) < 3:
+        print("Usage: python features/preprocess_csv_to_parquet.py input.csv output_dataset_dir [zstd|snappy] [row_group_size] [writers]")
         sys.exit(1)
     csv_path = sys.argv[1]
     dataset_dir = sys.argv[2]
-    csv_to_parquet_dataset(csv_path, dataset_dir) 
\ No newline at end of file
+    compression = sys.argv[3] if len(sys.argv) >= 4 else PARQUET_COMPRESSION
+    row_group_size = int(sys.argv[4]) if len(sys.argv) >= 5 else PARQUET_ROW_GROUP_SIZE
+    writers = int(sys.argv[5]) if len(sys.argv) >= 6 else PARQUET_WRITERS
+    csv_to_parquet_dataset(csv_path, dataset_dir, compression=compression, row_group_size=row_group_size, writers=writers)